@@ -1,11 +1,28 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import (Flask, render_template, request, flash, redirect, session, g,
+                   jsonify)
 # from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 
 from forms import UserAddForm, UserEditForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message
+from models import db, connect_db, User, Message, Follows, Likes
+from pagination import CARD_PAGE_SIZE, decode_cursor, keyset_page
+from timelines import timeline_store, connect_timelines
+from viewer import liked_message_ids, follow_relationships
+from search import (user_search, message_search, connect_search,
+                    create_search_indexes, SearchPage, SearchUnavailable,
+                    SEARCH_PAGE_SIZE)
+from identity import user_cache, connect_user_cache, load_current_user
+from hashing import HashingBusy, HASHING_CONCURRENCY, connect_hasher
+from availability import availability, connect_availability
+from instrumentation import connect_instrumentation
+from metrics import connect_metrics
+from caching import connect_caching, not_modified
+from assets import AssetBuilder, Image, brotli, connect_assets
+import counters
+import migrations
+import relationships
 
 CURR_USER_KEY = "curr_user"
 
@@ -20,9 +37,29 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['TIMELINE_BACKEND'] = os.environ.get('TIMELINE_BACKEND', 'sql')
+app.config['USER_SEARCH_BACKEND'] = os.environ.get('USER_SEARCH_BACKEND', 'auto')
+app.config['MESSAGE_SEARCH_BACKEND'] = os.environ.get('MESSAGE_SEARCH_BACKEND', 'auto')
+app.config['CURRENT_USER_CACHE_TTL'] = int(os.environ.get('CURRENT_USER_CACHE_TTL', 60))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['HASHING_CONCURRENCY'] = int(os.environ.get('HASHING_CONCURRENCY', HASHING_CONCURRENCY))
+app.config['QUERY_BUDGET'] = int(os.environ.get('QUERY_BUDGET', 30))
+app.config['QUERY_REPEAT_LIMIT'] = int(os.environ.get('QUERY_REPEAT_LIMIT', 5))
+app.config['QUERY_BUDGET_RAISE'] = bool(os.environ.get('QUERY_BUDGET_RAISE'))
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['SHARED_STATE_DIR'] = os.environ.get('SHARED_STATE_DIR')
 # toolbar = DebugToolbarExtension(app)
 
+connect_metrics(app)
 connect_db(app)
+connect_timelines(app)
+connect_search(app)
+connect_user_cache(app)
+connect_hasher(app)
+connect_availability(app)
+connect_instrumentation(app)
+connect_assets(app)
+connect_caching(app, CURR_USER_KEY)
 
 
 ##############################################################################
@@ -31,10 +68,14 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    The user comes from a per-worker cache of the fields base.html needs;
+    the rest of the row is only loaded if the route uses it.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = load_current_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -69,6 +110,16 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
+        # check before paying for a bcrypt hash; the unique constraints
+        # below still catch races with other signups
+        if availability.username_taken(form.username.data):
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
+        if availability.email_taken(form.email.data):
+            flash("Email already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -77,6 +128,8 @@ def signup():
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
             db.session.commit()
+            user_search.index_user(user)
+            availability.add_user(user)
 
         except IntegrityError as e:
             flash("Username already taken", 'danger')
@@ -90,6 +143,16 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
+@app.route('/api/username-available')
+def username_available():
+    """JSON: is the 'username' in the querystring free to sign up with?"""
+
+    username = request.args.get('username', '').strip()
+
+    return jsonify(username=username,
+                   available=bool(username) and not availability.username_taken(username))
+
+
 @app.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
@@ -101,6 +164,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # authenticate may have upgraded the stored hash
+            db.session.commit()
             do_login(user)
             return redirect("/")
 
@@ -125,57 +190,122 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and a
+    'page' param for later pages of results.
     """
 
     search = request.args.get('q')
+    page_num = max(request.args.get('page', 1, type=int), 1)
 
     if not search:
-        users = User.query.all()
+        users = (User
+                 .query
+                 .order_by(User.username)
+                 .offset((page_num - 1) * SEARCH_PAGE_SIZE)
+                 .limit(SEARCH_PAGE_SIZE + 1)
+                 .all())
+        page = SearchPage(users[:SEARCH_PAGE_SIZE],
+                          page_num,
+                          len(users) > SEARCH_PAGE_SIZE)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = user_search.search(search, page=page_num)
+
+    relationships = follow_relationships(g.user, [user.id for user in page.items])
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html',
+                           users=page.items,
+                           page=page,
+                           search=search,
+                           relationships=relationships)
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
+
+    The page only changes when the user or the viewer changes (every write
+    that affects it updates one of their rows), so it's validated against
+    their updated_at stamps before doing any real work.
+    """
 
     user = User.query.get_or_404(user_id)
+
+    if g.user:
+        cached = not_modified(user.id, user.updated_at, g.user.id, g.user.updated_at,
+                              last_modified=max(user.updated_at, g.user.updated_at))
+    else:
+        cached = not_modified(user.id, user.updated_at, last_modified=user.updated_at)
+
+    if cached:
+        return cached
+
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    page = keyset_page(Message.listing('profile').filter(Message.user_id == user_id),
+                       Message.id,
+                       before=decode_cursor(request.args.get('before')))
+
+    return render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           next_cursor=page.next_cursor,
+                           liked_ids=liked_message_ids(g.user, page.items))
 
 
 @app.route('/users/<int:user_id>/following')
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show list of people this user is following.
+
+    One page of cards at a time, newest accounts first; older pages via
+    `?before=<cursor>`.
+    """
 
     if not g.user:
         flash("You must be logged in to access this page.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    following = (User
+                 .cards()
+                 .join(Follows, Follows.user_being_followed_id == User.id)
+                 .filter(Follows.user_following_id == user_id))
+    page = keyset_page(following,
+                       Follows.user_being_followed_id,
+                       before=decode_cursor(request.args.get('before')),
+                       per_page=CARD_PAGE_SIZE)
+
+    return render_template('users/following.html',
+                           user=user,
+                           users=page.items,
+                           next_cursor=page.next_cursor,
+                           relationships=follow_relationships(
+                               g.user, [card.id for card in page.items]))
 
 
 @app.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
-    """Show list of followers of this user."""
+    """Show list of followers of this user, a page of cards at a time."""
 
     if not g.user:
         flash("You must be logged in to access this page.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    followers = (User
+                 .cards()
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .filter(Follows.user_being_followed_id == user_id))
+    page = keyset_page(followers,
+                       Follows.user_following_id,
+                       before=decode_cursor(request.args.get('before')),
+                       per_page=CARD_PAGE_SIZE)
+
+    return render_template('users/followers.html',
+                           user=user,
+                           users=page.items,
+                           next_cursor=page.next_cursor,
+                           relationships=follow_relationships(
+                               g.user, [card.id for card in page.items]))
 
 
 @app.route('/users/<int:user_id>/likes')
@@ -187,15 +317,19 @@ def show_likes(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    liked_message_ids = [l.id for l in user.likes]
-    messages = (Message
-                .query
-                .filter(Message.id.in_(liked_message_ids))
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    liked = (Message
+             .listing('likes')
+             .join(Likes, Likes.message_id == Message.id)
+             .filter(Likes.user_id == user_id))
+    page = keyset_page(liked,
+                       Likes.message_id,
+                       before=decode_cursor(request.args.get('before')))
 
-    return render_template('users/likes.html', user=user, messages=messages)
+    return render_template('users/likes.html',
+                           user=user,
+                           messages=page.items,
+                           next_cursor=page.next_cursor,
+                           liked_ids=liked_message_ids(g.user, page.items))
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -206,8 +340,8 @@ def add_follow(follow_id):
         flash("You must be logged in to access this page.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    User.query.get_or_404(follow_id)
+    relationships.follow(g.user.id, follow_id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -221,8 +355,7 @@ def stop_following(follow_id):
         flash("You must be logged in to access this page.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    relationships.unfollow(g.user.id, follow_id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -236,8 +369,8 @@ def like_message(message_id):
         flash("You must be logged in to access this page.", "danger")
         return redirect("/")
 
-    liked_message = Message.query.get_or_404(message_id)
-    g.user.likes.append(liked_message)
+    Message.query.get_or_404(message_id)
+    relationships.like(g.user.id, message_id)
     db.session.commit()
 
     return redirect(request.referrer)
@@ -251,8 +384,7 @@ def unlike_message(message_id):
         flash("You must be logged in to access this page.", "danger")
         return redirect("/")
 
-    liked_message = Message.query.get_or_404(message_id)
-    g.user.likes.remove(liked_message)
+    relationships.unlike(g.user.id, message_id)
     db.session.commit()
 
     return redirect(request.referrer)
@@ -279,6 +411,9 @@ def edit_profile():
             user.header_image_url = form.header_image_url.data or "/static/images/warbler-hero.jpg"
 
             db.session.commit()
+            user_cache.invalidate(user.id)
+            user_search.index_user(user)
+            availability.add_user(user)
             return redirect(f"/users/{user.id}")
 
         flash("Wrong password, please try again.", 'danger')
@@ -296,6 +431,10 @@ def delete_user():
 
     do_logout()
 
+    timeline_store.drop_user(g.user.id)
+    counters.user_deleted(g.user)
+    user_search.remove_user(g.user.id)
+    user_cache.invalidate(g.user.id)
     db.session.delete(g.user)
     db.session.commit()
 
@@ -321,13 +460,45 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        timeline_store.publish(msg)
+        counters.adjust(g.user.id, messages=1)
         db.session.commit()
+        message_search.index_message(msg)
 
         return redirect("/")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+def messages_search():
+    """Search messages by text.
+
+    Takes 'q' (words to match), 'sort' ('recent' or 'relevant') and an
+    optional 'before' cursor from a previous page.
+    """
+
+    query = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'recent')
+
+    if query:
+        page = message_search.search(query,
+                                     sort=sort,
+                                     cursor=request.args.get('before'))
+    else:
+        page = None
+
+    messages = page.items if page else []
+
+    return render_template('messages/search.html',
+                           query=query,
+                           sort=sort,
+                           messages=messages,
+                           next_cursor=page.next_cursor if page else None,
+                           liked_ids=liked_message_ids(g.user, messages))
+
+
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
@@ -337,8 +508,11 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    timeline_store.retract(msg)
+    counters.message_deleted(msg)
     db.session.delete(msg)
     db.session.commit()
+    message_search.remove_message(message_id)
 
     return redirect(request.referrer)
 
@@ -352,21 +526,20 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, read from
+      their materialized timeline; older pages via `?before=<cursor>`
     """
 
     if g.user:
         user = g.user
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
-
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        page = timeline_store.page(user.id,
+                                   before=decode_cursor(request.args.get('before')))
 
-        return render_template('home.html', user=user, messages=messages)
+        return render_template('home.html',
+                               user=user,
+                               messages=page.items,
+                               next_cursor=page.next_cursor,
+                               liked_ids=liked_message_ids(user, page.items))
 
     else:
         return render_template('home-anon.html')
@@ -379,19 +552,101 @@ def page_not_found(e):
     return render_template('404.html'), 404
 
 
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    """Too many logins/signups are being hashed right now."""
+
+    return render_template('503.html'), 503, {'Retry-After': '1'}
+
+
+@app.errorhandler(SearchUnavailable)
+def search_unavailable(e):
+    """The message search index is still being built."""
+
+    return render_template('503.html'), 503, {'Retry-After': '5'}
+
+
+##############################################################################
+# Worker startup
+
+
+def start_warming():
+    """Start building in-memory indexes on background threads.
+
+    gunicorn.conf.py calls this as each worker boots, so no request waits
+    on a table scan; anything not started here is started on first use.
+    """
+
+    timeline_store.start_warming(app)
+    availability.start_warming(app)
+    user_search.start_warming(app)
+    message_search.start_warming(app)
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# Maintenance commands
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Recompute every materialized home timeline."""
+
+    timeline_store.rebuild_all()
+    db.session.commit()
+
+
+@app.cli.command('create-search-indexes')
+def create_search_indexes_command():
+    """Install the Postgres indexes used by user and message search."""
+
+    create_search_indexes()
+    db.session.commit()
+
+
+@app.cli.command('recount')
+def recount_stats():
+    """Repair drifted counters on every user and message."""
+
+    drifted = counters.recount()
+    db.session.commit()
+
+    print(f"Repaired counters on {drifted} user(s) and message(s).")
+
+
+@app.cli.command('migrate')
+def migrate():
+    """Apply pending schema migrations (indexes are built concurrently)."""
+
+    for migration in migrations.upgrade():
+        print(f"Applied {migration.version}: {migration.description}")
+
+
+@app.cli.command('check-indexes')
+def check_indexes():
+    """List indexes declared on the models that the database is missing."""
+
+    missing = migrations.missing_indexes()
+
+    for index in missing:
+        print(f"Missing {index.name} on {index.table} ({', '.join(index.columns)})")
+
+    if missing:
+        raise SystemExit(1)
+
+    print("All model indexes present.")
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Build fingerprinted, precompressed assets and image variants into static/dist/."""
+
+    if Image is None:
+        print("Pillow isn't installed: images are copied without variants.")
+    if brotli is None:
+        print("brotli isn't installed: only gzip versions are written.")
+
+    manifest = AssetBuilder(app.static_folder).build()
+
+    for source, built in sorted(manifest['files'].items()):
+        variants = len(manifest['variants'].get(source, []))
+        print(f"{source} -> {built}" + (f" (+{variants} variants)" if variants else ''))
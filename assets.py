@@ -0,0 +1,340 @@
+"""Static asset build pipeline.
+
+`flask build-assets` turns static/ into static/dist/:
+
+- CSS and JS are minified; `url(/static/...)` references in CSS are
+  rewritten to the built files.
+- Every output file gets a content hash in its name
+  (style.1a2b3c4d5e.css), so it can be cached forever; caching.py serves
+  static/dist/ as immutable.
+- Text files also get .gz (and, if the brotli package is installed, .br)
+  siblings, which are served with the matching Content-Encoding to clients
+  that accept it.
+- JPEG/PNG images get resized variants (IMAGE_WIDTHS) in their own format
+  and as WebP, if Pillow is installed. Each image's default file is the
+  largest variant, which already caps the full-size heroes at 1280px.
+
+static/dist/manifest.json maps each source file to what was built from it.
+Templates use `static_url()`, `asset_url()` (for /static/ URLs stored in
+the database), `srcset()` and `picture()`; they fall back to the plain
+files when no build has been run, e.g. in development.
+"""
+
+from hashlib import md5
+from io import BytesIO
+import gzip
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory
+from markupsafe import Markup, escape
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'dist'
+
+MANIFEST_FILE = 'manifest.json'
+
+# resized variants to make of each image (plus its own width, if smaller)
+IMAGE_WIDTHS = (320, 640, 1280)
+
+JPEG_QUALITY = 80
+
+WEBP_QUALITY = 75
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.ico', '.json', '.txt')
+
+CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)(/static/[^'")]+)\1\s*\)''')
+
+mimetypes.add_type('image/webp', '.webp')
+
+
+##############################################################################
+# Minifiers: conservative, whitespace-and-comments only
+
+
+def minify_css(css):
+    """Strip comments and collapsible whitespace from a stylesheet."""
+
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    """Strip indentation, blank lines and whole-line // comments from a script."""
+
+    lines = (line.strip() for line in js.splitlines())
+
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+##############################################################################
+# Building
+
+
+def _gzip(data):
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+class AssetBuilder:
+    """Builds static/dist/ and its manifest from the files in static/."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.build_folder = os.path.join(static_folder, BUILD_DIR)
+        self.files = {}
+        self.variants = {}
+
+    def sources(self):
+        """Paths (relative to static/) of every source file, dist/ excluded."""
+
+        for root, dirs, names in os.walk(self.static_folder):
+            if root == self.static_folder:
+                dirs[:] = [d for d in dirs if d != BUILD_DIR]
+            for name in sorted(names):
+                yield os.path.relpath(os.path.join(root, name), self.static_folder)
+
+    def write(self, source, data, suffix=''):
+        """Write `data` under a fingerprinted name; return its static/-relative path."""
+
+        stem, ext = os.path.splitext(source)
+        built = os.path.join(BUILD_DIR, f"{stem}{suffix}.{md5(data).hexdigest()[:10]}{ext}")
+        path = os.path.join(self.static_folder, built)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            compressed = [('.gz', _gzip(data))]
+            if brotli:
+                compressed.append(('.br', brotli.compress(data)))
+
+            for extension, smaller in compressed:
+                if len(smaller) < len(data):
+                    with open(path + extension, 'wb') as f:
+                        f.write(smaller)
+
+        return built.replace(os.sep, '/')
+
+    def build_image(self, source):
+        _, ext = os.path.splitext(source)
+        mimetype = mimetypes.guess_type(source)[0]
+
+        with Image.open(os.path.join(self.static_folder, source)) as image:
+            image.load()
+
+        widths = [width for width in IMAGE_WIDTHS if width < image.width]
+        if image.width <= IMAGE_WIDTHS[-1]:
+            widths.append(image.width)
+
+        variants = []
+        for width in widths:
+            resized = image
+            if width != image.width:
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), getattr(Image, 'Resampling', Image).LANCZOS)
+
+            for variant_type, encode in ((mimetype, self._encode_original),
+                                         ('image/webp', self._encode_webp)):
+                variant_ext = ext if variant_type == mimetype else '.webp'
+                stem = os.path.splitext(source)[0]
+                built = self.write(stem + variant_ext, encode(resized, mimetype), f".{width}w")
+                variants.append({'width': width, 'type': variant_type, 'file': built})
+
+        self.variants[source] = variants
+        self.files[source] = [v['file'] for v in variants if v['type'] == mimetype][-1]
+
+    @staticmethod
+    def _encode_original(image, mimetype):
+        out = BytesIO()
+        if mimetype == 'image/jpeg':
+            image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY,
+                                      optimize=True, progressive=True)
+        else:
+            image.save(out, 'PNG', optimize=True)
+        return out.getvalue()
+
+    @staticmethod
+    def _encode_webp(image, mimetype):
+        out = BytesIO()
+        mode = 'RGB' if mimetype == 'image/jpeg' else 'RGBA'
+        image.convert(mode).save(out, 'WEBP', quality=WEBP_QUALITY, method=6)
+        return out.getvalue()
+
+    def build_text(self, source):
+        with open(os.path.join(self.static_folder, source), encoding='UTF-8') as f:
+            text = f.read()
+
+        if source.endswith('.css'):
+            text = CSS_URL_RE.sub(self._rewrite_url, minify_css(text))
+        elif source.endswith('.js'):
+            text = minify_js(text)
+
+        self.files[source] = self.write(source, text.encode('UTF-8'))
+
+    def _rewrite_url(self, match):
+        source = match.group(2)[len('/static/'):]
+        built = self.files.get(source)
+        return f'url("/static/{built}")' if built else match.group(0)
+
+    def build_other(self, source):
+        with open(os.path.join(self.static_folder, source), 'rb') as f:
+            self.files[source] = self.write(source, f.read())
+
+    def build(self):
+        """Rebuild static/dist/ from scratch; return the manifest."""
+
+        shutil.rmtree(self.build_folder, ignore_errors=True)
+        os.makedirs(self.build_folder)
+
+        sources = list(self.sources())
+
+        # images first, so stylesheets can point at the built versions
+        for source in sources:
+            if source.lower().endswith(IMAGE_EXTENSIONS) and Image is not None:
+                self.build_image(source)
+            elif source.endswith(('.css', '.js')):
+                continue
+            else:
+                self.build_other(source)
+
+        for source in sources:
+            if source.endswith(('.css', '.js')):
+                self.build_text(source)
+
+        manifest = {'files': self.files, 'variants': self.variants}
+
+        with open(os.path.join(self.build_folder, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        return manifest
+
+
+##############################################################################
+# Using the build
+
+
+class Manifest:
+    """Lookups into static/dist/manifest.json (empty if there's no build)."""
+
+    def __init__(self):
+        self.files = {}
+        self.variants = {}
+
+    def load(self, static_folder):
+        try:
+            with open(os.path.join(static_folder, BUILD_DIR, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+
+        self.files = manifest.get('files', {})
+        self.variants = manifest.get('variants', {})
+
+    def built_url(self, filename):
+        """The built URL for static file `filename`, or None if it wasn't built."""
+
+        built = self.files.get(filename)
+        return f"/static/{built}" if built else None
+
+
+assets = Manifest()
+
+
+def _static_filename(url):
+    if url and url.startswith('/static/'):
+        return url[len('/static/'):]
+    return None
+
+
+def asset_url(url):
+    """Map a /static/ URL (e.g. one stored in the database) to its built file."""
+
+    return assets.built_url(_static_filename(url)) or url
+
+
+def srcset(url, mimetype=None):
+    """A `srcset` value listing every width built of the image at `url`.
+
+    `mimetype` picks the format (e.g. 'image/webp'); by default, the
+    image's own. Empty if the image has no built variants.
+    """
+
+    variants = assets.variants.get(_static_filename(url), [])
+    mimetype = mimetype or mimetypes.guess_type(url or '')[0]
+
+    return ', '.join(f"/static/{v['file']} {v['width']}w"
+                     for v in variants if v['type'] == mimetype)
+
+
+def picture(url, alt='', class_=None, sizes='100vw'):
+    """A <picture> serving WebP where supported, or a plain <img> if unbuilt."""
+
+    img_attrs = f'src="{escape(asset_url(url))}" alt="{escape(alt)}"'
+    if class_:
+        img_attrs += f' class="{escape(class_)}"'
+
+    webp = srcset(url, 'image/webp')
+    if not webp:
+        return Markup(f"<img {img_attrs}>")
+
+    return Markup(f'<picture>'
+                  f'<source type="image/webp" srcset="{webp}" sizes="{escape(sizes)}">'
+                  f'<img {img_attrs} srcset="{srcset(url)}" sizes="{escape(sizes)}">'
+                  f'</picture>')
+
+
+def connect_assets(app):
+    """Use the last `flask build-assets` output (if any) in `app`."""
+
+    assets.load(app.static_folder)
+
+    app.jinja_env.globals.update(asset_url=asset_url, srcset=srcset, picture=picture)
+
+    send_static = app.view_functions['static']
+
+    def static(filename):
+        """Serve static files, precompressed when the client accepts it."""
+
+        if not filename.startswith(BUILD_DIR + '/'):
+            return send_static(filename=filename)
+
+        mimetype = mimetypes.guess_type(filename)[0]
+
+        for encoding, extension in (('br', '.br'), ('gzip', '.gz')):
+            compressed = os.path.join(app.static_folder, filename + extension)
+            if request.accept_encodings[encoding] and os.path.isfile(compressed):
+                resp = send_from_directory(app.static_folder, filename + extension,
+                                           mimetype=mimetype)
+                resp.headers['Content-Encoding'] = encoding
+                break
+        else:
+            resp = send_static(filename=filename)
+
+        if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+            resp.vary.add('Accept-Encoding')
+
+        return resp
+
+    app.view_functions['static'] = static
@@ -0,0 +1,240 @@
+"""Cheap "is this username/email taken?" checks.
+
+Signup used to find out a username was taken only after paying for a
+bcrypt hash and a failed INSERT. Now it asks first: a Bloom filter of every
+taken username and email answers "definitely free" from memory, and only a
+"maybe taken" costs an indexed EXISTS query.
+
+A "definitely free" is only true if every taken name is in the filter, so:
+
+- With SHARED_STATE_DIR set, the filter is a file there that every worker
+  on the host adds to (see workers.py); otherwise it's in this process.
+- Every signup/rename is added, whether or not the filter is filled yet,
+  and the filter never needs resizing: it's sized up front for
+  AVAILABILITY_FILTER_CAPACITY names.
+- It's filled from the users table once, on a background thread, and
+  until that's done every check goes to the database.
+"""
+
+from hashlib import blake2b
+from threading import Lock
+import math
+import os
+
+from flask import current_app
+
+from models import db, User
+from metrics import CACHE_LOOKUPS
+from workers import SharedFile, claim, release, run_in_background
+
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+# names (two per user) before the false positive rate starts to climb;
+# about 1.2MB of filter at 1%
+BLOOM_CAPACITY = 1000000
+
+# names added per hold of the filter's lock while filling it
+FILL_BATCH = 1000
+
+
+def _dimensions(capacity, error_rate):
+    """(bits, hash functions) for a Bloom filter of `capacity` items."""
+
+    size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    return size, max(1, round(size / capacity * math.log(2)))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, in this process.
+
+    `ready` says whether it has been filled; until then, that an item isn't
+    in it proves nothing.
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_FALSE_POSITIVE_RATE):
+        self.size, self.num_hashes = _dimensions(capacity, error_rate)
+        self._bits = bytearray((self.size + 7) // 8)
+        self._ready = False
+        self._warming = False
+        self._lock = Lock()
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def claim(self):
+        """Is it the caller's job to fill the filter? (True at most once.)"""
+
+        with self._lock:
+            if self._ready or self._warming:
+                return False
+            self._warming = True
+            return True
+
+    def release(self):
+        with self._lock:
+            self._warming = False
+
+    def mark_ready(self):
+        with self._lock:
+            self._ready = True
+            self._warming = False
+
+    def _positions(self, item):
+        digest = blake2b(item.encode('UTF-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return [(h1 + i * h2) % self.size for i in range(self.num_hashes)]
+
+    def add_all(self, items):
+        with self._lock:
+            for item in items:
+                for pos in self._positions(item):
+                    self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def add(self, item):
+        self.add_all([item])
+
+    def __contains__(self, item):
+        # bits are only ever set, so this needs no lock
+        return all(self._bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+class SharedBloomFilter(BloomFilter):
+    """A BloomFilter in a file under `directory`, shared by every worker.
+
+    The file is an 8-byte header, whose first byte is the ready flag,
+    followed by the bits.
+    """
+
+    HEADER_SIZE = 8
+
+    def __init__(self, directory, capacity, error_rate=BLOOM_FALSE_POSITIVE_RATE):
+        self.size, self.num_hashes = _dimensions(capacity, error_rate)
+        self._file = SharedFile(os.path.join(directory, 'availability.bloom'),
+                                self.HEADER_SIZE + (self.size + 7) // 8)
+        self._claim = os.path.join(directory, 'availability.warming')
+
+    @property
+    def ready(self):
+        with self._file.locked() as data:
+            return data[0] == 1
+
+    def claim(self):
+        """Is it the caller's job to fill the filter? (True for one process.)"""
+
+        return claim(self._claim)
+
+    def release(self):
+        release(self._claim)
+
+    def mark_ready(self):
+        with self._file.locked() as data:
+            data[0] = 1
+
+    def add_all(self, items):
+        with self._file.locked() as data:
+            for item in items:
+                for pos in self._positions(item):
+                    data[self.HEADER_SIZE + (pos >> 3)] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        with self._file.locked() as data:
+            return all(data[self.HEADER_SIZE + (pos >> 3)] & (1 << (pos & 7))
+                       for pos in self._positions(item))
+
+
+class AvailabilityChecker:
+    """Answers whether usernames/emails are free, hitting the DB only when unsure."""
+
+    def __init__(self, capacity=BLOOM_CAPACITY):
+        self.capacity = capacity
+        self._filter = BloomFilter(capacity)
+
+    def init_app(self, app):
+        """Size and place the filter from app.config."""
+
+        self.capacity = app.config.setdefault('AVAILABILITY_FILTER_CAPACITY', BLOOM_CAPACITY)
+        directory = app.config.setdefault('SHARED_STATE_DIR', None)
+
+        self._filter = (SharedBloomFilter(directory, self.capacity) if directory
+                        else BloomFilter(self.capacity))
+
+    def warm(self):
+        """Add every username and email in the database, then trust the filter."""
+
+        batch = []
+
+        for username, email in db.session.query(User.username, User.email).yield_per(1000):
+            batch.extend((f"username:{username}", f"email:{email}"))
+            if len(batch) >= FILL_BATCH:
+                self._filter.add_all(batch)
+                batch = []
+
+        self._filter.add_all(batch)
+        self._filter.mark_ready()
+
+    def start_warming(self, app):
+        """Fill the filter on a background thread, unless that's already been done."""
+
+        if self._filter.claim():
+            run_in_background(app, self._warm_claimed, 'availability-filter')
+
+    def _warm_claimed(self):
+        try:
+            self.warm()
+        except Exception:
+            # let the next check try again
+            self._filter.release()
+            raise
+
+    def _maybe_taken(self, key):
+        if not self._filter.ready:
+            self.start_warming(current_app._get_current_object())
+            maybe = True
+        else:
+            maybe = key in self._filter
+
+        # a "hit" is a question the filter answered without the database
+        CACHE_LOOKUPS.inc(cache='availability', result='miss' if maybe else 'hit')
+
+        return maybe
+
+    def username_taken(self, username):
+        """Is `username` already in use?"""
+
+        if not self._maybe_taken(f"username:{username}"):
+            return False
+
+        query = User.query.filter(User.username == username)
+        return db.session.query(query.exists()).scalar()
+
+    def email_taken(self, email):
+        """Is `email` already in use?"""
+
+        if not self._maybe_taken(f"email:{email}"):
+            return False
+
+        query = User.query.filter(User.email == email)
+        return db.session.query(query.exists()).scalar()
+
+    def add_user(self, user):
+        """Record `user`'s username and email as taken."""
+
+        self._filter.add_all([f"username:{user.username}", f"email:{user.email}"])
+
+    def reset(self):
+        """Start again with an empty, unfilled filter in this process."""
+
+        self._filter = BloomFilter(self.capacity)
+
+
+availability = AvailabilityChecker()
+
+
+def connect_availability(app):
+    """Configure the availability filter from app.config."""
+
+    availability.init_app(app)
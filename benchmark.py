@@ -0,0 +1,436 @@
+"""Load test for Warbler: replay a realistic traffic mix and measure latency.
+
+Seeds a dedicated database at a chosen scale (using generator/create_csvs.py
+and the COPY loader), then runs virtual users that each log in and make a
+weighted mix of requests: home timeline, profiles, follow/unfollow,
+like/unlike, posting and user/message search. Reports p50/p95/p99 latency
+and requests/sec per route, and saves them as JSON so runs from different
+commits can be compared:
+
+    createdb warbler-bench
+    python benchmark.py --users 2000 --messages 50000 --follows 100000 \\
+        --requests 5000 --output before.json
+    ... make changes ...
+    python benchmark.py --skip-seed --requests 5000 --output after.json \\
+        --compare before.json
+
+By default requests go through Flask's WSGI test client in this process. To
+include a real server, start one against the same database, e.g.
+
+    DATABASE_URL=postgresql:///warbler-bench gunicorn -w 4 app:app
+
+and pass `--url http://127.0.0.1:8000`. Every seeded user's password is
+"password".
+"""
+
+from array import array
+from collections import defaultdict
+from datetime import datetime
+from http.cookiejar import CookieJar
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+BENCHMARK_DATABASE_URL = 'postgresql:///warbler-bench'
+
+# likes seeded per message when --likes isn't given, the ratio generator/ uses
+LIKES_PER_MESSAGE = 2
+
+# relative weights of each kind of request in the traffic mix
+TRAFFIC_MIX = {
+    'home': 40,
+    'profile': 20,
+    'like': 10,
+    'follow': 5,
+    'post': 5,
+    'search_users': 10,
+    'search_messages': 10,
+}
+
+SEED_PASSWORD = 'password'
+
+CSRF_TOKEN_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+##############################################################################
+# Clients: the same small interface over the WSGI test client or real HTTP
+
+
+class WSGIClient:
+    """Requests straight into the Flask app, logged in as `user_id`."""
+
+    def __init__(self, app, user_id):
+        from app import CURR_USER_KEY
+
+        self.client = app.test_client()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def request(self, method, path, data=None):
+        resp = self.client.open(path, method=method, data=data,
+                                headers={'Referer': '/'})
+        return resp.status_code
+
+    def csrf_token(self):
+        # the benchmark app has CSRF checks turned off
+        return ''
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """Requests to a running server at `base_url`, logged in as `username`."""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect())
+
+        self.request('POST', '/login', {'username': username,
+                                        'password': SEED_PASSWORD,
+                                        'csrf_token': self._token('/login')})
+        self._csrf = self._token('/messages/new')
+
+    def _open(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode('UTF-8') if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                     headers={'Referer': self.base_url + '/'})
+        try:
+            with self.opener.open(req) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def _token(self, path):
+        _, body = self._open('GET', path)
+        match = CSRF_TOKEN_RE.search(body.decode('UTF-8'))
+        return match.group(1) if match else ''
+
+    def request(self, method, path, data=None):
+        return self._open(method, path, data)[0]
+
+    def csrf_token(self):
+        return self._csrf
+
+
+##############################################################################
+# Virtual users
+
+
+class Dataset:
+    """What a virtual user needs to know about the seeded data."""
+
+    def __init__(self):
+        from models import db, User, Message, Follows, Likes
+
+        self.user_ids = [id for (id,) in db.session.query(User.id)]
+        self.usernames = dict(db.session.query(User.id, User.username))
+        # ids are time-ordered, not 1..N, so keep them (8 bytes each) to pick from
+        self.message_ids = array('q', (id for (id,) in db.session.query(Message.id)))
+        self.following = defaultdict(set)
+        self.likes = defaultdict(set)
+
+        for follower, followed in db.session.query(Follows.user_following_id,
+                                                   Follows.user_being_followed_id):
+            self.following[follower].add(followed)
+
+        for user_id, message_id in db.session.query(Likes.user_id, Likes.message_id):
+            self.likes[user_id].add(message_id)
+
+        texts = db.session.query(Message.text).limit(500)
+        self.words = sorted({word.strip('.,').lower()
+                             for (text,) in texts for word in text.split()
+                             if len(word) > 3}) or ['warble']
+
+        db.session.remove()
+
+
+class VirtualUser:
+    """One logged-in user making a weighted random mix of requests."""
+
+    def __init__(self, client, user_id, dataset, rng):
+        self.client = client
+        self.user_id = user_id
+        self.data = dataset
+        self.rng = rng
+        self.following = set(dataset.following[user_id])
+        self.likes = set(dataset.likes[user_id])
+
+    def home(self):
+        return self.client.request('GET', '/')
+
+    def profile(self):
+        return self.client.request('GET', f"/users/{self.rng.choice(self.data.user_ids)}")
+
+    def follow(self):
+        other = self.rng.choice(self.data.user_ids)
+
+        if other in self.following:
+            self.following.discard(other)
+            return self.client.request('POST', f"/users/stop-following/{other}")
+
+        self.following.add(other)
+        return self.client.request('POST', f"/users/follow/{other}")
+
+    def like(self):
+        if not self.data.message_ids:
+            return self.home()
+
+        message_id = self.rng.choice(self.data.message_ids)
+
+        if message_id in self.likes:
+            self.likes.discard(message_id)
+            return self.client.request('POST', f"/users/remove_like/{message_id}")
+
+        self.likes.add(message_id)
+        return self.client.request('POST', f"/users/add_like/{message_id}")
+
+    def post(self):
+        text = ' '.join(self.rng.choices(self.data.words, k=8)).capitalize()
+        return self.client.request('POST', '/messages/new',
+                                   {'text': text, 'csrf_token': self.client.csrf_token()})
+
+    def search_users(self):
+        prefix = self.data.usernames[self.rng.choice(self.data.user_ids)][:3]
+        return self.client.request('GET', f"/users?q={urllib.parse.quote(prefix)}")
+
+    def search_messages(self):
+        word = self.rng.choice(self.data.words)
+        return self.client.request('GET', f"/messages/search?q={urllib.parse.quote(word)}")
+
+    def step(self):
+        """Make one request; return (route, seconds, status)."""
+
+        route = self.rng.choices(list(TRAFFIC_MIX), weights=list(TRAFFIC_MIX.values()))[0]
+
+        start = time.perf_counter()
+        status = getattr(self, route)()
+
+        return route, time.perf_counter() - start, status
+
+
+##############################################################################
+# Seeding, running and reporting
+
+
+def seed_database(args):
+    """Generate CSVs at the requested scale and load them into the database."""
+
+    from models import db
+    from loader import load_seed_data
+    from timelines import timeline_store
+    from search import create_search_indexes
+    import counters
+    import migrations
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable,
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     'generator', 'create_csvs.py'),
+                        '--users', str(args.users),
+                        '--messages', str(args.messages),
+                        '--follows', str(args.follows),
+                        '--likes', str(args.likes),
+                        '--seed', str(args.seed),
+                        '--output', directory],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        db.drop_all()
+        db.create_all()
+        migrations.stamp()
+        db.session.commit()
+
+        for stats in load_seed_data(directory):
+            print(stats)
+
+    timeline_store.rebuild_all()
+    counters.recount()
+    create_search_indexes()
+    db.session.commit()
+
+
+def percentile(sorted_values, p):
+    """The `p`th percentile (nearest rank) of already-sorted values."""
+
+    if not sorted_values:
+        return None
+
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples, elapsed):
+    """Latency (ms) and throughput stats for a list of (seconds, status)."""
+
+    latencies = sorted(seconds * 1000 for seconds, _ in samples)
+
+    return {
+        'requests': len(samples),
+        'errors': sum(status >= 500 for _, status in samples),
+        'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+    }
+
+
+def run(make_client, dataset, args):
+    """Run `args.concurrency` virtual users until `args.requests` are made."""
+
+    samples = []
+    lock = threading.Lock()
+    remaining = [args.warmup + args.requests]
+    started = [None]
+
+    def worker(n):
+        rng = random.Random(f"{args.seed}:{n}")
+        user_id = rng.choice(dataset.user_ids)
+        vu = VirtualUser(make_client(user_id), user_id, dataset, rng)
+
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+                warming_up = remaining[0] >= args.requests
+                if not warming_up and started[0] is None:
+                    started[0] = time.perf_counter()
+
+            route, seconds, status = vu.step()
+
+            if not warming_up:
+                with lock:
+                    samples.append((route, seconds, status))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - (started[0] or time.perf_counter())
+
+    by_route = defaultdict(list)
+    for route, seconds, status in samples:
+        by_route[route].append((seconds, status))
+
+    return {
+        'routes': {route: summarize(by_route[route], elapsed) for route in sorted(by_route)},
+        'total': summarize([(seconds, status) for _, seconds, status in samples], elapsed),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    """Print a per-route table, with % change against `baseline` if given."""
+
+    print(f"{'route':<16}{'reqs':>7}{'errs':>6}{'rps':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    rows = list(results['routes'].items()) + [('total', results['total'])]
+
+    for route, stats in rows:
+        line = (f"{route:<16}{stats['requests']:>7}{stats['errors']:>6}{stats['rps']:>10.1f}"
+                f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+        before = (baseline['total'] if route == 'total'
+                  else baseline['routes'].get(route)) if baseline else None
+        if before and before['p95_ms']:
+            change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+            line += f"   p95 {change:+.1f}%"
+
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', default=os.environ.get('BENCHMARK_DATABASE_URL',
+                                                             BENCHMARK_DATABASE_URL))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=30000)
+    parser.add_argument('--likes', type=int,
+                        help="(default: %d per message)" % LIKES_PER_MESSAGE)
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the data already in the database")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100,
+                        help="requests made (and not measured) before timing starts")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--url', help="benchmark a running server instead of the test client")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+
+    args = parser.parse_args()
+    if args.likes is None:
+        args.likes = LIKES_PER_MESSAGE * args.messages
+
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # app.py connects to DATABASE_URL when imported
+    os.environ['DATABASE_URL'] = args.database
+    from app import app
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        if not args.skip_seed:
+            seed_database(args)
+        dataset = Dataset()
+
+    if args.url:
+        def make_client(user_id):
+            return HTTPClient(args.url, dataset.usernames[user_id])
+    else:
+        def make_client(user_id):
+            return WSGIClient(app, user_id)
+
+    results = run(make_client, dataset, args)
+    results.update(commit=git_commit(),
+                   date=datetime.utcnow().isoformat(),
+                   dataset={'users': len(dataset.user_ids),
+                            'messages': len(dataset.message_ids)},
+                   config={key: value for key, value in vars(args).items()
+                           if key not in ('output', 'compare')})
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
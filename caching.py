@@ -0,0 +1,145 @@
+"""HTTP caching policy for Warbler.
+
+Replaces the old blanket `no-cache, no-store` with headers that fit each
+kind of response:
+
+- Static files linked through `static_url()` carry a content hash in their
+  URL (the fingerprinted name from `flask build-assets`, see assets.py, or
+  `?v=...` without a build), so the browser may keep them forever: a
+  changed file gets a new URL. A `?v=` that isn't the file's current hash
+  (a stale or made-up link) doesn't count. Other static files (images
+  referenced from the database or CSS) are cached for STATIC_MAX_AGE
+  seconds and then revalidated with the ETag Flask already sends for them.
+- Pages are cached privately when someone is logged in (they contain that
+  user's nav, like buttons...), and always vary on the session cookie.
+- Pages that call `not_modified()` get an ETag and Last-Modified built from
+  cheap version stamps, and a 304 with no body when the browser's copy is
+  still current.
+"""
+
+from functools import lru_cache
+from hashlib import md5, sha1
+import os
+
+from flask import Response, g, request, session
+from werkzeug.http import is_resource_modified
+
+from assets import BUILD_DIR, assets
+
+STATIC_MAX_AGE = 60 * 60
+
+FINGERPRINT_MAX_AGE = 60 * 60 * 24 * 365
+
+_static_folder = None
+_build_stamp = ''
+
+
+@lru_cache(maxsize=None)
+def _file_hash(path, mtime):
+    with open(path, 'rb') as f:
+        return md5(f.read()).hexdigest()[:12]
+
+
+def asset_version(filename):
+    """A short hash of the contents of static file `filename`."""
+
+    path = os.path.join(_static_folder, filename)
+    return _file_hash(path, os.path.getmtime(path))
+
+
+def is_current_version(filename, version):
+    """Is `version` the current `asset_version()` of static file `filename`?"""
+
+    try:
+        return version == asset_version(filename)
+    except OSError:
+        return False
+
+
+def static_url(filename):
+    """URL for static file `filename` that changes whenever the file does."""
+
+    return assets.built_url(filename) or f"/static/{filename}?v={asset_version(filename)}"
+
+
+def templates_stamp(folder):
+    """Identify this version of the templates, the same in every worker."""
+
+    stamps = sorted((os.path.relpath(os.path.join(root, name), folder),
+                     os.path.getmtime(os.path.join(root, name)))
+                    for root, _, names in os.walk(folder) for name in names)
+
+    return sha1(repr(stamps).encode('UTF-8')).hexdigest()[:12]
+
+
+def not_modified(*stamps, last_modified=None):
+    """Validate this response against cheap version stamps of what it shows.
+
+    Returns a 304 response if the browser's copy (by ETag or Last-Modified)
+    is current, or None if the page has to be rendered; the validators are
+    then added to that response. Pages showing flashed messages are never
+    validated, since those aren't part of the stamps.
+    """
+
+    if '_flashes' in session:
+        return None
+
+    key = repr((_build_stamp, request.full_path) + stamps)
+    etag = sha1(key.encode('UTF-8')).hexdigest()
+
+    g.cache_validators = (etag, last_modified)
+
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+
+    return Response(status=304)
+
+
+def connect_caching(app, session_key):
+    """Apply the caching policy to `app`'s responses.
+
+    `session_key` is the session entry that marks someone as logged in.
+    """
+
+    global _static_folder, _build_stamp
+
+    _static_folder = app.static_folder
+    _build_stamp = templates_stamp(os.path.join(app.root_path, app.template_folder))
+
+    app.config.setdefault('STATIC_MAX_AGE', STATIC_MAX_AGE)
+    app.jinja_env.globals['static_url'] = static_url
+
+    @app.after_request
+    def set_cache_headers(resp):
+        """Add Cache-Control (and validators) to every response."""
+
+        if request.endpoint == 'static':
+            filename = request.view_args['filename']
+            fingerprinted = (filename.startswith(BUILD_DIR + '/')
+                             or is_current_version(filename, request.args.get('v')))
+            if fingerprinted and resp.status_code == 200:
+                resp.cache_control.public = True
+                resp.cache_control.max_age = FINGERPRINT_MAX_AGE
+                # Werkzeug 0.14's ResponseCacheControl has no `immutable`
+                resp.headers['Cache-Control'] += ', immutable'
+            else:
+                resp.cache_control.public = True
+                resp.cache_control.max_age = app.config['STATIC_MAX_AGE']
+            return resp
+
+        validators = g.pop('cache_validators', None)
+        if validators:
+            etag, last_modified = validators
+            resp.set_etag(etag)
+            if last_modified is not None:
+                resp.last_modified = last_modified
+
+        # a response that's about to set the session cookie mustn't be shared
+        if session_key in session or session.modified:
+            resp.cache_control.private = True
+        else:
+            resp.cache_control.public = True
+        resp.cache_control.no_cache = True
+        resp.vary.add('Cookie')
+
+        return resp
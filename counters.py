@@ -0,0 +1,140 @@
+"""Denormalized stat counters.
+
+The profile header shows how many messages, follows, followers and likes a
+user has, and message lists show how many likes each message has. Rather than loading each collection to count it, those numbers
+live on the users row and are adjusted in the same transaction as the
+write that changes them. `recount()` rebuilds them from scratch if they
+ever drift.
+"""
+
+from models import db, utcnow, User, Message, Follows, Likes
+
+COUNTER_COLUMNS = {
+    'messages': User.messages_count,
+    'following': User.following_count,
+    'followers': User.followers_count,
+    'likes': User.likes_count,
+}
+
+
+def adjust(user_id, **deltas):
+    """Atomically add `deltas` (e.g. followers=1) to `user_id`'s counters."""
+
+    adjust_many(User.id == user_id, **deltas)
+
+
+def adjust_many(criterion, **deltas):
+    """Atomically add `deltas` to the counters of every user matching `criterion`."""
+
+    values = {COUNTER_COLUMNS[name]: COUNTER_COLUMNS[name] + delta
+              for name, delta in deltas.items()}
+
+    User.query.filter(criterion).update(values, synchronize_session=False)
+
+
+def adjust_like_counts(criterion, delta):
+    """Atomically add `delta` to the like count of every message matching `criterion`.
+
+    Their authors are touched too: profile pages show the counts, and are
+    validated against the author's `updated_at` (see users_show).
+    """
+
+    (Message
+     .query
+     .filter(criterion)
+     .update({Message.like_count: Message.like_count + delta},
+             synchronize_session=False))
+
+    authors = db.session.query(Message.user_id).filter(criterion)
+
+    (User
+     .query
+     .filter(User.id.in_(authors.subquery()))
+     .update({User.updated_at: utcnow()},
+             synchronize_session=False))
+
+
+def message_deleted(message):
+    """Update counters for `message` and the likes cascading away with it."""
+
+    adjust(message.user_id, messages=-1)
+
+    likers = (db.session
+              .query(Likes.user_id)
+              .filter(Likes.message_id == message.id))
+    adjust_many(User.id.in_(likers.subquery()), likes=-1)
+
+
+def user_deleted(user):
+    """Update other users' counters for the rows cascading away with `user`."""
+
+    followed = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == user.id))
+    adjust_many(User.id.in_(followed.subquery()), followers=-1)
+
+    followers = (db.session
+                 .query(Follows.user_following_id)
+                 .filter(Follows.user_being_followed_id == user.id))
+    adjust_many(User.id.in_(followers.subquery()), following=-1)
+
+    liked = (db.session
+             .query(Likes.message_id)
+             .filter(Likes.user_id == user.id))
+    adjust_like_counts(Message.id.in_(liked.subquery()), -1)
+
+    # a liker may have liked several of this user's messages
+    liked_here = (db.select([db.func.count()])
+                  .select_from(Likes.__table__.join(Message.__table__))
+                  .where(Likes.user_id == User.id)
+                  .where(Message.user_id == user.id)
+                  .as_scalar())
+    likers = (db.session
+              .query(Likes.user_id)
+              .join(Message, Message.id == Likes.message_id)
+              .filter(Message.user_id == user.id))
+
+    (User
+     .query
+     .filter(User.id.in_(likers.subquery()))
+     .update({User.likes_count: User.likes_count - liked_here},
+             synchronize_session=False))
+
+
+def recount():
+    """Recompute every user's and message's counters from the underlying tables.
+
+    Returns the number of users and messages whose stored counts had drifted.
+    """
+
+    actual = {
+        'messages': (db.select([db.func.count()])
+                     .where(Message.user_id == User.id)),
+        'following': (db.select([db.func.count()])
+                      .where(Follows.user_following_id == User.id)),
+        'followers': (db.select([db.func.count()])
+                      .where(Follows.user_being_followed_id == User.id)),
+        'likes': (db.select([db.func.count()])
+                  .where(Likes.user_id == User.id)),
+    }
+
+    actual = {name: query.as_scalar() for name, query in actual.items()}
+
+    drifted = db.or_(*[COUNTER_COLUMNS[name] != actual[name] for name in actual])
+
+    users = (User
+             .query
+             .filter(drifted)
+             .update({COUNTER_COLUMNS[name]: actual[name] for name in actual},
+                     synchronize_session=False))
+
+    likes = (db.select([db.func.count()])
+             .where(Likes.message_id == Message.id)
+             .as_scalar())
+
+    messages = (Message
+                .query
+                .filter(Message.like_count != likes)
+                .update({Message.like_count: likes}, synchronize_session=False))
+
+    return users + messages
@@ -2,29 +2,69 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. a production-sized
+dataset for load testing:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --likes 30000000 --output /tmp/warbler-big
+
+Output is deterministic for a given --seed (and independent of --workers):
+rows are generated in fixed-size blocks, each with its own seeded RNG, and
+blocks are spread over a process pool and written back in order. Nothing
+holds more than one block in memory and nothing touches the network.
+
+Activity is skewed the way real social data is: a few users post, follow and
+like far more than the rest, and a few users/messages attract most of the
+follows/likes (power-law distributions; see helpers.py).
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+from datetime import datetime
+from io import StringIO
+from multiprocessing import Pool
+import os
+import random
+import sys
+import time
+
 from faker import Faker
-from helpers import get_random_datetime
+
+from helpers import (spread_datetime, zipf_rank, harmonic, coprime_multiplier,
+                     scatter, skewed_count, distinct_targets)
+
+# ids.py lives in the app, one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ids import snowflake
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 2000
+
+# bcrypt hash of "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# users (or messages, for messages.csv) per block; each block has its own RNG
+BLOCK_SIZE = 10000
 
-fake = Faker()
+# power-law exponents: how lopsided posting, following and liking are
+POSTING_SKEW = 1.0
+FOLLOWING_SKEW = 0.8
+FOLLOWED_SKEW = 1.0
+LIKING_SKEW = 0.8
+LIKED_SKEW = 1.0
 
-# Generate random profile image URLs to use for users
+VOCABULARY_SIZE = 2000
+
+# Random profile image URLs to use for users
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +72,193 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header images are served by the app itself, so generating needs no network
 
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    "/static/images/warbler-hero.jpg",
+    "/static/images/warbler-hero2.jpg",
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+_fake = None
+_vocabulary = None
+
+
+def faker():
+    """This process's Faker, and a fixed vocabulary for message text."""
+
+    global _fake, _vocabulary
+
+    if _fake is None:
+        _fake = Faker()
+        _fake.seed_instance(0)
+        _vocabulary = sorted({_fake.word() for _ in range(VOCABULARY_SIZE)})
+
+    return _fake
+
+
+def sentence(rng, max_length=MAX_WARBLER_LENGTH):
+    words = rng.choices(_vocabulary, k=rng.randint(4, 20))
+
+    return (' '.join(words).capitalize() + '.')[:max_length]
+
+
+def block_rng(args, kind, start):
+    return random.Random(f"{args.seed}:{kind}:{start}")
+
+
+##############################################################################
+# One function per CSV: each writes the rows for ids start..end-1 and
+# returns (csv text, number of rows).
+
+
+def users_block(args, start, end):
+    fake = faker()
+    rng = block_rng(args, 'users', start)
+    fake.seed_instance(f"{args.seed}:users:{start}")
+
+    out = StringIO()
+    writer = csv.writer(out)
+
+    for user_id in range(start, end):
+        username = f"{fake.user_name()}{user_id}"
+        writer.writerow([user_id,
+                         f"{username}@{fake.free_email_domain()}",
+                         username,
+                         rng.choice(image_urls),
+                         PASSWORD_HASH,
+                         sentence(rng),
+                         rng.choice(header_image_urls),
+                         fake.city()])
+
+    return out.getvalue(), end - start
+
+
+def message_timestamp(args, n):
+    """When the `n`th message was posted; messages are numbered oldest first."""
+
+    return spread_datetime(n, args.messages, args.start, args.end)
+
+
+def message_id(args, n):
+    """The `n`th message's time-ordered id (see ids.py)."""
+
+    return snowflake(message_timestamp(args, n), n)
+
+
+def messages_block(args, start, end):
+    faker()
+    rng = block_rng(args, 'messages', start)
+    authors = coprime_multiplier(args.users, 1)
+
+    out = StringIO()
+    writer = csv.writer(out)
+
+    for i in range(start, end):
+        writer.writerow([message_id(args, i),
+                         sentence(rng),
+                         message_timestamp(args, i),
+                         scatter(zipf_rank(rng, args.users, POSTING_SKEW), args.users, authors)])
+
+    return out.getvalue(), end - start
+
+
+def follows_block(args, start, end):
+    rng = block_rng(args, 'follows', start)
+    n = args.users
+    norm = harmonic(n, FOLLOWING_SKEW)
+    activity = coprime_multiplier(n, 2)
+    popularity = coprime_multiplier(n, 3)
+
+    out = StringIO()
+    writer = csv.writer(out)
+    rows = 0
+
+    for follower in range(start, end):
+        count = skewed_count(rng, scatter(follower, n, activity), args.follows,
+                             n, FOLLOWING_SKEW, norm, cap=(n - 1) // 2)
+        for followed in distinct_targets(rng, count, n, FOLLOWED_SKEW, popularity,
+                                         exclude=follower):
+            writer.writerow([followed, follower])
+        rows += count
+
+    return out.getvalue(), rows
+
+
+def likes_block(args, start, end):
+    rng = block_rng(args, 'likes', start)
+    n = args.users
+    norm = harmonic(n, LIKING_SKEW)
+    activity = coprime_multiplier(n, 4)
+    popularity = coprime_multiplier(args.messages, 5)
+
+    out = StringIO()
+    writer = csv.writer(out)
+    rows = 0
+
+    for liker in range(start, end):
+        count = skewed_count(rng, scatter(liker, n, activity), args.likes,
+                             n, LIKING_SKEW, norm, cap=args.messages // 2)
+        for liked in distinct_targets(rng, count, args.messages, LIKED_SKEW, popularity):
+            writer.writerow([liker, message_id(args, liked)])
+        rows += count
+
+    return out.getvalue(), rows
+
+
+def run_block(task):
+    block, args, start, end = task
+    return block(args, start, end)
+
+
+def write_csv(pool, args, filename, headers, block, num_ids):
+    """Generate `filename` block by block (ids 1..num_ids) and write it in order."""
+
+    started = time.perf_counter()
+    tasks = [(block, args, start, min(start + BLOCK_SIZE, num_ids + 1))
+             for start in range(1, num_ids + 1, BLOCK_SIZE)]
+    rows = 0
+
+    with open(os.path.join(args.output, filename), 'w', newline='') as f:
+        csv.writer(f).writerow(headers)
+
+        for text, count in pool.imap(run_block, tasks):
+            f.write(text)
+            rows += count
+
+    elapsed = time.perf_counter() - started
+    print(f"{filename}: {rows} rows in {elapsed:.1f}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS,
+                        help="approximate; heavy followers are capped at half the users")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES,
+                        help="approximate; heavy likers are capped at half the messages")
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--start', type=datetime.fromisoformat, default=datetime(2019, 1, 1),
+                        help="earliest message timestamp (YYYY-MM-DD)")
+    parser.add_argument('--end', type=datetime.fromisoformat, default=datetime(2021, 1, 1),
+                        help="latest message timestamp (YYYY-MM-DD)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory to write the CSVs to (default: generator/)")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.output, exist_ok=True)
+
+    with Pool(args.workers) as pool:
+        write_csv(pool, args, 'users.csv', USERS_CSV_HEADERS, users_block, args.users)
+        write_csv(pool, args, 'messages.csv', MESSAGES_CSV_HEADERS, messages_block, args.messages)
+        write_csv(pool, args, 'follows.csv', FOLLOWS_CSV_HEADERS, follows_block, args.users)
+        write_csv(pool, args, 'likes.csv', LIKES_CSV_HEADERS, likes_block, args.users)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,102 @@
-"""Support functions for CSV generation."""
+"""Support functions for CSV generation.
 
-from datetime import datetime
-from random import uniform
+Everything here takes an explicit `random.Random` so output is reproducible
+from a seed, and nothing needs memory proportional to the number of users.
+"""
 
+from datetime import timedelta
+from functools import lru_cache
+from math import gcd
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+def spread_datetime(i, n, start, end):
+    """The `i`th (1..n) of `n` datetimes spread over `start`..`end`, in order.
 
-    return datetime.fromtimestamp(random_timestamp)
+    Each gets a pseudo-random offset within its own slot, so the result is
+    a pure function of `i`: ids derived from it can be recomputed anywhere.
+    """
+
+    jitter = (i * 2654435761) % 2 ** 32 / 2 ** 32
+    slot = (end - start).total_seconds() / n
+
+    return start + timedelta(seconds=slot * (i - 1 + jitter))
+
+
+def zipf_rank(rng, n, skew):
+    """Pick a rank in 1..n where rank r is roughly r**-skew times as likely as rank 1.
+
+    Uses the inverse CDF of the continuous power law, so it's O(1) with no
+    tables, however large `n` is.
+    """
+
+    u = rng.random()
+
+    if skew == 1:
+        x = (n + 1) ** u
+    else:
+        x = (((n + 1) ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+
+    return min(n, int(x))
+
+
+@lru_cache()
+def harmonic(n, skew):
+    """Sum of r**-skew for r in 1..n (the zipf normalizing constant)."""
+
+    return sum(r ** -skew for r in range(1, n + 1))
+
+
+def coprime_multiplier(n, salt):
+    """A multiplier coprime to `n`, so `scatter(..., multiplier)` is a bijection."""
+
+    multiplier = (salt * 2654435761) % n or 1
+
+    while gcd(multiplier, n) != 1:
+        multiplier += 1
+
+    return multiplier
+
+
+def scatter(rank, n, multiplier):
+    """Map rank 1..n to an id 1..n, one to one.
+
+    Used so the most popular/active users aren't simply the lowest ids.
+    """
+
+    return rank * multiplier % n + 1
+
+
+def skewed_count(rng, rank, total, n, skew, norm, cap):
+    """How many of `total` items the actor with activity `rank` (of `n`) gets.
+
+    Expected counts follow a power law; the fractional part is rounded at
+    random so the grand total comes out close to `total`.
+    """
+
+    expected = total * rank ** -skew / norm
+    count = int(expected) + (rng.random() < expected % 1)
+
+    return min(count, cap)
+
+
+def distinct_targets(rng, count, n, skew, multiplier, exclude=None):
+    """Pick `count` distinct ids in 1..n, popular ones (by zipf rank) first.
+
+    Falls back to uniform picks if the popular end is exhausted.
+    """
+
+    chosen = set()
+    attempts = count * 10 + 100
+
+    while len(chosen) < count and attempts:
+        target = scatter(zipf_rank(rng, n, skew), n, multiplier)
+        if target != exclude:
+            chosen.add(target)
+        attempts -= 1
+
+    while len(chosen) < count:
+        target = rng.randint(1, n)
+        if target != exclude:
+            chosen.add(target)
+
+    return sorted(chosen)
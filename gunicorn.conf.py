@@ -0,0 +1,39 @@
+"""gunicorn settings (read automatically by `gunicorn app:app`).
+
+Workers are threaded. bcrypt (see hashing.py) and database calls release
+the GIL, so while one thread waits on them the worker's other threads keep
+serving. At most half of the host's threads may be hashing at once.
+
+Workers share /metrics totals through files in METRICS_DIR (see
+metrics.py), and in-memory indexes through files in SHARED_STATE_DIR (see
+workers.py); both directories are emptied each time the server starts, so
+nothing from a previous run is read back. With --preload the app is
+imported before this hook runs, so set both in the environment.
+"""
+
+import os
+import shutil
+import tempfile
+
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# read by app.py; set here so it's in place even with --preload
+os.environ.setdefault('HASHING_CONCURRENCY',
+                      str(max(1, min(os.cpu_count() or 1, workers * threads // 2))))
+
+
+def on_starting(server):
+    for name, default in (('METRICS_DIR', 'warbler-metrics'),
+                          ('SHARED_STATE_DIR', 'warbler-shared')):
+        directory = os.environ.setdefault(name, os.path.join(tempfile.gettempdir(), default))
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def post_worker_init(worker):
+    from app import start_warming
+
+    start_warming()
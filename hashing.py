@@ -0,0 +1,124 @@
+"""Password hashing for Warbler.
+
+bcrypt is deliberately slow: each hash keeps a CPU core busy for a few
+hundred milliseconds. It runs on the request's own thread, and bcrypt
+releases the GIL meanwhile, so under gunicorn's threaded workers (see
+gunicorn.conf.py) the worker's other threads keep serving.
+
+Only HASHING_CONCURRENCY hashes run at once on a host, so logins can never
+occupy every thread. The limit is a semaphore shared by every worker on
+the host (see workers.py; with no SHARED_STATE_DIR it's per process).
+
+A request that finds every slot in use fails fast with `HashingBusy` (a
+503) rather than waiting in a queue. A queued login holds its thread just
+as a running one does, so a queue would only let logins take over the
+threads the limit keeps free.
+
+The work factor comes from BCRYPT_LOG_ROUNDS. Stored hashes made with a
+different cost still verify, and `needs_rehash()` tells login to upgrade
+(or downgrade) them to the current cost.
+"""
+
+import os
+
+import bcrypt
+
+from metrics import BCRYPT_SECONDS
+from workers import LocalSemaphore, SharedSemaphore
+
+BCRYPT_LOG_ROUNDS = 12
+
+# hashes allowed to run at once on a host; gunicorn.conf.py sets this
+# below the host's thread count
+HASHING_CONCURRENCY = os.cpu_count() or 2
+
+# bcrypt only looks at the first 72 bytes of a password
+BCRYPT_MAX_BYTES = 72
+
+
+class HashingBusy(Exception):
+    """Too many password hashes are already running; try again shortly."""
+
+
+def _encode(password):
+    return password.encode('UTF-8')[:BCRYPT_MAX_BYTES]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(hashed, password):
+    try:
+        return bcrypt.checkpw(_encode(password), hashed.encode('UTF-8'))
+    except ValueError:
+        # not a bcrypt hash at all
+        return False
+
+
+def hash_rounds(hashed):
+    """Return the cost factor a bcrypt hash was made with (None if unknown)."""
+
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Runs bcrypt a limited number at a time, rejecting work when saturated."""
+
+    def __init__(self,
+                 rounds=BCRYPT_LOG_ROUNDS,
+                 concurrency=HASHING_CONCURRENCY,
+                 directory=None):
+        self.configure(rounds, concurrency, directory)
+
+    def configure(self, rounds, concurrency, directory=None):
+        """Set the work factor, and how many hashes may run at once.
+
+        With `directory`, the limit is shared with every process using it.
+        """
+
+        self.rounds = rounds
+        self._slots = (SharedSemaphore(directory, 'hashing', concurrency) if directory
+                       else LocalSemaphore(concurrency))
+
+    def init_app(self, app):
+        """Set the work factor and concurrency from app.config."""
+
+        self.configure(app.config.setdefault('BCRYPT_LOG_ROUNDS', BCRYPT_LOG_ROUNDS),
+                       app.config.setdefault('HASHING_CONCURRENCY', HASHING_CONCURRENCY),
+                       app.config.setdefault('SHARED_STATE_DIR', None))
+
+    def _run(self, operation, fn, *args):
+        with self._slots.slot() as acquired:
+            if not acquired:
+                raise HashingBusy()
+
+            with BCRYPT_SECONDS.time(operation=operation):
+                return fn(*args)
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost."""
+
+        return self._run('hash', _hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match the stored hash `hashed`?"""
+
+        return self._run('check', _check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different cost than we use now?"""
+
+        return hash_rounds(hashed) != self.rounds
+
+
+password_hasher = PasswordHasher()
+
+
+def connect_hasher(app):
+    """Configure the password hasher from app.config."""
+
+    password_hasher.init_app(app)
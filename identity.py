@@ -0,0 +1,105 @@
+"""Per-worker cache of who the logged-in user is.
+
+`add_user_to_g` used to load the full users row on every request, even for
+redirects and 404s. Instead, each worker keeps a small TTL cache of just
+the fields base.html renders (id, username, image_url). `g.user` is built
+from that snapshot and attached to the session without a query; any other
+attribute (bio, counters, relationships...) is loaded from the database the
+first time a route touches it.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+from metrics import CACHE_LOOKUPS
+
+SNAPSHOT_FIELDS = ('id', 'username', 'image_url')
+
+CURRENT_USER_CACHE_TTL = 60
+
+CURRENT_USER_CACHE_SIZE = 10000
+
+
+class UserCache:
+    """Bounded, thread-safe LRU of user id -> (expiry, snapshot dict)."""
+
+    def __init__(self, ttl=CURRENT_USER_CACHE_TTL, max_size=CURRENT_USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id):
+        """Return the cached snapshot for `user_id`, or None if missing/stale."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[user_id]
+                entry = None
+
+            if entry is None:
+                CACHE_LOOKUPS.inc(cache='current_user', result='miss')
+                return None
+
+            CACHE_LOOKUPS.inc(cache='current_user', result='hit')
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user_id, snapshot):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Forget `user_id` (call after editing or deleting them)."""
+
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+def connect_user_cache(app):
+    """Configure the current-user cache from app.config."""
+
+    user_cache.ttl = app.config.setdefault('CURRENT_USER_CACHE_TTL',
+                                           CURRENT_USER_CACHE_TTL)
+    user_cache.clear()
+
+
+def load_current_user(user_id):
+    """Return a session-attached User for `user_id`, or None if there isn't one.
+
+    On a cache hit this costs no query. Only the snapshot fields are
+    populated; the rest of the row is marked expired and loads on access.
+    """
+
+    snapshot = user_cache.get(user_id)
+
+    if snapshot is None:
+        row = (db.session
+               .query(*[getattr(User, field) for field in SNAPSHOT_FIELDS])
+               .filter(User.id == user_id)
+               .first())
+        if row is None:
+            return None
+
+        snapshot = dict(zip(SNAPSHOT_FIELDS, row))
+        user_cache.set(user_id, snapshot)
+
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+
+    return db.session.merge(user, load=False)
@@ -0,0 +1,84 @@
+"""Time-ordered ("snowflake") message ids.
+
+A message id is its timestamp in milliseconds since EPOCH, shifted left
+SEQUENCE_BITS, with the low bits taken from a database sequence:
+
+    | 41 bits: ms since 2010-01-01 | 22 bits: message_id_sequence |
+
+so sorting by id sorts by time, and newest-first pages, cursors and
+timelines can run on the primary key alone. Ids are assigned in Postgres
+by a BEFORE INSERT trigger (from the row's `timestamp`, which itself
+defaults to the server's clock), so every worker on every host draws from
+the same sequence and no two ids can collide unless one millisecond sees
+more than 4 million messages.
+
+`snowflake()` computes the same layout in Python, for data generated
+outside the database (see generator/), and `next_snowflake()` assigns ids
+on databases without the trigger (SQLite).
+"""
+
+from datetime import datetime, timedelta
+from itertools import count
+
+EPOCH = datetime(2010, 1, 1)
+
+SEQUENCE_BITS = 22
+
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+
+ONE_MS = timedelta(milliseconds=1)
+
+EPOCH_MS = (EPOCH - datetime(1970, 1, 1)) // ONE_MS
+
+# installed with the messages table (see models.py) and by migrations 8 and 12
+ID_FUNCTIONS = f"""
+CREATE SEQUENCE IF NOT EXISTS message_id_sequence;
+
+CREATE OR REPLACE FUNCTION snowflake_id(ts TIMESTAMP) RETURNS BIGINT AS $$
+    SELECT ((floor(extract(epoch FROM ts) * 1000)::BIGINT - {EPOCH_MS}) << {SEQUENCE_BITS})
+           | (nextval('message_id_sequence') & {SEQUENCE_MASK})
+$$ LANGUAGE sql VOLATILE;
+
+CREATE OR REPLACE FUNCTION assign_message_id() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.id := coalesce(NEW.id, snowflake_id(NEW.timestamp));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+ID_TRIGGER = """
+DROP TRIGGER IF EXISTS messages_assign_id ON messages;
+
+CREATE TRIGGER messages_assign_id BEFORE INSERT ON messages
+    FOR EACH ROW EXECUTE PROCEDURE assign_message_id();
+"""
+
+
+def snowflake(timestamp, sequence=0):
+    """The id for a message posted at (naive UTC) `timestamp`."""
+
+    ms = (timestamp - EPOCH) // ONE_MS
+
+    return (ms << SEQUENCE_BITS) | (sequence & SEQUENCE_MASK)
+
+
+# low bits for ids assigned in this process
+_sequence = count()
+
+
+def next_snowflake(timestamp):
+    """A new id for a message posted at `timestamp`, without the trigger.
+
+    The sequence bits are drawn in this process, so these ids are only
+    unique within one process - fine for SQLite in development and tests.
+    """
+
+    return snowflake(timestamp, next(_sequence))
+
+
+def snowflake_timestamp(id):
+    """When the message with `id` was posted, to the millisecond."""
+
+    return EPOCH + (id >> SEQUENCE_BITS) * ONE_MS
+
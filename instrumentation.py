@@ -0,0 +1,141 @@
+"""Per-request SQL instrumentation and N+1 detection.
+
+Every SQL statement run while handling a request is counted and timed by
+hooking SQLAlchemy's engine events. After the request we check two things:
+
+* the total number of statements against QUERY_BUDGET, and
+* how often the same statement shape (the SQL with its bind parameters,
+  so `... WHERE users.id = %(param_1)s` is one shape whatever the id) was
+  repeated, against QUERY_REPEAT_LIMIT. Repeats are the signature of an
+  N+1: a lazy load or helper query inside a loop over results.
+
+Either one logs a warning, or raises `QueryBudgetExceeded` when
+QUERY_BUDGET_RAISE is set (turn it on in tests). Outside production the
+numbers are also sent back as X-Query-Count, X-Query-Time-Ms and
+X-Query-Max-Repeats response headers (QUERY_STATS_HEADERS).
+"""
+
+from collections import Counter
+import re
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_BUDGET = 30
+
+QUERY_REPEAT_LIMIT = 5
+
+# `IN (%(a_1)s, %(a_2)s, ...)` is one shape however many values it has
+IN_LIST_RE = re.compile(r'\(\s*%\(\w+\)s(?:\s*,\s*%\(\w+\)s)*\s*\)')
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran too many SQL statements, or repeated one too often."""
+
+
+def statement_shape(statement):
+    """Normalize `statement` so executions of the same query compare equal."""
+
+    return IN_LIST_RE.sub('(...)', WHITESPACE_RE.sub(' ', statement)).strip()
+
+
+class QueryStats:
+    """SQL statements run during one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, limit):
+        """Return (shape, times) for each statement run more than `limit` times."""
+
+        return [(shape, times) for shape, times in self.shapes.most_common()
+                if times > limit]
+
+    @property
+    def max_repeats(self):
+        return max(self.shapes.values(), default=0)
+
+
+def current_stats():
+    """The QueryStats for the request being handled, or None."""
+
+    if not has_request_context():
+        return None
+
+    return g.get('query_stats')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start_times'].pop()
+    stats = current_stats()
+
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def check_budget(app, stats):
+    """Warn (or raise) if `stats` exceeds the app's query budget or repeat limit."""
+
+    problems = []
+    budget = app.config['QUERY_BUDGET']
+
+    if stats.count > budget:
+        problems.append(f"{stats.count} queries (budget {budget})")
+
+    for shape, times in stats.repeated(app.config['QUERY_REPEAT_LIMIT']):
+        problems.append(f"repeated {times} times: {shape}")
+
+    if not problems:
+        return
+
+    message = f"{request.method} {request.full_path.rstrip('?')}: " + '; '.join(problems)
+
+    if app.config['QUERY_BUDGET_RAISE']:
+        raise QueryBudgetExceeded(message)
+
+    app.logger.warning(message)
+
+
+def connect_instrumentation(app):
+    """Count and check the SQL run by each of `app`'s requests."""
+
+    app.config.setdefault('QUERY_BUDGET', QUERY_BUDGET)
+    app.config.setdefault('QUERY_REPEAT_LIMIT', QUERY_REPEAT_LIMIT)
+    app.config.setdefault('QUERY_BUDGET_RAISE', False)
+    app.config.setdefault('QUERY_STATS_HEADERS', app.env != 'production')
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def finish_query_stats(resp):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return resp
+
+        if app.config['QUERY_STATS_HEADERS']:
+            resp.headers['X-Query-Count'] = str(stats.count)
+            resp.headers['X-Query-Time-Ms'] = f"{stats.seconds * 1000:.2f}"
+            resp.headers['X-Query-Max-Repeats'] = str(stats.max_repeats)
+
+        check_budget(app, stats)
+
+        return resp
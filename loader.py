@@ -0,0 +1,167 @@
+"""Bulk loading of CSV data (the files in generator/) into the database.
+
+`bulk_insert_mappings` builds an ORM mapping per row and sends batched
+INSERTs, which is fine for the sample data but far too slow for the
+tens-of-millions-of-rows datasets we load into staging. Instead, each CSV is
+streamed straight from disk into Postgres with `COPY ... FROM STDIN`; on
+other databases (SQLite) rows go in with batched `executemany`.
+
+Secondary indexes on the tables being loaded are dropped first and rebuilt
+once at the end (one sort per index beats millions of incremental inserts),
+and `id` sequences are moved past the loaded rows so later INSERTs don't
+collide with them. Everything happens in one transaction, so a failed load
+leaves the database (and its indexes) as they were.
+"""
+
+from collections import namedtuple
+import csv
+import os
+import time
+
+from models import db
+
+# rows per executemany() call when COPY isn't available
+LOAD_BATCH_SIZE = 10000
+
+# CSV files in generator/, in foreign key order
+SEED_FILES = (('users', 'users.csv'),
+              ('messages', 'messages.csv'),
+              ('follows', 'follows.csv'),
+              ('likes', 'likes.csv'))
+
+
+class LoadStats(namedtuple('LoadStats', ['table', 'rows', 'seconds'])):
+    """How many rows were loaded into `table`, and how long it took."""
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+    def __str__(self):
+        return (f"{self.table}: {self.rows} rows in {self.seconds:.2f}s "
+                f"({self.rows_per_sec:,.0f} rows/sec)")
+
+
+def _csv_columns(conn, table, path):
+    """Return the (quoted) column names from the header of `path`."""
+
+    with open(path, newline='') as f:
+        header = next(csv.reader(f))
+
+    known = {col.name for col in db.metadata.tables[table].columns}
+    unknown = [name for name in header if name not in known]
+    if unknown:
+        raise ValueError(f"{path}: no such column(s) in {table}: {', '.join(unknown)}")
+
+    quote = conn.dialect.identifier_preparer.quote
+    return [quote(name) for name in header]
+
+
+def _copy_csv(conn, table, path):
+    columns = _csv_columns(conn, table, path)
+    cursor = conn.connection.cursor()
+
+    with open(path, newline='') as f:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) "
+                           "FROM STDIN WITH (FORMAT csv, HEADER true)", f)
+
+    return cursor.rowcount
+
+
+def _insert_csv(conn, table, path, batch_size=LOAD_BATCH_SIZE):
+    columns = _csv_columns(conn, table, path)
+    placeholder = '?' if conn.dialect.paramstyle == 'qmark' else '%s'
+    sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+           f"VALUES ({', '.join([placeholder] * len(columns))})")
+    cursor = conn.connection.cursor()
+    rows = 0
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+
+        batch = []
+        for row in reader:
+            # match COPY, which reads unquoted empty fields as NULL
+            batch.append([value if value != '' else None for value in row])
+            if len(batch) == batch_size:
+                cursor.executemany(sql, batch)
+                rows += len(batch)
+                batch = []
+
+        if batch:
+            cursor.executemany(sql, batch)
+            rows += len(batch)
+
+    return rows
+
+
+def drop_indexes(conn, table):
+    """Drop `table`'s secondary indexes, returning the SQL to recreate them.
+
+    Indexes that back a primary key or unique constraint are kept.
+    """
+
+    if conn.dialect.name == 'postgresql':
+        indexes = conn.execute(db.text(
+            "SELECT indexname, indexdef FROM pg_indexes "
+            "WHERE schemaname = current_schema() AND tablename = :table "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint)"), table=table).fetchall()
+    else:
+        indexes = conn.execute(db.text(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"),
+            table=table).fetchall()
+
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {conn.dialect.identifier_preparer.quote(name)}")
+
+    return [definition for _, definition in indexes]
+
+
+def reset_sequence(conn, table):
+    """Point `table`'s id sequence past the largest id in it (Postgres only)."""
+
+    if conn.dialect.name != 'postgresql' or 'id' not in db.metadata.tables[table].columns:
+        return
+
+    conn.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                 f"COALESCE(MAX(id), 0) + 1, false) FROM {table}")
+
+
+def load_csvs(files, directory='.'):
+    """Load each (table, filename) in `files` and return a LoadStats for each.
+
+    The last entry is the total for the whole load, including rebuilding
+    indexes and committing.
+    """
+
+    stats = []
+    started = time.perf_counter()
+
+    with db.engine.begin() as conn:
+        load = _copy_csv if conn.dialect.name == 'postgresql' else _insert_csv
+        tables = [table for table, _ in files]
+        rebuild = [sql for table in tables for sql in drop_indexes(conn, table)]
+
+        for table, filename in files:
+            start = time.perf_counter()
+            rows = load(conn, table, os.path.join(directory, filename))
+            stats.append(LoadStats(table, rows, time.perf_counter() - start))
+
+        for sql in rebuild:
+            conn.execute(sql)
+
+        for table in tables:
+            reset_sequence(conn, table)
+
+    stats.append(LoadStats('total', sum(s.rows for s in stats),
+                           time.perf_counter() - started))
+
+    return stats
+
+
+def load_seed_data(directory='generator'):
+    """Load the generator/ CSVs (users, messages, follows, likes)."""
+
+    return load_csvs(SEED_FILES, directory)
@@ -0,0 +1,378 @@
+"""Prometheus-style operational metrics, shared across gunicorn workers.
+
+Counters and histograms are recorded wherever the work happens (requests,
+DB pool checkouts, bcrypt, template rendering, caches) and exposed in the
+Prometheus text format at /metrics.
+
+With several gunicorn workers, whichever worker answers a scrape only knows
+its own numbers. So when METRICS_DIR is set, each process keeps its values
+in its own memory-mapped file in that directory (writes are just stores
+into shared memory), and /metrics sums the files of every process. Values
+are monotonic counts and sums, so adding them up across workers - including
+workers that have since exited - gives the correct totals. The directory
+must be emptied when the server (re)starts; gunicorn.conf.py does that.
+
+Without METRICS_DIR (development, tests) values just live in this process.
+"""
+
+from collections import OrderedDict, defaultdict
+from threading import Lock
+import glob
+import mmap
+import os
+import struct
+import time
+
+from flask import Response, g, request, template_rendered, before_render_template
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 2.5, 5.0, 7.5, 10.0, float('inf'))
+
+# pool waits are usually tiny; bucket them finer
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+                     1.0, 5.0, float('inf'))
+
+METRICS_FILE_SIZE = 1024 * 64
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+##############################################################################
+# Storage: one value per sample key, e.g. 'requests_total{method="GET"}'
+
+
+class MemoryStore:
+    """Sample values kept in this process."""
+
+    def __init__(self):
+        self._values = defaultdict(float)
+        self._lock = Lock()
+
+    def add(self, key, amount):
+        with self._lock:
+            self._values[key] += amount
+
+    def totals(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class MmapStore:
+    """Sample values in a per-process memory-mapped file under `directory`.
+
+    File layout: an 8-byte header holding the number of bytes in use, then
+    entries of (4-byte key length, key padded to 8 bytes, 8-byte double).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = Lock()
+        self._pid = None
+
+    def _open(self):
+        """(Re)open this process's file; a forked worker gets its own."""
+
+        self._pid = os.getpid()
+        self._path = os.path.join(self.directory, f"metrics_{self._pid}.db")
+        self._offsets = {}
+
+        with open(self._path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                f.truncate(METRICS_FILE_SIZE)
+
+        self._file = open(self._path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        for key, _, offset in _read_entries(self._map):
+            self._offsets[key] = offset
+
+        if _used(self._map) == 0:
+            struct.pack_into('q', self._map, 0, 8)
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _offset(self, key):
+        offset = self._offsets.get(key)
+        if offset is not None:
+            return offset
+
+        encoded = key.encode('UTF-8')
+        padded = len(encoded) + (-(4 + len(encoded)) % 8)
+        used = _used(self._map)
+        end = used + 4 + padded + 8
+
+        if end > len(self._map):
+            self._grow(end)
+
+        struct.pack_into(f'i{padded}sd', self._map, used, len(encoded), encoded, 0.0)
+        struct.pack_into('q', self._map, 0, end)
+
+        self._offsets[key] = end - 8
+        return end - 8
+
+    def add(self, key, amount):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+
+            offset = self._offset(key)
+            value, = struct.unpack_from('d', self._map, offset)
+            struct.pack_into('d', self._map, offset, value + amount)
+
+    def totals(self):
+        """Sum every process's file."""
+
+        totals = defaultdict(float)
+
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.db')):
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            for key, value, _ in _read_entries(data):
+                totals[key] += value
+
+        return dict(totals)
+
+
+def _used(data):
+    return struct.unpack_from('q', data, 0)[0]
+
+
+def _read_entries(data):
+    """Yield (key, value, value offset) for each entry in a metrics file."""
+
+    if len(data) < 8:
+        return
+
+    pos = 8
+    used = min(_used(data), len(data))
+
+    while pos + 4 <= used:
+        length, = struct.unpack_from('i', data, pos)
+        padded = length + (-(4 + length) % 8)
+        key = bytes(data[pos + 4:pos + 4 + length]).decode('UTF-8')
+        offset = pos + 4 + padded
+        value, = struct.unpack_from('d', data, offset)
+
+        yield key, value, offset
+        pos = offset + 8
+
+
+##############################################################################
+# Metric types
+
+
+def _sample_key(name, labels):
+    if not labels:
+        return name
+
+    pairs = ','.join(f'{label}="{_escape(value)}"' for label, value in labels)
+    return f"{name}{{{pairs}}}"
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Counter:
+    """A count that only goes up, optionally split by labels."""
+
+    type = 'counter'
+
+    def __init__(self, registry, name, description):
+        self.registry = registry
+        self.name = name
+        self.description = description
+
+    def inc(self, amount=1, **labels):
+        self.registry.store.add(_sample_key(self.name, sorted(labels.items())), amount)
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, plus their count and sum."""
+
+    type = 'histogram'
+
+    def __init__(self, registry, name, description, buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        labels = sorted(labels.items())
+        add = self.registry.store.add
+
+        # every bucket is written (if only with 0) so each series lists them all
+        for bound in self.buckets:
+            add(_sample_key(f"{self.name}_bucket", labels + [('le', _format(bound))]),
+                1 if value <= bound else 0)
+
+        add(_sample_key(f"{self.name}_count", labels), 1)
+        add(_sample_key(f"{self.name}_sum", labels), value)
+
+    def time(self, **labels):
+        """Context manager observing the seconds its block takes."""
+
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def _format(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Registry:
+    """All metrics, and where their values are stored."""
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.store = MemoryStore()
+
+    def counter(self, name, description):
+        return self.metrics.setdefault(name, Counter(self, name, description))
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(self, name, description, buckets))
+
+    def use_directory(self, directory):
+        """Share values with other processes through files in `directory`."""
+
+        os.makedirs(directory, exist_ok=True)
+        self.store = MmapStore(directory)
+
+    def exposition(self):
+        """Every metric in the Prometheus text format."""
+
+        totals = self.store.totals()
+        lines = []
+
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric.type}")
+
+            series = {name} if metric.type == 'counter' else {
+                f"{name}_bucket", f"{name}_count", f"{name}_sum"}
+            samples = [key for key in totals if key.partition('{')[0] in series]
+
+            for key in sorted(samples, key=_sample_order):
+                lines.append(f"{key} {totals[key]!r}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _sample_order(key):
+    """Group each series' samples together, buckets in ascending `le` order."""
+
+    name, _, labels = key.partition('{')
+    labels, _, bound = labels.rstrip('}').partition('le="')
+    labels = labels.rstrip(',')
+    bound = float(bound.rstrip('"').replace('+Inf', 'inf')) if bound else 0.0
+
+    return (labels, name, bound)
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    'warbler_http_requests_total', "HTTP requests by route, method and status.")
+REQUEST_SECONDS = registry.histogram(
+    'warbler_http_request_duration_seconds', "Time to handle a request, by route.")
+POOL_WAIT_SECONDS = registry.histogram(
+    'warbler_db_pool_checkout_wait_seconds', "Time spent waiting for a database connection.",
+    POOL_WAIT_BUCKETS)
+BCRYPT_SECONDS = registry.histogram(
+    'warbler_bcrypt_duration_seconds', "Time to hash or check a password, including queueing.")
+TEMPLATE_SECONDS = registry.histogram(
+    'warbler_template_render_duration_seconds', "Time to render a template.")
+CACHE_LOOKUPS = registry.counter(
+    'warbler_cache_lookups_total', "Cache lookups by cache and result (hit or miss).")
+
+
+##############################################################################
+# Hooks
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def connect_metrics(app):
+    """Record request, pool and template metrics for `app` and serve /metrics.
+
+    Call before anything uses the database, so the engine gets the timed pool.
+    """
+
+    directory = app.config.setdefault('METRICS_DIR', None)
+    if directory:
+        registry.use_directory(directory)
+
+    # applied by models.SQLAlchemy, as the pinned Flask-SQLAlchemy ignores it;
+    # SQLite keeps the pools SQLAlchemy picks for it, which don't queue
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'sqlite':
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        options.setdefault('poolclass', TimedQueuePool)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(resp):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = _route()
+            REQUESTS.inc(route=route, method=request.method, status=resp.status_code)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+
+        return resp
+
+    def start_template_timer(sender, template, context, **extra):
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+    def record_template(sender, template, context, **extra):
+        started = g.get('template_started')
+        if started:
+            TEMPLATE_SECONDS.observe(time.perf_counter() - started.pop(),
+                                     template=template.name)
+
+    before_render_template.connect(start_template_timer, app, weak=False)
+    template_rendered.connect(record_template, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        """Operational metrics in the Prometheus text format."""
+
+        return Response(registry.exposition(), content_type=CONTENT_TYPE)
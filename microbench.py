@@ -0,0 +1,216 @@
+"""Micro-benchmarks for Warbler's hot model helpers, with scaling thresholds.
+
+Each helper is timed against fixture graphs of increasing size: one
+"subject" user who follows N users, is followed by the same N users, likes N
+messages and has a home timeline built from N followed users' messages.
+From the timings at each size we fit how the cost grows with N (the slope
+of log(time) against log(N): ~0 for an index lookup, ~1 for a scan) and
+fail if any helper grows faster than its threshold in MAX_SCALING.
+
+    createdb warbler-bench
+    python microbench.py                     # 100 -> 100k relations
+    python microbench.py --sizes 100,1000 --output micro.json
+
+Exits with status 1 if any threshold is exceeded. This drops all data in
+the target database (warbler-bench by default).
+"""
+
+from collections import namedtuple
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+from benchmark import BENCHMARK_DATABASE_URL
+
+SIZES = (100, 1000, 10000, 100000)
+
+# largest acceptable growth exponent for each helper: time ~ N ** exponent
+MAX_SCALING = {
+    'is_following': 0.25,
+    'is_followed_by': 0.25,
+    'likes_message': 0.25,
+    'authenticate': 0.25,
+    'home_timeline': 0.25,
+    # looks at one ring head per followed author before merging
+    'ring_timeline': 0.5,
+}
+
+# cheapest bcrypt cost, so authenticate measures the lookup rather than the hash
+BENCHMARK_BCRYPT_ROUNDS = 4
+
+SUBJECT_PASSWORD = 'password'
+
+# keep repeating an operation until it has run this long (or MAX_REPEATS times)
+MIN_SECONDS = 0.2
+MIN_REPEATS = 5
+MAX_REPEATS = 500
+
+Result = namedtuple('Result', ['name', 'timings', 'exponent', 'limit'])
+
+
+def build_fixture(n):
+    """Replace all data with a graph of N relations around user 1."""
+
+    from models import db
+    from hashing import password_hasher
+    from timelines import timeline_store
+
+    db.session.execute("TRUNCATE users, messages, follows, likes, timeline_entries "
+                       "RESTART IDENTITY CASCADE")
+
+    db.session.execute(db.text(
+        "INSERT INTO users (username, email, password) "
+        "SELECT 'user' || g, 'user' || g || '@bench.test', :password "
+        "FROM generate_series(1, :n + 1) g"),
+        {'password': password_hasher.hash(SUBJECT_PASSWORD), 'n': n})
+
+    # user 1 follows, is followed by, and likes a message from everyone else
+    db.session.execute(db.text(
+        "INSERT INTO messages (text, timestamp, user_id) "
+        "SELECT 'message ' || g, now() - g * interval '1 minute', g "
+        "FROM generate_series(2, :n + 1) g"), {'n': n})
+    db.session.execute(db.text(
+        "INSERT INTO follows (user_being_followed_id, user_following_id) "
+        "SELECT g, 1 FROM generate_series(2, :n + 1) g "
+        "UNION ALL SELECT 1, g FROM generate_series(2, :n + 1) g"), {'n': n})
+    db.session.execute("INSERT INTO likes (user_id, message_id) SELECT 1, id FROM messages")
+
+    timeline_store.rebuild(1)
+    db.session.commit()
+
+    db.session.execute("ANALYZE")
+    db.session.commit()
+
+
+def operations(n):
+    """The helpers to time, as name -> zero-argument callable."""
+
+    from models import db, User, Message
+    from timelines import timeline_store, AuthorRingTimelineBackend
+
+    # a relation in the middle of the graph, so ordering can't help
+    other_id = n // 2 + 1
+    message_id = db.session.query(Message.id).filter(Message.user_id == other_id).scalar()
+
+    rings = AuthorRingTimelineBackend()
+    rings.warm()
+
+    def fresh(user_id):
+        # start each call from an empty session, so nothing is cached
+        db.session.expire_all()
+        return User.query.get(user_id)
+
+    return {
+        'is_following': lambda: fresh(1).is_following(fresh(other_id)),
+        'is_followed_by': lambda: fresh(1).is_followed_by(fresh(other_id)),
+        'likes_message': lambda: fresh(1).likes_message(message_id),
+        'authenticate': lambda: User.authenticate('user1', SUBJECT_PASSWORD),
+        'home_timeline': lambda: timeline_store.page(1).items,
+        'ring_timeline': lambda: rings.page(1).items,
+    }
+
+
+def time_call(fn):
+    """Median seconds per call of `fn`, after one warm-up call."""
+
+    fn()
+    timings = []
+    deadline = time.perf_counter() + MIN_SECONDS
+
+    while (len(timings) < MIN_REPEATS
+           or (time.perf_counter() < deadline and len(timings) < MAX_REPEATS)):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings)
+
+
+def scaling_exponent(timings):
+    """Least-squares slope of log(seconds) against log(N)."""
+
+    xs = [math.log(n) for n in timings]
+    ys = [math.log(seconds) for seconds in timings.values()]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+
+    return (sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+            / sum((x - x_mean) ** 2 for x in xs))
+
+
+def run(sizes=SIZES):
+    """Time every helper at every size; return a list of Results."""
+
+    from models import db
+
+    timings = {name: {} for name in MAX_SCALING}
+
+    for n in sizes:
+        build_fixture(n)
+
+        for name, fn in operations(n).items():
+            timings[name][n] = time_call(fn)
+
+        db.session.rollback()
+
+    return [Result(name, timings[name], scaling_exponent(timings[name]), MAX_SCALING[name])
+            for name in MAX_SCALING]
+
+
+def print_report(results):
+    sizes = list(results[0].timings)
+
+    print(f"{'helper':<16}" + ''.join(f"{f'N={n}':>12}" for n in sizes)
+          + f"{'exponent':>10}{'limit':>8}")
+
+    for result in results:
+        status = '' if result.exponent <= result.limit else '  TOO SLOW'
+        print(f"{result.name:<16}"
+              + ''.join(f"{result.timings[n] * 1000:>10.3f}ms" for n in sizes)
+              + f"{result.exponent:>10.2f}{result.limit:>8.2f}{status}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', default=os.environ.get('BENCHMARK_DATABASE_URL',
+                                                             BENCHMARK_DATABASE_URL))
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        type=lambda sizes: [int(n) for n in sizes.split(',')])
+    parser.add_argument('--output', help="write timings to this JSON file")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # app.py connects to DATABASE_URL when imported
+    os.environ['DATABASE_URL'] = args.database
+    from app import app
+    from hashing import password_hasher
+
+    app.config['BCRYPT_LOG_ROUNDS'] = BENCHMARK_BCRYPT_ROUNDS
+    password_hasher.init_app(app)
+
+    with app.app_context():
+        results = run(args.sizes)
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({result.name: {'timings': result.timings,
+                                     'exponent': result.exponent,
+                                     'limit': result.limit}
+                       for result in results}, f, indent=2)
+
+    if any(result.exponent > result.limit for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""Versioned schema migrations for Warbler.
+
+`db.create_all()` only creates tables that don't exist yet, so it can't
+change a database that is already serving traffic. Each change to an
+existing schema is written here as a numbered migration, and the versions
+that have been applied are recorded in the `schema_migrations` table.
+
+Migrations marked `transactional=False` run on an autocommit connection so
+they can use `CREATE INDEX CONCURRENTLY`, which builds an index without
+locking writes to the table. A concurrent build that fails (or is killed)
+leaves an INVALID index behind; `create_index_concurrently` drops such
+leftovers before trying again, so every migration is safe to re-run.
+
+A database made from scratch with `create_all()` already matches the
+models, so it should be `stamp()`ed rather than migrated.
+"""
+
+from collections import namedtuple
+
+from ids import ID_FUNCTIONS, ID_TRIGGER
+from models import db, SchemaMigration
+
+Migration = namedtuple('Migration', ['version', 'description', 'upgrade', 'transactional'])
+
+MIGRATIONS = []
+
+MissingIndex = namedtuple('MissingIndex', ['table', 'name', 'columns'])
+
+
+def migration(version, transactional=True):
+    """Register the decorated function as migration number `version`.
+
+    The function is called with a connection and its docstring is recorded
+    as the migration's description.
+    """
+
+    def register(upgrade):
+        MIGRATIONS.append(Migration(version, upgrade.__doc__.strip(), upgrade, transactional))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return upgrade
+
+    return register
+
+
+def index_is_valid(conn, name):
+    """True if index `name` exists and is usable, False if it is a failed
+    concurrent build, None if it doesn't exist."""
+
+    return conn.execute(db.text(
+        "SELECT i.indisvalid FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name"), name=name).scalar()
+
+
+def create_index_concurrently(conn, name, table, *columns):
+    """Build index `name` on `table` without blocking writes.
+
+    Must be run outside a transaction.
+    """
+
+    if index_is_valid(conn, name) is False:
+        conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+    conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                 f"ON {table} ({', '.join(columns)})")
+
+
+##############################################################################
+# Migrations: append new ones at the end, never edit one that has shipped.
+
+
+@migration(1, transactional=False)
+def hot_path_indexes(conn):
+    """Composite indexes for profile messages, following lists and likes"""
+
+    create_index_concurrently(conn, 'ix_messages_user_id_timestamp',
+                              'messages', 'user_id', 'timestamp', 'id')
+    create_index_concurrently(conn, 'ix_follows_user_following_id',
+                              'follows', 'user_following_id', 'user_being_followed_id')
+    create_index_concurrently(conn, 'ix_likes_user_id_message_id',
+                              'likes', 'user_id', 'message_id')
+
+
+@migration(2)
+def users_updated_at(conn):
+    """users.updated_at for validating cached profile pages"""
+
+    # a non-volatile default is stored once in the catalog, not written to every row
+    conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at "
+                 "TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT timezone('utc', now())")
+
+
+@migration(3)
+def likes_composite_key(conn):
+    """likes keyed on (user_id, message_id), and messages.like_count"""
+
+    surrogate_key = conn.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'likes' AND column_name = 'id'").scalar()
+
+    # the old schema let only one user like each message (message_id was unique)
+    if surrogate_key:
+        conn.execute("DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL")
+        conn.execute("ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key")
+        conn.execute("ALTER TABLE likes DROP COLUMN id")
+        conn.execute("ALTER TABLE likes ADD PRIMARY KEY (user_id, message_id)")
+
+    conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS like_count "
+                 "INTEGER NOT NULL DEFAULT 0")
+    conn.execute("UPDATE messages SET like_count = liked.n "
+                 "FROM (SELECT message_id, count(*) AS n FROM likes GROUP BY message_id) liked "
+                 "WHERE messages.id = liked.message_id")
+
+
+@migration(4, transactional=False)
+def likes_reverse_index(conn):
+    """Index likes by message; drop the one the primary key now covers"""
+
+    create_index_concurrently(conn, 'ix_likes_message_id_user_id',
+                              'likes', 'message_id', 'user_id')
+    conn.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_likes_user_id_message_id")
+
+
+@migration(5)
+def user_counter_columns(conn):
+    """users.messages_count, following_count, followers_count and likes_count"""
+
+    for column in ('messages_count', 'following_count', 'followers_count', 'likes_count'):
+        conn.execute(f"ALTER TABLE users ADD COLUMN IF NOT EXISTS {column} "
+                     "INTEGER NOT NULL DEFAULT 0")
+
+
+@migration(6)
+def backfill_user_counters(conn):
+    """Count each user's messages, follows, followers and likes"""
+
+    conn.execute(
+        "UPDATE users SET "
+        "messages_count = (SELECT count(*) FROM messages "
+        "                  WHERE messages.user_id = users.id), "
+        "following_count = (SELECT count(*) FROM follows "
+        "                   WHERE follows.user_following_id = users.id), "
+        "followers_count = (SELECT count(*) FROM follows "
+        "                   WHERE follows.user_being_followed_id = users.id), "
+        "likes_count = (SELECT count(*) FROM likes "
+        "               WHERE likes.user_id = users.id)")
+
+
+@migration(7)
+def timeline_entries(conn):
+    """timeline_entries, filled from everyone's own and followed messages"""
+
+    if conn.execute("SELECT to_regclass('timeline_entries')").scalar():
+        return
+
+    conn.execute("CREATE TABLE timeline_entries ("
+                 "user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE, "
+                 "message_id BIGINT NOT NULL REFERENCES messages (id) ON DELETE CASCADE, "
+                 "PRIMARY KEY (user_id, message_id))")
+    conn.execute("CREATE INDEX ix_timeline_entries_message_id "
+                 "ON timeline_entries (message_id)")
+
+    # the same rows as `flask rebuild-timelines`
+    conn.execute("INSERT INTO timeline_entries (user_id, message_id) "
+                 "SELECT user_id, id FROM messages "
+                 "UNION "
+                 "SELECT follows.user_following_id, messages.id FROM follows "
+                 "JOIN messages ON messages.user_id = follows.user_being_followed_id")
+
+
+@migration(8)
+def message_id_functions(conn):
+    """snowflake_id() and a server-side message timestamp"""
+
+    conn.execute(ID_FUNCTIONS)
+    conn.execute("ALTER TABLE messages ALTER COLUMN timestamp "
+                 "SET DEFAULT timezone('utc', now())")
+
+    # pages and timelines are ordered on message id alone now
+    conn.execute("ALTER TABLE timeline_entries DROP COLUMN IF EXISTS timestamp")
+
+
+def column_type(conn, table, column):
+    """The information_schema data type of `table`.`column` (e.g. 'bigint')."""
+
+    return conn.execute(db.text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = :table AND column_name = :column"),
+        table=table, column=column).scalar()
+
+
+# tables whose message_id column references messages.id
+MESSAGE_REFERENCES = ('likes', 'timeline_entries')
+
+
+def drop_message_foreign_keys(conn):
+    """Drop the foreign keys to messages.id; migration 12 puts them back."""
+
+    for table in MESSAGE_REFERENCES:
+        conn.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_message_id_fkey")
+
+
+@migration(9)
+def messages_id_bigint(conn):
+    """messages.id as BIGINT (rewrites messages)"""
+
+    if column_type(conn, 'messages', 'id') == 'bigint':
+        return
+
+    drop_message_foreign_keys(conn)
+    conn.execute("ALTER TABLE messages ALTER COLUMN id TYPE BIGINT")
+
+
+@migration(10)
+def likes_message_id_bigint(conn):
+    """likes.message_id as BIGINT (rewrites likes)"""
+
+    if column_type(conn, 'likes', 'message_id') != 'bigint':
+        conn.execute("ALTER TABLE likes ALTER COLUMN message_id TYPE BIGINT")
+
+
+@migration(11)
+def timeline_entries_message_id_bigint(conn):
+    """timeline_entries.message_id as BIGINT (rewrites timeline_entries)"""
+
+    if column_type(conn, 'timeline_entries', 'message_id') != 'bigint':
+        conn.execute("ALTER TABLE timeline_entries ALTER COLUMN message_id TYPE BIGINT")
+
+
+@migration(12)
+def snowflake_message_ids(conn):
+    """Time-ordered message ids, assigned by a trigger"""
+
+    serial = conn.execute("SELECT pg_get_serial_sequence('messages', 'id')").scalar()
+
+    if serial:
+        drop_message_foreign_keys(conn)
+
+        conn.execute("ALTER TABLE messages ALTER COLUMN id DROP DEFAULT")
+        conn.execute(f"DROP SEQUENCE {serial}")
+
+        # renumber existing messages by when they were posted
+        conn.execute("CREATE TEMPORARY TABLE message_ids ON COMMIT DROP AS "
+                     "SELECT id AS old_id, snowflake_id(timestamp) AS new_id "
+                     "FROM messages ORDER BY timestamp, id")
+        conn.execute("UPDATE messages SET id = new_id FROM message_ids WHERE id = old_id")
+        for table in MESSAGE_REFERENCES:
+            conn.execute(f"UPDATE {table} SET message_id = new_id "
+                         f"FROM message_ids WHERE message_id = old_id")
+
+    for table in MESSAGE_REFERENCES:
+        constraint = f"{table}_message_id_fkey"
+        exists = conn.execute(db.text("SELECT 1 FROM pg_constraint WHERE conname = :name"),
+                              name=constraint).scalar()
+        if not exists:
+            conn.execute(f"ALTER TABLE {table} ADD CONSTRAINT {constraint} "
+                         f"FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE")
+
+    conn.execute(ID_TRIGGER)
+
+
+@migration(13, transactional=False)
+def messages_id_index(conn):
+    """Index profile messages on (user_id, id) instead of timestamp"""
+
+    create_index_concurrently(conn, 'ix_messages_user_id_id', 'messages', 'user_id', 'id')
+    conn.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_messages_user_id_timestamp")
+
+
+##############################################################################
+
+
+def applied_versions():
+    """Return the set of migration versions applied to this database."""
+
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+
+    return {version for (version,) in db.session.query(SchemaMigration.version)}
+
+
+def pending():
+    """Return the migrations not yet applied, oldest first."""
+
+    applied = applied_versions()
+
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _record(conn, migration):
+    conn.execute(SchemaMigration.__table__.insert(),
+                 version=migration.version,
+                 description=migration.description)
+
+
+def upgrade():
+    """Apply every pending migration in order; return the ones applied."""
+
+    todo = pending()
+    db.session.commit()
+
+    for migration in todo:
+        with db.engine.connect() as conn:
+            if migration.transactional:
+                with conn.begin():
+                    migration.upgrade(conn)
+                    _record(conn, migration)
+            else:
+                conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                migration.upgrade(conn)
+                _record(conn, migration)
+
+    return todo
+
+
+def stamp():
+    """Mark every migration as applied without running it.
+
+    For databases created by `db.create_all()`, which already match the models.
+    """
+
+    for migration in pending():
+        db.session.add(SchemaMigration(version=migration.version,
+                                       description=migration.description))
+
+
+def missing_indexes():
+    """Return the indexes declared on the models that this database lacks.
+
+    Indexes left INVALID by a failed concurrent build count as missing.
+    """
+
+    valid = {name for (name,) in db.session.execute(
+        "SELECT c.relname FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indisvalid")}
+
+    return [MissingIndex(table.name, index.name, [col.name for col in index.columns])
+            for table in db.metadata.sorted_tables
+            for index in sorted(table.indexes, key=lambda index: index.name)
+            if index.name not in valid]
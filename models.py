@@ -2,13 +2,48 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+import flask_sqlalchemy
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from hashing import password_hasher
+from ids import ID_FUNCTIONS, ID_TRIGGER, next_snowflake
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    """Flask-SQLAlchemy, honouring SQLALCHEMY_ENGINE_OPTIONS.
+
+    The pinned Flask-SQLAlchemy (2.3) ignores that setting, which is how
+    metrics.py installs its timed connection pool.
+    """
+
+    def apply_driver_hacks(self, app, info, options):
+        result = super().apply_driver_hacks(app, info, options)
+        options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        return result
+
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
+class utcnow(FunctionElement):
+    """The current time in UTC, as a naive timestamp, in SQL."""
+
+    type = db.DateTime()
+    name = 'utcnow'
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
 
@@ -26,28 +61,50 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key already covers "who follows X?"; this covers "who does X follow?"
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`?"""
+
+        query = cls.query.filter_by(user_being_followed_id=followed_id,
+                                    user_following_id=follower_id)
+        return db.session.query(query.exists()).scalar()
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
-    __tablename__ = 'likes' 
-
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
+    __tablename__ = 'likes'
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
-        db.Integer,
+        db.BigInteger,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
     )
 
+    # the primary key already covers "what does X like?"; this covers "who likes Y?"
+    __table_args__ = (
+        db.Index('ix_likes_message_id_user_id', 'message_id', 'user_id'),
+    )
+
+    @classmethod
+    def exists(cls, user_id, message_id):
+        """Does `user_id` like `message_id`?"""
+
+        query = cls.query.filter_by(user_id=user_id, message_id=message_id)
+        return db.session.query(query.exists()).scalar()
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,6 +151,47 @@ class User(db.Model):
         nullable=False,
     )
 
+    # denormalized counts for the profile header; kept up to date by the
+    # write paths in app.py (see counters.py) and repaired by `flask recount`
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # bumped (in UTC) by every UPDATE of the row, including the counter
+    # updates above; caching.py uses it to validate cached profile pages
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=utcnow(),
+        onupdate=utcnow(),
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -119,23 +217,34 @@ class User(db.Model):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+        """Is this user followed by `other_user`?
+
+        Checks the follows primary key rather than loading `followers`.
+        """
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(follower_id=other_user.id, followed_id=self.id)
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_use`?
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        Checks the follows primary key rather than loading `following`.
+        """
+
+        return Follows.exists(follower_id=self.id, followed_id=other_user.id)
 
     def likes_message(self, message_id):
-        """Does the user like `message_id`? """
-        
-        liked_message_list = [msg for msg in self.likes if msg.id == message_id]
-        return len(liked_message_list) == 1
-            
+        """Does the user like `message_id`?
+
+        Checks the likes index rather than loading `likes`.
+        """
+
+        return Likes.exists(user_id=self.id, message_id=message_id)
+
+    @classmethod
+    def cards(cls):
+        """Query just the CARD_COLUMNS of users, as plain rows."""
+
+        return db.session.query(*(getattr(cls, name) for name in CARD_COLUMNS))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -144,7 +253,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_hasher.hash(password)
 
         user = User(
             username=username,
@@ -164,14 +273,19 @@ class User(db.Model):
         It searches for a user whose password hash matches this password
         and, if it finds such a user, returns that user object.
 
+        If the stored hash was made with a different bcrypt cost than we use
+        now, it's replaced with a fresh one (the caller commits).
+
         If can't find matching user (or if password is wrong), returns False.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = password_hasher.check(user.password, password)
             if is_auth:
+                if password_hasher.needs_rehash(user.password):
+                    user.password = password_hasher.hash(password)
                 return user
 
         return False
@@ -182,9 +296,13 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    # time-ordered: assigned from `timestamp` by a trigger on Postgres, and
+    # by assign_message_id() below elsewhere (see ids.py)
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
+        server_default=db.FetchedValue(),
     )
 
     text = db.Column(
@@ -195,7 +313,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        server_default=utcnow(),
     )
 
     user_id = db.Column(
@@ -204,8 +322,112 @@ class Message(db.Model):
         nullable=False,
     )
 
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_id', 'user_id', 'id'),
+    )
+
+    # read the server-assigned id and timestamp back from the INSERT itself
+    __mapper_args__ = {'eager_defaults': True}
+
+    @classmethod
+    def listing(cls, profile):
+        """Query messages for a list view, loading authors per LOAD_PROFILES[profile]."""
+
+        return cls.query.options(*LOAD_PROFILES[profile])
+
+
+db.event.listen(Message.__table__, 'after_create',
+                db.DDL(ID_FUNCTIONS + ID_TRIGGER).execute_if(dialect='postgresql'))
+
+
+@db.event.listens_for(Message, 'before_insert')
+def assign_message_id(mapper, connection, message):
+    """Give `message` its id in Python on databases without the trigger."""
+
+    if connection.dialect.name == 'postgresql' or message.id is not None:
+        return
+
+    if message.timestamp is None:
+        message.timestamp = datetime.utcnow()
+
+    message.id = next_snowflake(message.timestamp)
+
+
+# what a message list shows of each author: profile link, avatar and @username
+AUTHOR_COLUMNS = ('id', 'username', 'image_url')
+
+# what a user card (follower/following grids) shows; never the password hash
+CARD_COLUMNS = ('id', 'username', 'image_url', 'header_image_url', 'bio')
+
+# How each message list loads `msg.user`. Left lazy, that's a SELECT per
+# distinct author on the page.
+LOAD_PROFILES = {
+    # many authors: joined into the page's query, only the columns shown
+    'timeline': (db.joinedload(Message.user).load_only(*AUTHOR_COLUMNS),),
+    'likes': (db.joinedload(Message.user).load_only(*AUTHOR_COLUMNS),),
+    # one author, whom the view has already loaded: the lazy load is
+    # answered from the session's identity map without any SQL
+    'profile': (db.lazyload(Message.user),),
+}
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline.
+
+    Rows are written when a message is posted (one per follower, plus the
+    author), so the homepage is a single range read of the primary key
+    (user_id, message_id): message ids are time-ordered.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+
+class SchemaMigration(db.Model):
+    """A migration (see migrations.py) that has been applied to this database."""
+
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    description = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    applied_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now(),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,68 @@
+"""Keyset (cursor) pagination for message lists.
+
+Pages are ordered newest-first on message id, which is time-ordered (see
+ids.py). A cursor names the last message of a page, and the next page is
+everything strictly older than it, so each page is one index range scan no
+matter how far back it is.
+"""
+
+from collections import namedtuple
+
+PAGE_SIZE = 100
+
+# user cards per page; divisible by the grid's 2 and 3 columns
+CARD_PAGE_SIZE = 48
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(id):
+    """Turn a message id position into a URL-safe cursor string."""
+
+    return str(id)
+
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a message id.
+
+    Returns None for a missing or malformed cursor (i.e. the first page).
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        id = int(cursor)
+    except ValueError:
+        return None
+
+    return id if id > 0 else None
+
+
+def keyset_page(query, id_col, before=None, per_page=PAGE_SIZE):
+    """Return one newest-first Page of `query`, older than `before`.
+
+    `query` should return messages (or rows with .id); `id_col` is the
+    message id column it is ordered on.
+    """
+
+    if before:
+        query = query.filter(id_col < before)
+
+    rows = (query
+            .order_by(id_col.desc())
+            .limit(per_page + 1)
+            .all())
+
+    return make_page(rows, per_page)
+
+
+def make_page(rows, per_page=PAGE_SIZE):
+    """Wrap `per_page + 1` fetched messages as a Page."""
+
+    items = rows[:per_page]
+
+    if len(rows) > per_page:
+        return Page(items, encode_cursor(items[-1].id))
+
+    return Page(items, None)
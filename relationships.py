@@ -0,0 +1,106 @@
+"""Follow and like writes.
+
+Going through `g.user.following.append(...)` and friends loads the whole
+collection into the session before adding or removing one row, so a click
+costs O(size of the collection), and a double-clicked follow inserts a
+duplicate row and fails with an IntegrityError.
+
+These functions instead issue one idempotent statement each -
+`INSERT ... ON CONFLICT DO NOTHING` (`INSERT OR IGNORE` on SQLite) or a
+targeted `DELETE` - and only
+update counters and timelines when the row actually changed. Each returns
+the resulting State; no collections are loaded.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Follows, Likes, Message
+from timelines import timeline_store
+import counters
+
+# `active`: whether the relationship exists now; `changed`: whether this call did it
+State = namedtuple('State', ['active', 'changed'])
+
+
+def _insert_new(session, table, **values):
+    """Insert a row into `table` unless it's already there; was it inserted?"""
+
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        statement = postgresql.insert(table).values(**values).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        statement = table.insert().values(**values).prefix_with('OR IGNORE')
+    else:
+        try:
+            with session.begin_nested():
+                session.execute(table.insert().values(**values))
+        except IntegrityError:
+            return False
+        return True
+
+    return bool(session.execute(statement).rowcount)
+
+
+def follow(follower_id, followed_id):
+    """Have `follower_id` follow `followed_id`."""
+
+    if not _insert_new(db.session, Follows.__table__,
+                       user_following_id=follower_id, user_being_followed_id=followed_id):
+        return State(active=True, changed=False)
+
+    timeline_store.follow(follower_id, followed_id)
+    counters.adjust(follower_id, following=1)
+    counters.adjust(followed_id, followers=1)
+
+    return State(active=True, changed=True)
+
+
+def unfollow(follower_id, followed_id):
+    """Have `follower_id` stop following `followed_id`."""
+
+    deleted = (Follows
+               .query
+               .filter_by(user_following_id=follower_id, user_being_followed_id=followed_id)
+               .delete(synchronize_session=False))
+
+    if not deleted:
+        return State(active=False, changed=False)
+
+    timeline_store.unfollow(follower_id, followed_id)
+    counters.adjust(follower_id, following=-1)
+    counters.adjust(followed_id, followers=-1)
+
+    return State(active=False, changed=True)
+
+
+def like(user_id, message_id):
+    """Have `user_id` like `message_id`."""
+
+    if not _insert_new(db.session, Likes.__table__, user_id=user_id, message_id=message_id):
+        return State(active=True, changed=False)
+
+    counters.adjust(user_id, likes=1)
+    counters.adjust_like_counts(Message.id == message_id, 1)
+
+    return State(active=True, changed=True)
+
+
+def unlike(user_id, message_id):
+    """Have `user_id` stop liking `message_id`."""
+
+    deleted = (Likes
+               .query
+               .filter_by(user_id=user_id, message_id=message_id)
+               .delete(synchronize_session=False))
+
+    if not deleted:
+        return State(active=False, changed=False)
+
+    counters.adjust(user_id, likes=-1)
+    counters.adjust_like_counts(Message.id == message_id, -1)
+
+    return State(active=False, changed=True)
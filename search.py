@@ -0,0 +1,718 @@
+"""Search for Warbler.
+
+User search
+-----------
+
+`/users?q=` used to run `username LIKE '%q%'`, which no B-tree index can
+help with. User search now goes through one of two backends, picked with
+the USER_SEARCH_BACKEND config value:
+
+- "postgres": `ILIKE` backed by a pg_trgm GIN index on users.username,
+  ranked by exact match, then prefix match, then trigram similarity.
+- "memory": an in-process n-gram index of usernames, kept current by
+  this worker's signup/edit/delete and rebuilt every INDEX_REFRESH_AFTER
+  seconds on a background thread (searches scan the table with ILIKE
+  until the first build is done).
+- "auto" (default): postgres if pg_trgm is installed, otherwise memory.
+
+Message search
+--------------
+
+`/messages/search?q=` matches every word of the query against message
+text, newest first or by relevance. MESSAGE_SEARCH_BACKEND picks:
+
+- "postgres": `to_tsvector @@ plainto_tsquery` over a GIN expression
+  index, ranked with ts_rank.
+- "memory": an in-process inverted index of message words, built on a
+  background thread as the worker starts (searches get a 503 until it's
+  ready). New rows are pulled in by id on each search, so posts made by
+  other workers show up without rescanning the table.
+- "auto" (default): postgres if the GIN index exists, otherwise memory.
+
+`flask create-search-indexes` installs the Postgres indexes.
+"""
+from collections import Counter, defaultdict, namedtuple
+from decimal import Decimal, InvalidOperation
+from operator import itemgetter
+from threading import Lock
+import heapq
+import logging
+import math
+import re
+import time
+
+from flask import current_app
+
+from ids import SEQUENCE_BITS
+from models import db, User, Message
+from pagination import (PAGE_SIZE, Page, encode_cursor, decode_cursor,
+                        keyset_page)
+from workers import run_in_background
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 48
+
+# how often (seconds) the in-process user index is rebuilt; other workers'
+# signups/edits only reach this one through a rebuild
+INDEX_REFRESH_AFTER = 300
+
+# most usernames fully ranked for one query; a short query can match most
+# of the table, so the rest are cut by a cheaper ordering first
+MAX_CANDIDATES = 1000
+
+# a message's id comes from its transaction's start time, so one that
+# commits late can land below ids already indexed; each catch-up looks
+# this many seconds' worth of ids back for those
+CATCH_UP_WINDOW = 60
+
+SearchPage = namedtuple('SearchPage', ['items', 'page', 'has_next'])
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in user-supplied `text`."""
+
+    return (text
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def ngrams(text, n):
+    """Return the set of length-`n` substrings of `text`."""
+
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex:
+    """In-process substring index over short strings (e.g. usernames).
+
+    Every substring up to `n` characters long is posted, so a query of up
+    to `n` characters is a single posting lookup and a longer one is the
+    intersection of its n-grams, confirmed with a substring check.
+
+    Only the best `max_candidates` matches by a cheap ordering (exact, then
+    prefix, then shortest) are ranked by similarity.
+    """
+
+    def __init__(self, n=3, max_candidates=MAX_CANDIDATES):
+        self.n = n
+        self.max_candidates = max_candidates
+        self._docs = {}
+        self._postings = defaultdict(set)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _grams(self, text):
+        grams = set()
+        for size in range(1, self.n + 1):
+            grams |= ngrams(text, size)
+        return grams
+
+    def add(self, doc_id, text):
+        """Index (or re-index) `doc_id` under `text`."""
+
+        text = text.lower()
+
+        with self._lock:
+            self._discard(doc_id)
+            self._docs[doc_id] = text
+            for gram in self._grams(text):
+                self._postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        """Drop `doc_id` from the index."""
+
+        with self._lock:
+            self._discard(doc_id)
+
+    def _discard(self, doc_id):
+        text = self._docs.pop(doc_id, None)
+        if text is None:
+            return
+
+        for gram in self._grams(text):
+            postings = self._postings[gram]
+            postings.discard(doc_id)
+            if not postings:
+                del self._postings[gram]
+
+    def search(self, query, limit, offset=0):
+        """Return up to `limit` doc ids containing `query`, best match first."""
+
+        query = query.lower()
+        if not query:
+            return []
+
+        with self._lock:
+            if len(query) <= self.n:
+                candidates = set(self._postings.get(query, ()))
+            else:
+                grams = sorted(ngrams(query, self.n),
+                               key=lambda gram: len(self._postings.get(gram, ())))
+                candidates = set(self._postings.get(grams[0], ()))
+                for gram in grams[1:]:
+                    candidates &= self._postings.get(gram, set())
+                    if not candidates:
+                        break
+                candidates = {doc_id for doc_id in candidates
+                              if query in self._docs[doc_id]}
+
+            def closeness(doc_id):
+                # shorter texts share more of their n-grams with the query
+                text = self._docs[doc_id]
+                return (text != query, not text.startswith(query), len(text))
+
+            most = max(self.max_candidates, offset + limit)
+            if len(candidates) > most:
+                candidates = heapq.nsmallest(most, candidates, key=closeness)
+
+            docs = {doc_id: self._docs[doc_id] for doc_id in candidates}
+
+        query_grams = ngrams(query, self.n) or {query}
+
+        def rank(doc_id):
+            text = docs[doc_id]
+            text_grams = ngrams(text, self.n) or {text}
+            similarity = (len(query_grams & text_grams) /
+                          len(query_grams | text_grams))
+            return (text != query, not text.startswith(query), -similarity, text)
+
+        ranked = heapq.nsmallest(offset + limit, docs, key=rank)
+        return ranked[offset:]
+
+
+class PostgresUserSearch:
+    """User search using a pg_trgm GIN index on users.username."""
+
+    def search(self, query, limit, offset=0):
+        pattern = escape_like(query)
+
+        return (User
+                .query
+                .filter(User.username.ilike(f"%{pattern}%"))
+                .order_by((db.func.lower(User.username) == query.lower()).desc(),
+                          User.username.ilike(f"{pattern}%").desc(),
+                          db.func.similarity(User.username, query).desc(),
+                          User.username)
+                .offset(offset)
+                .limit(limit)
+                .all())
+
+    def start_warming(self, app):
+        """Nothing to do; the GIN index is maintained by Postgres."""
+
+    def index_user(self, user):
+        """Nothing to do; the GIN index is maintained by Postgres."""
+
+    def remove_user(self, user_id):
+        """Nothing to do; the GIN index is maintained by Postgres."""
+
+
+class MemoryUserSearch:
+    """User search over an in-process NgramIndex of usernames."""
+
+    def __init__(self, refresh_after=INDEX_REFRESH_AFTER):
+        self.refresh_after = refresh_after
+        self.index = None
+        self._refreshing = False
+        self._lock = Lock()
+
+    def warm(self):
+        """(Re)build the index from the users table."""
+
+        index = NgramIndex()
+        for id, username in db.session.query(User.id, User.username).yield_per(1000):
+            index.add(id, username)
+
+        self.index = index
+
+    def start_warming(self, app):
+        """Build the index, and keep rebuilding it, on a background thread."""
+
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        run_in_background(app, self._keep_fresh, 'user-search-index')
+
+    def _keep_fresh(self):
+        while True:
+            try:
+                self.warm()
+            except Exception:
+                logger.exception("rebuilding the user search index failed")
+            finally:
+                # don't hold a connection between rebuilds
+                db.session.remove()
+
+            time.sleep(self.refresh_after)
+
+    def _scan(self, query, limit, offset):
+        """Search without the index, ranked as closeness() would."""
+
+        pattern = escape_like(query)
+
+        return (User
+                .query
+                .filter(User.username.ilike(f"%{pattern}%", escape='\\'))
+                .order_by((db.func.lower(User.username) == query.lower()).desc(),
+                          User.username.ilike(f"{pattern}%", escape='\\').desc(),
+                          db.func.length(User.username),
+                          User.username)
+                .offset(offset)
+                .limit(limit)
+                .all())
+
+    def search(self, query, limit, offset=0):
+        if self.index is None:
+            self.start_warming(current_app._get_current_object())
+            return self._scan(query, limit, offset)
+
+        ids = self.index.search(query, limit, offset)
+        if not ids:
+            return []
+
+        by_id = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+        return [by_id[id] for id in ids if id in by_id]
+
+    def index_user(self, user):
+        if self.index is not None:
+            self.index.add(user.id, user.username)
+
+    def remove_user(self, user_id):
+        if self.index is not None:
+            self.index.remove(user_id)
+
+
+def has_trigram_support():
+    """Is this a Postgres database with the pg_trgm extension installed?"""
+
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    installed = db.session.execute(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first()
+    return installed is not None
+
+
+class UserSearch:
+    """Front door to whichever user search backend the app is configured with."""
+
+    def __init__(self):
+        self.backend_name = 'auto'
+        self._backend = None
+
+    def init_app(self, app):
+        """Pick the backend named by app.config['USER_SEARCH_BACKEND']."""
+
+        self.backend_name = app.config.setdefault('USER_SEARCH_BACKEND', 'auto')
+        self._backend = None
+
+    @property
+    def backend(self):
+        # 'auto' needs the database to decide, so it's resolved on first use
+        if self._backend is None:
+            name = self.backend_name
+            if name == 'auto':
+                name = 'postgres' if has_trigram_support() else 'memory'
+            self._backend = (PostgresUserSearch() if name == 'postgres'
+                             else MemoryUserSearch())
+
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    def search(self, query, page=1, per_page=SEARCH_PAGE_SIZE):
+        """Return a SearchPage of users whose username contains `query`."""
+
+        offset = (page - 1) * per_page
+        users = self.backend.search(query, per_page + 1, offset)
+
+        return SearchPage(users[:per_page], page, len(users) > per_page)
+
+    def start_warming(self, app):
+        """Start building the backend's in-process index, if it has one."""
+
+        with app.app_context():
+            self.backend.start_warming(app)
+
+    def index_user(self, user):
+        self.backend.index_user(user)
+
+    def remove_user(self, user_id):
+        self.backend.remove_user(user_id)
+
+
+user_search = UserSearch()
+
+
+##############################################################################
+# Message search
+
+TEXT_SEARCH_CONFIG = 'english'
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have i if in is it its of on
+    or so that the their there they this to was we were what when which who
+    will with you your
+""".split())
+
+
+def tokenize(text):
+    """Split `text` into lowercase, stopword-free search terms."""
+
+    return [word for word in WORD_RE.findall(text.lower())
+            if word not in STOPWORDS]
+
+
+def encode_ranked_cursor(score, id):
+    """Cursor for relevance-ordered results: score, then message id."""
+
+    return f"{score}_{encode_cursor(id)}"
+
+
+def decode_ranked_cursor(cursor):
+    """Turn a relevance cursor back into (score, id), or None."""
+
+    if not cursor or '_' not in cursor:
+        return None
+
+    score, position = cursor.split('_', 1)
+    position = decode_cursor(position)
+
+    try:
+        return (Decimal(score), position) if position else None
+    except InvalidOperation:
+        return None
+
+
+class SearchUnavailable(Exception):
+    """The search index is still being built; try again shortly."""
+
+
+class InvertedIndex:
+    """In-process word -> message index with tf-idf scoring.
+
+    Every query term has to appear in a message for it to match (like
+    plainto_tsquery), so candidates come from intersecting posting lists.
+    """
+
+    def __init__(self):
+        # highest message id pulled from the database so far
+        self.max_id = 0
+        self._docs = {}
+        self._postings = defaultdict(dict)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._docs
+
+    def add(self, doc_id, text):
+        """Index (or re-index) message `doc_id`."""
+
+        terms = Counter(tokenize(text))
+
+        with self._lock:
+            self._discard(doc_id)
+            self._docs[doc_id] = terms
+            for term, count in terms.items():
+                self._postings[term][doc_id] = count
+
+    def remove(self, doc_id):
+        """Drop message `doc_id` from the index."""
+
+        with self._lock:
+            self._discard(doc_id)
+
+    def _discard(self, doc_id):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+
+        for term in doc:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query, sort='recent', before=None, limit=PAGE_SIZE):
+        """Return up to `limit` (score, id) matches for `query`.
+
+        Results are ordered newest first (`sort='recent'`) or by score
+        (`sort='relevant'`), and start strictly after cursor `before`.
+        """
+
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            postings = sorted((self._postings.get(term, {}) for term in terms),
+                              key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates &= posting.keys()
+
+            total = len(self._docs)
+            idf = [math.log(1 + total / len(posting)) for posting in postings
+                   if posting]
+
+            matches = []
+            for doc_id in candidates:
+                score = sum(posting[doc_id] * weight
+                            for posting, weight in zip(postings, idf))
+                matches.append((Decimal(f"{score:.6f}"), doc_id))
+
+        # matches are (score, id)
+        key = itemgetter(1) if sort == 'recent' else itemgetter(0, 1)
+
+        if before:
+            matches = [match for match in matches if key(match) < before]
+
+        return heapq.nlargest(limit, matches, key=key)
+
+
+class PostgresMessageSearch:
+    """Message search using a tsvector GIN expression index."""
+
+    def search(self, query, sort='recent', before=None, per_page=PAGE_SIZE):
+        vector = db.func.to_tsvector(TEXT_SEARCH_CONFIG, Message.text)
+        tsquery = db.func.plainto_tsquery(TEXT_SEARCH_CONFIG, query)
+        matching = vector.op('@@')(tsquery)
+
+        if sort == 'recent':
+            return keyset_page(Message.query.filter(matching),
+                               Message.id,
+                               before=before,
+                               per_page=per_page)
+
+        # rounded so scores survive the trip through a cursor exactly
+        rank = db.func.round(db.cast(db.func.ts_rank(vector, tsquery),
+                                     db.Numeric), 6)
+
+        results = db.session.query(Message, rank).filter(matching)
+        if before:
+            results = results.filter(
+                db.tuple_(rank, Message.id) < before)
+
+        rows = (results
+                .order_by(rank.desc(), Message.id.desc())
+                .limit(per_page + 1)
+                .all())
+
+        items = [msg for msg, score in rows[:per_page]]
+        if len(rows) > per_page:
+            msg, score = rows[per_page - 1]
+            return Page(items, encode_ranked_cursor(score, msg.id))
+
+        return Page(items, None)
+
+    def start_warming(self, app):
+        """Nothing to do; the GIN index is maintained by Postgres."""
+
+    def index_message(self, message):
+        """Nothing to do; the GIN index is maintained by Postgres."""
+
+    def remove_message(self, message_id):
+        """Nothing to do; the GIN index is maintained by Postgres."""
+
+
+class MemoryMessageSearch:
+    """Message search over an in-process InvertedIndex."""
+
+    def __init__(self):
+        self.index = InvertedIndex()
+        self.ready = False
+        self._warming = False
+        self._lock = Lock()
+
+    def warm(self):
+        """Index every message, and search the index from then on."""
+
+        self.catch_up()
+        self.ready = True
+
+    def start_warming(self, app):
+        """Build the index on a background thread, unless that's already begun."""
+
+        with self._lock:
+            if self.ready or self._warming:
+                return
+            self._warming = True
+
+        run_in_background(app, self._warm_claimed, 'message-search-index')
+
+    def _warm_claimed(self):
+        try:
+            self.warm()
+        finally:
+            # if it failed, the next search tries again
+            self._warming = False
+
+    def catch_up(self):
+        """Index messages added (by any worker) since we last looked.
+
+        The ids of the last CATCH_UP_WINDOW seconds are listed again, and
+        any not yet indexed are read.
+        """
+
+        if not self.index.max_id:
+            self._index_rows(Message.id > 0)
+            return
+
+        floor = self.index.max_id - (CATCH_UP_WINDOW * 1000 << SEQUENCE_BITS)
+        recent = db.session.query(Message.id).filter(Message.id > floor)
+        missing = [id for id, in recent if id not in self.index]
+
+        for start in range(0, len(missing), 1000):
+            self._index_rows(Message.id.in_(missing[start:start + 1000]))
+
+    def _index_rows(self, condition):
+        rows = (db.session
+                .query(Message.id, Message.text)
+                .filter(condition)
+                .order_by(Message.id)
+                .yield_per(1000))
+
+        for id, text in rows:
+            self.index.add(id, text)
+            self.index.max_id = max(self.index.max_id, id)
+
+    def search(self, query, sort='recent', before=None, per_page=PAGE_SIZE):
+        if not self.ready:
+            self.start_warming(current_app._get_current_object())
+            raise SearchUnavailable()
+
+        self.catch_up()
+
+        matches = self.index.search(query, sort, before, per_page + 1)
+        ids = [id for score, id in matches]
+        if not ids:
+            return Page([], None)
+
+        # rows deleted elsewhere simply drop out here
+        by_id = {msg.id: msg for msg in Message.query.filter(Message.id.in_(ids))}
+        items = [by_id[id] for id in ids[:per_page] if id in by_id]
+
+        if len(matches) > per_page:
+            score, id = matches[per_page - 1]
+            cursor = (encode_cursor(id) if sort == 'recent'
+                      else encode_ranked_cursor(score, id))
+            return Page(items, cursor)
+
+        return Page(items, None)
+
+    def index_message(self, message):
+        self.index.add(message.id, message.text)
+
+    def remove_message(self, message_id):
+        self.index.remove(message_id)
+
+
+def has_message_text_index():
+    """Is this a Postgres database with the message full-text index?"""
+
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    installed = db.session.execute(
+        "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_messages_text_fts'").first()
+    return installed is not None
+
+
+class MessageSearch:
+    """Front door to whichever message search backend the app is configured with."""
+
+    def __init__(self):
+        self.backend_name = 'auto'
+        self._backend = None
+
+    def init_app(self, app):
+        """Pick the backend named by app.config['MESSAGE_SEARCH_BACKEND']."""
+
+        self.backend_name = app.config.setdefault('MESSAGE_SEARCH_BACKEND', 'auto')
+        self._backend = None
+
+    @property
+    def backend(self):
+        # 'auto' needs the database to decide, so it's resolved on first use
+        if self._backend is None:
+            name = self.backend_name
+            if name == 'auto':
+                name = 'postgres' if has_message_text_index() else 'memory'
+            self._backend = (PostgresMessageSearch() if name == 'postgres'
+                             else MemoryMessageSearch())
+
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    def search(self, query, sort='recent', cursor=None, per_page=PAGE_SIZE):
+        """Return a Page of messages matching every word of `query`.
+
+        `sort` is 'recent' or 'relevant'; `cursor` is a next_cursor from an
+        earlier page of the same search.
+        """
+
+        if sort == 'recent':
+            before = decode_cursor(cursor)
+        else:
+            sort = 'relevant'
+            before = decode_ranked_cursor(cursor)
+
+        return self.backend.search(query, sort, before, per_page)
+
+    def start_warming(self, app):
+        """Start building the backend's in-process index, if it has one."""
+
+        with app.app_context():
+            self.backend.start_warming(app)
+
+    def index_message(self, message):
+        self.backend.index_message(message)
+
+    def remove_message(self, message_id):
+        self.backend.remove_message(message_id)
+
+
+message_search = MessageSearch()
+
+
+def connect_search(app):
+    """Attach the search backends to the Flask app."""
+
+    user_search.init_app(app)
+    message_search.init_app(app)
+
+
+def create_search_indexes():
+    """Install the Postgres indexes used by user and message search.
+
+    The trigram index is skipped if pg_trgm isn't available on the server.
+    """
+
+    db.session.execute(
+        "CREATE INDEX IF NOT EXISTS ix_messages_text_fts "
+        f"ON messages USING gin (to_tsvector('{TEXT_SEARCH_CONFIG}', text))")
+
+    available = db.session.execute(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").first()
+
+    if available:
+        db.session.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        db.session.execute(
+            "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+            "ON users USING gin (username gin_trgm_ops)")
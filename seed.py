@@ -1,20 +1,20 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+from timelines import timeline_store
+from loader import load_seed_data
+import counters
+import migrations
 
 
 db.drop_all()
 db.create_all()
+migrations.stamp()
+db.session.commit()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+for stats in load_seed_data('generator'):
+    print(stats)
 
+timeline_store.rebuild_all()
+counters.recount()
 db.session.commit()
@@ -0,0 +1,25 @@
+// Let people know a username is taken before they submit the signup form.
+
+const $username = $('#user_form input[name="username"]');
+const $usernameStatus = $('<small class="form-text username-status"></small>');
+
+$username.after($usernameStatus);
+
+$username.on('blur', async function () {
+  const username = $username.val().trim();
+
+  if (!username) {
+    $usernameStatus.text('');
+    return;
+  }
+
+  const resp = await $.getJSON('/api/username-available', { username });
+
+  // ignore answers for a username that's since been edited
+  if (resp.username !== $username.val().trim()) return;
+
+  $usernameStatus
+    .text(resp.available ? 'Username is available' : 'Username already taken')
+    .toggleClass('text-success', resp.available)
+    .toggleClass('text-danger', !resp.available);
+});
@@ -0,0 +1,193 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import mimetypes
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from assets import (AssetBuilder, Image, assets, asset_url, minify_css, minify_js,
+                    picture, srcset)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+STYLESHEET = """
+/* the hero */
+.hero {
+  background-image: url("/static/images/hero.jpg");
+  color: rgba(0, 0, 0, 0.5);
+}
+
+a:hover ,  a > b {
+  color:   red;
+}
+"""
+
+SCRIPT = """
+// say hello
+function hello() {
+    return 'hi';
+}
+"""
+
+
+class MinifyTestCase(TestCase):
+    """Test the CSS and JS minifiers."""
+
+    def test_minify_css(self):
+        self.assertEqual(minify_css(STYLESHEET),
+                         '.hero{background-image:url("/static/images/hero.jpg");'
+                         'color:rgba(0,0,0,0.5)}a:hover,a>b{color:red}')
+
+    def test_minify_js(self):
+        self.assertEqual(minify_js(SCRIPT), "function hello() {\nreturn 'hi';\n}\n")
+
+
+class AssetBuildTestCase(TestCase):
+    """Test building static/dist/ and serving what's in it."""
+
+    def setUp(self):
+        self.static_folder = tempfile.mkdtemp()
+
+        for name, contents in (('stylesheets/site.css', STYLESHEET),
+                               ('scripts/site.js', SCRIPT * 20)):
+            os.makedirs(os.path.join(self.static_folder, os.path.dirname(name)))
+            with open(os.path.join(self.static_folder, name), 'w') as f:
+                f.write(contents)
+
+        if Image is not None:
+            os.makedirs(os.path.join(self.static_folder, 'images'))
+            Image.new('RGB', (800, 400), 'blue').save(
+                os.path.join(self.static_folder, 'images/hero.jpg'))
+
+        self.manifest = AssetBuilder(self.static_folder).build()
+
+        self.real_static_folder = app.static_folder
+        app.static_folder = self.static_folder
+        assets.load(self.static_folder)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.static_folder = self.real_static_folder
+        assets.load(self.real_static_folder)
+        shutil.rmtree(self.static_folder)
+
+    def built(self, source):
+        return os.path.join(self.static_folder, self.manifest['files'][source])
+
+    def test_fingerprinted_names(self):
+        """Are built files named for their contents, and minified?"""
+
+        built = self.manifest['files']['scripts/site.js']
+        self.assertRegex(built, r'^dist/scripts/site\.[0-9a-f]{10}\.js$')
+
+        with open(self.built('scripts/site.js')) as f:
+            self.assertEqual(f.read(), minify_js(SCRIPT * 20))
+
+    def test_precompressed(self):
+        """Are text files gzipped alongside, when that's smaller?"""
+
+        with gzip.open(self.built('scripts/site.js') + '.gz', 'rt') as f:
+            self.assertEqual(f.read(), minify_js(SCRIPT * 20))
+
+        # too small to gain anything
+        self.assertFalse(os.path.exists(self.built('stylesheets/site.css') + '.gz'))
+
+    def test_rebuild_clears_old_files(self):
+        stale = os.path.join(self.static_folder, 'dist', 'stale.css')
+        open(stale, 'w').close()
+
+        AssetBuilder(self.static_folder).build()
+
+        self.assertFalse(os.path.exists(stale))
+
+    @skipIf(Image is None, "Pillow isn't installed")
+    def test_image_variants(self):
+        """Are images resized and converted to WebP?"""
+
+        variants = self.manifest['variants']['images/hero.jpg']
+
+        self.assertEqual([(v['width'], v['type']) for v in variants],
+                         [(320, 'image/jpeg'), (320, 'image/webp'),
+                          (640, 'image/jpeg'), (640, 'image/webp'),
+                          (800, 'image/jpeg'), (800, 'image/webp')])
+
+        with Image.open(os.path.join(self.static_folder, variants[1]['file'])) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+
+        # the default is the biggest variant in the original format
+        self.assertEqual(self.manifest['files']['images/hero.jpg'], variants[4]['file'])
+
+    @skipIf(Image is None, "Pillow isn't installed")
+    def test_css_urls_rewritten(self):
+        with open(self.built('stylesheets/site.css')) as f:
+            css = f.read()
+
+        self.assertIn(f'url("/static/{self.manifest["files"]["images/hero.jpg"]}")', css)
+
+    @skipIf(Image is None, "Pillow isn't installed")
+    def test_helpers(self):
+        """Do the template helpers point at the built files?"""
+
+        hero = '/static/images/hero.jpg'
+
+        self.assertEqual(asset_url(hero), f"/static/{self.manifest['files']['images/hero.jpg']}")
+        self.assertEqual(asset_url('http://example.com/x.jpg'), 'http://example.com/x.jpg')
+        self.assertEqual(srcset(hero, 'image/webp').count('w, '), 2)
+
+        html = picture(hero, class_='card-hero', sizes='50vw')
+        self.assertTrue(html.startswith('<picture><source type="image/webp" srcset="/static/dist/'))
+        self.assertIn('class="card-hero"', html)
+        self.assertIn('sizes="50vw"', html)
+
+        # not built: a plain <img>
+        self.assertEqual(picture('http://example.com/x.jpg', 'X'),
+                         '<img src="http://example.com/x.jpg" alt="X">')
+
+    def test_static_url_uses_build(self):
+        with app.test_request_context():
+            html = app.jinja_env.from_string(
+                "{{ static_url('stylesheets/site.css') }}").render()
+
+        self.assertEqual(html, f"/static/{self.manifest['files']['stylesheets/site.css']}")
+
+    def test_serves_precompressed(self):
+        """Are precompressed files sent to clients that accept them?"""
+
+        url = f"/static/{self.manifest['files']['scripts/site.js']}"
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.mimetype, mimetypes.guess_type(url)[0])
+        self.assertEqual(gzip.decompress(resp.data).decode(), minify_js(SCRIPT * 20))
+        self.assertIn('Accept-Encoding', resp.vary)
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.get_data(as_text=True), minify_js(SCRIPT * 20))
+        self.assertIn('Accept-Encoding', resp.vary)
@@ -0,0 +1,138 @@
+"""Username/email availability tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_availability.py
+
+
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from availability import availability, AvailabilityChecker, BloomFilter, SharedBloomFilter
+from hashing import password_hasher
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class BloomFilterTestCase(TestCase):
+    """Test the Bloom filter."""
+
+    def test_no_false_negatives(self):
+        """Is everything added reported as present?"""
+
+        bloom = BloomFilter(1000)
+        names = [f"user{i}" for i in range(1000)]
+
+        for name in names:
+            bloom.add(name)
+
+        self.assertTrue(all(name in bloom for name in names))
+
+    def test_false_positive_rate(self):
+        """Do absent items mostly come back absent?"""
+
+        bloom = BloomFilter(1000)
+        for i in range(1000):
+            bloom.add(f"user{i}")
+
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_shared_between_workers(self):
+        """Does a name one worker adds show up in every worker's filter?"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            mine = SharedBloomFilter(directory, 1000)
+            theirs = SharedBloomFilter(directory, 1000)
+
+            theirs.add("username:newcomer")
+            theirs.mark_ready()
+
+            self.assertIn("username:newcomer", mine)
+            self.assertNotIn("username:stranger", mine)
+            self.assertTrue(mine.ready)
+
+
+class AvailabilityTestCase(TestCase):
+    """Test availability checks and the signup fast path."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        self.client = app.test_client()
+
+        db.session.add(User(username="taken",
+                            email="taken@test.com",
+                            password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        availability.warm()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        availability.reset()
+
+    def test_taken_and_free(self):
+        """Are existing names reported taken and new ones free?"""
+
+        self.assertTrue(availability.username_taken("taken"))
+        self.assertTrue(availability.email_taken("taken@test.com"))
+        self.assertFalse(availability.username_taken("free"))
+        self.assertFalse(availability.email_taken("free@test.com"))
+
+    def test_api(self):
+        """Does the JSON endpoint report availability?"""
+
+        resp = self.client.get("/api/username-available?username=taken")
+        self.assertEqual(resp.get_json(), {"username": "taken", "available": False})
+
+        resp = self.client.get("/api/username-available?username=free")
+        self.assertEqual(resp.get_json(), {"username": "free", "available": True})
+
+    def test_duplicate_signup_skips_hashing(self):
+        """Is a taken username rejected without hashing the password?"""
+
+        with mock.patch.object(password_hasher, 'hash') as hash_password:
+            resp = self.client.post("/signup", data={"username": "taken",
+                                                     "email": "new@test.com",
+                                                     "password": "password"})
+
+        self.assertIn("Username already taken", resp.get_data(as_text=True))
+        hash_password.assert_not_called()
+        self.assertEqual(User.query.count(), 1)
+
+    def test_unfilled_filter_asks_database(self):
+        """Until the filter is filled, are names checked against the database?"""
+
+        checker = AvailabilityChecker(capacity=1000)
+        # pretend another worker is filling it, so no thread is started here
+        self.assertTrue(checker._filter.claim())
+
+        with app.app_context():
+            self.assertTrue(checker.username_taken("taken"))
+            self.assertFalse(checker.username_taken("free"))
@@ -0,0 +1,95 @@
+"""Load test harness tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_benchmark.py
+
+
+import os
+from argparse import Namespace
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from benchmark import Dataset, WSGIClient, percentile, summarize, run, TRAFFIC_MIX
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class StatsTestCase(TestCase):
+    """Test latency statistics."""
+
+    def test_percentile(self):
+        """Are nearest-rank percentiles right?"""
+
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        """Are errors and throughput counted?"""
+
+        stats = summarize([(0.010, 200), (0.020, 302), (0.030, 500)], elapsed=2)
+
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['rps'], 1.5)
+        self.assertEqual(stats['p50_ms'], 20)
+
+
+class RunTestCase(TestCase):
+    """Test replaying the traffic mix through the test client."""
+
+    def setUp(self):
+        """Create a few users and messages."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        for i in range(5):
+            user = User(username=f"user{i}", email=f"user{i}@test.com", password="HASHED")
+            user.messages.append(Message(text=f"Benchmark message number {i}"))
+            db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_run(self):
+        """Does every route in the mix get exercised and reported?"""
+
+        dataset = Dataset()
+        args = Namespace(seed='test', requests=150, warmup=10, concurrency=2)
+
+        results = run(lambda user_id: WSGIClient(app, user_id), dataset, args)
+
+        self.assertEqual(results['total']['requests'], 150)
+        self.assertEqual(set(results['routes']), set(TRAFFIC_MIX))
+        self.assertEqual(results['routes']['home']['errors'], 0)
+        self.assertEqual(results['routes']['post']['errors'], 0)
@@ -0,0 +1,157 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_caching.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from assets import assets
+import counters
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CachingTestCase(TestCase):
+    """Test cache headers and conditional GETs."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        author = User(username="author", email="author@test.com", password="HASHED")
+        author.messages.append(Message(text="Hello"))
+        viewer = User(username="viewer", email="viewer@test.com", password="HASHED")
+        db.session.add_all([author, viewer])
+        db.session.commit()
+
+        self.author_id = author.id
+        self.viewer_id = viewer.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+    def test_static_fingerprints(self):
+        """Are linked assets fingerprinted and cached for good?"""
+
+        # as without a `flask build-assets` (see test_assets.py for with)
+        with patch.dict(assets.files, clear=True):
+            html = self.client.get("/login").get_data(as_text=True)
+        self.assertIn("/static/stylesheets/style.css?v=", html)
+
+        url = html.split('href="/static/stylesheets/style.css')[1].split('"')[0]
+        resp = self.client.get("/static/stylesheets/style.css" + url)
+
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertEqual(resp.cache_control.max_age, 60 * 60 * 24 * 365)
+
+    def test_stale_version_revalidates(self):
+        """Is a `?v=` that isn't the file's hash cached only briefly?"""
+
+        resp = self.client.get("/static/stylesheets/style.css?v=not-the-hash")
+
+        self.assertNotIn("immutable", resp.headers["Cache-Control"])
+        self.assertEqual(resp.cache_control.max_age, 60 * 60)
+
+    def test_plain_static_revalidates(self):
+        """Are other static files cached briefly and revalidated?"""
+
+        resp = self.client.get("/static/images/default-pic.png")
+
+        self.assertEqual(resp.cache_control.max_age, 60 * 60)
+        self.assertIsNotNone(resp.headers.get('ETag'))
+
+    def test_profile_not_modified(self):
+        """Does a current ETag get a 304 with no body?"""
+
+        resp = self.client.get(f"/users/{self.author_id}")
+        etag = resp.headers['ETag']
+
+        self.assertTrue(resp.cache_control.public)
+        self.assertIn('Cookie', resp.headers['Vary'])
+        self.assertIsNotNone(resp.last_modified)
+
+        resp = self.client.get(f"/users/{self.author_id}", headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+
+    def test_profile_changes(self):
+        """Does posting as the profile user invalidate the ETag?"""
+
+        etag = self.client.get(f"/users/{self.author_id}").headers['ETag']
+
+        db.session.add(Message(text="Another", user_id=self.author_id))
+        counters.adjust(self.author_id, messages=1)
+        db.session.commit()
+
+        resp = self.client.get(f"/users/{self.author_id}", headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Another", resp.get_data(as_text=True))
+
+    def test_logged_in_is_private(self):
+        """Are logged-in pages private and validated per viewer?"""
+
+        anonymous_etag = self.client.get(f"/users/{self.author_id}").headers['ETag']
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get(f"/users/{self.author_id}", headers={'If-None-Match': anonymous_etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.cache_control.private)
+            self.assertFalse(resp.cache_control.public)
+
+            etag = resp.headers['ETag']
+            c.post(f"/users/follow/{self.author_id}")
+
+            resp = c.get(f"/users/{self.author_id}", headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_flashes_not_validated(self):
+        """Are pages showing a flashed message rendered in full?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('danger', "Something happened")]
+
+            resp = c.get(f"/users/{self.author_id}")
+
+        self.assertIsNone(resp.headers.get('ETag'))
@@ -0,0 +1,146 @@
+"""User stat counter tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CountersTestCase(TestCase):
+    """Test denormalized message/follow/like counters."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        Likes.query.delete()
+
+        self.client = app.test_client()
+
+        user1 = User(email="test1@test.com",
+                     username="testuser1",
+                     password="HASHED_PASSWORD1")
+        user2 = User(email="test2@test.com",
+                     username="testuser2",
+                     password="HASHED_PASSWORD2")
+        db.session.add_all([user1, user2])
+        db.session.commit()
+
+        self.user1_id = user1.id
+        self.user2_id = user2.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = User.query.get(user_id)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def test_follow_and_unfollow(self):
+        """Do follow/unfollow adjust both users' counters?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1_id
+
+            c.post(f"/users/follow/{self.user2_id}")
+            self.assertEqual(self.counts(self.user1_id), (0, 1, 0, 0))
+            self.assertEqual(self.counts(self.user2_id), (0, 0, 1, 0))
+
+            c.post(f"/users/stop-following/{self.user2_id}")
+            self.assertEqual(self.counts(self.user1_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.user2_id), (0, 0, 0, 0))
+
+    def test_post_like_and_delete(self):
+        """Do posting, liking and deleting keep counts in step?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user2_id
+
+            c.post("/messages/new", data={"text": "Count me"})
+            self.assertEqual(self.counts(self.user2_id), (1, 0, 0, 0))
+
+            msg_id = Message.query.one().id
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1_id
+
+            c.post(f"/users/add_like/{msg_id}", headers={"Referer": "/"})
+            self.assertEqual(self.counts(self.user1_id), (0, 0, 0, 1))
+
+            # deleting the message takes user1's like with it
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user2_id
+
+            c.post(f"/messages/{msg_id}/delete", headers={"Referer": "/"})
+            self.assertEqual(self.counts(self.user2_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.user1_id), (0, 0, 0, 0))
+
+    def test_recount_repairs_drift(self):
+        """Does recount() fix counters that disagree with the tables?"""
+
+        db.session.add(Message(text="Uncounted", user_id=self.user1_id))
+        db.session.add(Follows(user_being_followed_id=self.user1_id,
+                               user_following_id=self.user2_id))
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.user1_id), (0, 0, 0, 0))
+
+        self.assertEqual(counters.recount(), 2)
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.user1_id), (1, 0, 1, 0))
+        self.assertEqual(self.counts(self.user2_id), (0, 1, 0, 0))
+        self.assertEqual(counters.recount(), 0)
+
+    def test_recount_repairs_like_counts(self):
+        """Does recount() fix messages' like counts too?"""
+
+        msg = Message(text="Liked", user_id=self.user1_id)
+        db.session.add(msg)
+        db.session.flush()
+        db.session.add_all([Likes(user_id=self.user1_id, message_id=msg.id),
+                            Likes(user_id=self.user2_id, message_id=msg.id)])
+        db.session.commit()
+        msg_id = msg.id
+
+        counters.recount()
+        db.session.commit()
+
+        self.assertEqual(Message.query.get(msg_id).like_count, 2)
+        self.assertEqual(counters.recount(), 0)
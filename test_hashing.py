@@ -0,0 +1,128 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_hashing.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from hashing import (PasswordHasher, HashingBusy, password_hasher, hash_rounds,
+                     BCRYPT_LOG_ROUNDS)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the concurrency-limited hasher."""
+
+    def test_hash_and_check(self):
+        """Does a hash verify only against its own password?"""
+
+        hasher = PasswordHasher(rounds=4)
+        hashed = hasher.hash("secret-password")
+
+        self.assertEqual(hash_rounds(hashed), 4)
+        self.assertTrue(hasher.check(hashed, "secret-password"))
+        self.assertFalse(hasher.check(hashed, "wrong-password"))
+        self.assertFalse(hasher.check("not-a-hash", "secret-password"))
+
+    def test_needs_rehash(self):
+        """Are hashes made at another cost flagged for rehashing?"""
+
+        hashed = PasswordHasher(rounds=4).hash("secret-password")
+
+        self.assertFalse(PasswordHasher(rounds=4).needs_rehash(hashed))
+        self.assertTrue(PasswordHasher(rounds=5).needs_rehash(hashed))
+
+    def test_rejects_when_saturated(self):
+        """Do hashes beyond the limit fail fast instead of waiting?"""
+
+        hasher = PasswordHasher(rounds=4, concurrency=1)
+
+        with hasher._slots.slot():
+            with self.assertRaises(HashingBusy):
+                hasher.hash("secret-password")
+
+        self.assertTrue(hasher.hash("secret-password"))
+
+    def test_limit_shared_between_workers(self):
+        """Does a hash running in one worker count against the others?"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            mine = PasswordHasher(rounds=4, concurrency=1, directory=directory)
+            theirs = PasswordHasher(rounds=4, concurrency=1, directory=directory)
+
+            with theirs._slots.slot() as acquired:
+                self.assertTrue(acquired)
+                with self.assertRaises(HashingBusy):
+                    mine.hash("secret-password")
+
+            self.assertTrue(mine.hash("secret-password"))
+
+
+class RehashOnLoginTestCase(TestCase):
+    """Test login-time hash upgrades."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        self.client = app.test_client()
+
+        old_hash = PasswordHasher(rounds=4).hash("testuser")
+        db.session.add(User(username="testuser",
+                            email="test@test.com",
+                            password=old_hash))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        password_hasher.init_app(app)
+
+    def test_login_upgrades_hash(self):
+        """Does logging in re-hash a password stored at the old cost?"""
+
+        resp = self.client.post("/login", data={"username": "testuser",
+                                                "password": "testuser"})
+        self.assertEqual(resp.status_code, 302)
+
+        user = User.query.filter_by(username="testuser").one()
+        self.assertEqual(hash_rounds(user.password), BCRYPT_LOG_ROUNDS)
+        self.assertTrue(password_hasher.check(user.password, "testuser"))
+
+    def test_login_when_busy(self):
+        """Is a saturated hasher reported as 503 rather than a slow login?"""
+
+        password_hasher.configure(rounds=4, concurrency=0)
+
+        resp = self.client.post("/login", data={"username": "testuser",
+                                                "password": "testuser"})
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '1')
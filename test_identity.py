@@ -0,0 +1,122 @@
+"""Current-user cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_identity.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from identity import user_cache, load_current_user
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CurrentUserCacheTestCase(TestCase):
+    """Test the per-worker current-user cache."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        user = User.signup(username="testuser",
+                           email="test@test.com",
+                           password="testuser",
+                           image_url="/static/images/default-pic.png")
+        user.bio = "Original bio"
+        db.session.commit()
+
+        self.user_id = user.id
+        self.statements = []
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def record_statements(self):
+        """Capture every SQL statement run until the test ends."""
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            self.statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+
+    def test_cache_hit_skips_query(self):
+        """Does a cached user render a page without touching the users table?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.get("/messages/new")
+            self.record_statements()
+
+            html = c.get("/messages/new").get_data(as_text=True)
+
+            self.assertIn('alt="testuser"', html)
+            self.assertFalse([sql for sql in self.statements if 'users' in sql])
+
+    def test_other_fields_load_on_demand(self):
+        """Can a route still read fields that aren't in the snapshot?"""
+
+        with app.test_request_context():
+            load_current_user(self.user_id)
+            db.session.remove()
+
+            user = load_current_user(self.user_id)
+            self.assertEqual(user.username, "testuser")
+            self.assertEqual(user.bio, "Original bio")
+
+    def test_missing_user(self):
+        """Is a session pointing at a deleted user treated as logged out?"""
+
+        self.assertIsNone(load_current_user(-1))
+
+    def test_edit_profile_invalidates(self):
+        """Does editing your profile refresh the cached username?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.get("/messages/new")
+            self.assertEqual(user_cache.get(self.user_id)['username'], "testuser")
+
+            c.post("/users/profile", data={"username": "renamed",
+                                           "email": "test@test.com",
+                                           "password": "testuser"})
+            self.assertIsNone(user_cache.get(self.user_id))
+
+            html = c.get("/messages/new").get_data(as_text=True)
+            self.assertIn('alt="renamed"', html)
@@ -0,0 +1,122 @@
+"""Message id tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_ids.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from ids import SEQUENCE_BITS, snowflake, snowflake_timestamp
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class IdsTestCase(TestCase):
+    """Test time-ordered message ids."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        user = User(username="testuser", email="test@test.com", password="HASHED")
+        db.session.add(user)
+        db.session.commit()
+
+        self.user_id = user.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_python_round_trip(self):
+        ts = datetime(2020, 5, 17, 8, 30, 1, 123000)
+
+        self.assertEqual(snowflake_timestamp(snowflake(ts, 7)), ts)
+        self.assertLess(snowflake(ts, 2 ** 22 - 1), snowflake(ts.replace(microsecond=124000)))
+
+    def test_database_matches_python(self):
+        """Does the trigger lay ids out the way snowflake() does?"""
+
+        ts = datetime(2020, 5, 17, 8, 30, 1, 123456)
+        msg = Message(text="Hello", user_id=self.user_id, timestamp=ts)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.assertEqual(msg.id >> SEQUENCE_BITS, snowflake(ts) >> SEQUENCE_BITS)
+        self.assertEqual(snowflake_timestamp(msg.id), ts.replace(microsecond=123000))
+
+    def test_ids_follow_timestamps(self):
+        """Does an older message get a smaller id, whatever the insert order?"""
+
+        newer = Message(text="Newer", user_id=self.user_id, timestamp=datetime(2021, 1, 1))
+        older = Message(text="Older", user_id=self.user_id, timestamp=datetime(2020, 1, 1))
+        db.session.add(newer)
+        db.session.commit()
+        db.session.add(older)
+        db.session.commit()
+
+        self.assertLess(older.id, newer.id)
+
+    def test_server_timestamp(self):
+        """Does a message without a timestamp get the database's clock?"""
+
+        before = db.session.execute("SELECT timezone('utc', now())").scalar()
+        db.session.commit()
+
+        msg = Message(text="Now", user_id=self.user_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.assertGreaterEqual(msg.timestamp, before)
+        self.assertEqual(snowflake_timestamp(msg.id),
+                         msg.timestamp.replace(microsecond=msg.timestamp.microsecond // 1000 * 1000))
+
+    def test_ids_without_trigger(self):
+        """Do messages get time-ordered ids on SQLite, which has no trigger?"""
+
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(engine)
+        session = Session(bind=engine)
+
+        user = User(username="lite", email="lite@test.com", password="HASHED")
+        session.add(user)
+        session.flush()
+
+        newer = Message(text="Newer", user_id=user.id, timestamp=datetime(2021, 1, 1))
+        older = Message(text="Older", user_id=user.id, timestamp=datetime(2020, 1, 1))
+        now = Message(text="Now", user_id=user.id)
+        session.add_all([newer, older, now])
+        session.commit()
+
+        self.assertLess(older.id, newer.id)
+        self.assertLess(newer.id, now.id)
+        self.assertEqual(snowflake_timestamp(older.id), datetime(2020, 1, 1))
+        session.close()
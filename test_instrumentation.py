@@ -0,0 +1,133 @@
+"""SQL instrumentation tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from instrumentation import check_budget, statement_shape, QueryBudgetExceeded, QueryStats
+from timelines import timeline_store
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class StatementShapeTestCase(TestCase):
+    """Test normalizing statements."""
+
+    def test_in_lists(self):
+        """Are IN lists of any length the same shape?"""
+
+        self.assertEqual(
+            statement_shape("SELECT * FROM users\n WHERE id IN (%(id_1)s, %(id_2)s)"),
+            statement_shape("SELECT * FROM users WHERE id IN (%(id_1)s)"))
+
+
+class InstrumentationTestCase(TestCase):
+    """Test per-request query counting and budgets."""
+
+    def setUp(self):
+        """Create a user following several authors with a message each."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        reader = User(username="reader", email="reader@test.com", password="HASHED")
+        db.session.add(reader)
+
+        for i in range(8):
+            author = User(username=f"author{i}", email=f"author{i}@test.com", password="HASHED")
+            author.messages.append(Message(text=f"Message {i}"))
+            reader.following.append(author)
+
+        db.session.commit()
+        timeline_store.rebuild(reader.id)
+        db.session.commit()
+
+        self.reader_id = reader.id
+        self.config = dict(app.config)
+
+    def tearDown(self):
+        """Clean up fouled transactions and restore settings."""
+
+        db.session.rollback()
+        app.config.update(self.config)
+
+    def get_home(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+
+            return c.get("/")
+
+    def test_headers(self):
+        """Are query numbers sent back when enabled?"""
+
+        app.config['QUERY_STATS_HEADERS'] = True
+        app.config['QUERY_REPEAT_LIMIT'] = 100
+
+        resp = self.client.get(f"/users/{self.reader_id}")
+
+        self.assertGreater(int(resp.headers['X-Query-Count']), 0)
+        self.assertIn('X-Query-Time-Ms', resp.headers)
+        self.assertIn('X-Query-Max-Repeats', resp.headers)
+
+    def test_no_headers_in_production(self):
+        """Are query numbers kept out of responses in production?"""
+
+        resp = self.client.get(f"/users/{self.reader_id}")
+
+        self.assertNotIn('X-Query-Count', resp.headers)
+
+    def test_repeats_raise(self):
+        """Does a repeated per-row query fail the request when raising is on?"""
+
+        app.config['QUERY_BUDGET_RAISE'] = True
+        app.config['QUERY_REPEAT_LIMIT'] = 3
+
+        # timelines load their authors up front now, so repeat one by hand
+        stats = QueryStats()
+        for _ in range(4):
+            stats.record("SELECT * FROM users WHERE users.id = %(param_1)s", 0.001)
+
+        with app.test_request_context("/"):
+            with self.assertRaises(QueryBudgetExceeded):
+                check_budget(app, stats)
+
+    def test_budget_warns(self):
+        """Is a request over its query budget logged?"""
+
+        app.config['QUERY_BUDGET'] = 1
+
+        with self.assertLogs(app.logger, level='WARNING') as logs:
+            resp = self.get_home()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("budget 1", logs.output[0])
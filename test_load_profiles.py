@@ -0,0 +1,137 @@
+"""Message list loading tests: query counts per view."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_load_profiles.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from flask import g
+
+from app import app, CURR_USER_KEY
+from instrumentation import QueryStats
+from timelines import timeline_store
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# most SQL statements each view may run (with the viewer cached), however
+# many authors it shows: (the profile user,) the page of messages with
+# their authors, and which of them the viewer likes
+QUERY_LIMITS = {
+    'home': 2,
+    'profile': 3,
+    'likes': 3,
+}
+
+
+class LoadProfilesTestCase(TestCase):
+    """Test that message lists don't run a query per author."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+        self.config = dict(app.config)
+
+        app.config['QUERY_STATS_HEADERS'] = True
+
+    def tearDown(self):
+        """Clean up fouled transactions and restore settings."""
+
+        db.session.rollback()
+        app.config.update(self.config)
+
+    def add_authors(self, n):
+        """Have the reader follow, and like a message by, `n` more authors."""
+
+        reader = User.query.filter_by(username="reader").first()
+        if reader is None:
+            reader = User(username="reader", email="reader@test.com", password="HASHED")
+            reader.messages.append(Message(text="Mine"))
+            db.session.add(reader)
+
+        start = User.query.count()
+        for i in range(start, start + n):
+            author = User(username=f"author{i}", email=f"author{i}@test.com", password="HASHED")
+            msg = Message(text=f"Message {i}")
+            author.messages.append(msg)
+            reader.following.append(author)
+            reader.likes.append(msg)
+
+        db.session.commit()
+        timeline_store.rebuild(reader.id)
+        db.session.commit()
+
+        return reader.id
+
+    def query_counts(self, reader_id):
+        """SQL statements run by each message list view."""
+
+        urls = {
+            'home': "/",
+            'profile': f"/users/{reader_id}",
+            'likes': f"/users/{reader_id}/likes",
+        }
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = reader_id
+
+            # fill the current-user cache, so every view is measured warm
+            c.get("/")
+
+            return {view: int(c.get(url).headers['X-Query-Count'])
+                    for view, url in urls.items()}
+
+    def test_query_counts(self):
+        """Does each view stay within its limit, and not grow with authors?"""
+
+        few = self.query_counts(self.add_authors(2))
+        many = self.query_counts(self.add_authors(10))
+
+        self.assertEqual(few, many)
+
+        for view, limit in QUERY_LIMITS.items():
+            self.assertLessEqual(many[view], limit, view)
+
+    def test_authors_loaded_with_messages(self):
+        """Are authors' shown columns loaded by the page query itself?"""
+
+        self.add_authors(3)
+        db.session.expunge_all()
+
+        messages = Message.listing('timeline').all()
+
+        with app.test_request_context():
+            g.query_stats = QueryStats()
+
+            shown = {(msg.user.id, msg.user.username, msg.user.image_url) for msg in messages}
+
+            self.assertEqual(g.query_stats.count, 0)
+
+        self.assertEqual(len(shown), 4)
@@ -0,0 +1,120 @@
+"""Bulk CSV loader tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_loader.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app  # noqa: F401 (importing it connects `db` to DATABASE_URL)
+from loader import load_csvs
+import migrations
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+USERS_CSV = """email,username,image_url,password,bio,header_image_url,location
+a@test.com,alice,/static/images/default-pic.png,HASHED,,,
+b@test.com,bob,/static/images/default-pic.png,HASHED,"Hi, I'm Bob",,Boston
+"""
+
+MESSAGES_CSV = """id,text,timestamp,user_id
+900001,hello,2020-01-01 10:00:00,{alice}
+900002,"hello, again",2020-01-02 10:00:00,{bob}
+"""
+
+
+class LoaderTestCase(TestCase):
+    """Test loading CSVs with COPY."""
+
+    def setUp(self):
+        """Clear tables and write sample CSVs."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.write('users.csv', USERS_CSV)
+
+    def tearDown(self):
+        """Clean up fouled transactions and temp files."""
+
+        db.session.rollback()
+        self.directory.cleanup()
+
+    def write(self, filename, contents):
+        with open(os.path.join(self.directory.name, filename), 'w') as f:
+            f.write(contents)
+
+    def test_load(self):
+        """Are rows loaded, with empty fields as NULL?"""
+
+        stats = load_csvs([('users', 'users.csv')], self.directory.name)
+
+        self.assertEqual([(s.table, s.rows) for s in stats], [('users', 2), ('total', 2)])
+
+        bob = User.query.filter_by(username="bob").one()
+        self.assertEqual(bob.bio, "Hi, I'm Bob")
+        self.assertIsNone(User.query.filter_by(username="alice").one().bio)
+        self.assertEqual(bob.messages_count, 0)
+
+    def test_sequences_and_indexes(self):
+        """Are explicit ids kept (new messages sort after them), and do indexes survive?"""
+
+        load_csvs([('users', 'users.csv')], self.directory.name)
+        ids = dict(db.session.query(User.username, User.id))
+        db.session.commit()
+
+        self.write('messages.csv', MESSAGES_CSV.format(alice=ids['alice'], bob=ids['bob']))
+        load_csvs([('messages', 'messages.csv')], self.directory.name)
+
+        msg = Message(text="new", user_id=ids['alice'])
+        db.session.add(msg)
+        db.session.commit()
+
+        loaded = Message.query.filter(Message.id != msg.id).order_by(Message.id)
+        self.assertEqual([m.id for m in loaded], [900001, 900002])
+        self.assertGreater(msg.id, 900002)
+        self.assertEqual(migrations.missing_indexes(), [])
+
+    def test_failed_load_rolls_back(self):
+        """Does a bad CSV leave the table and its indexes untouched?"""
+
+        self.write('messages.csv', "text,timestamp,user_id\norphan,2020-01-01,-1\n")
+
+        with self.assertRaises(Exception):
+            load_csvs([('users', 'users.csv'), ('messages', 'messages.csv')],
+                      self.directory.name)
+
+        self.assertEqual(User.query.count(), 0)
+        self.assertEqual(migrations.missing_indexes(), [])
+
+    def test_unknown_column(self):
+        """Is a CSV with a column the table lacks rejected?"""
+
+        self.write('bad.csv', "username,nope\nx,y\n")
+
+        with self.assertRaises(ValueError):
+            load_csvs([('users', 'bad.csv')], self.directory.name)
@@ -0,0 +1,132 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_metrics.py
+
+
+import os
+import tempfile
+from multiprocessing import Process
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from metrics import Registry, MmapStore
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class RegistryTestCase(TestCase):
+    """Test metric types and the text format."""
+
+    def test_exposition(self):
+        """Are counters and cumulative histogram buckets rendered?"""
+
+        registry = Registry()
+        requests = registry.counter('requests_total', "Requests.")
+        latency = registry.histogram('latency_seconds', "Latency.", buckets=(0.1, 1.0, float('inf')))
+
+        requests.inc(route='/')
+        requests.inc(route='/')
+        latency.observe(0.5, route='/')
+        latency.observe(2, route='/')
+
+        text = registry.exposition()
+
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{route="/"} 2.0', text)
+        self.assertIn('latency_seconds_bucket{route="/",le="0.1"} 0.0', text)
+        self.assertIn('latency_seconds_bucket{route="/",le="1.0"} 1.0', text)
+        self.assertIn('latency_seconds_bucket{route="/",le="+Inf"} 2.0', text)
+        self.assertIn('latency_seconds_count{route="/"} 2.0', text)
+        self.assertIn('latency_seconds_sum{route="/"} 2.5', text)
+
+    def test_buckets_in_order(self):
+        """Are buckets listed smallest first?"""
+
+        registry = Registry()
+        latency = registry.histogram('latency_seconds', "Latency.", buckets=(0.1, 1.0, 10.0, float('inf')))
+        latency.observe(0.01)
+
+        buckets = [line for line in registry.exposition().splitlines() if '_bucket' in line]
+        self.assertEqual([line.split('"')[1] for line in buckets], ['0.1', '1.0', '10.0', '+Inf'])
+
+
+def add_from_child(directory):
+    store = MmapStore(directory)
+    for i in range(1000):
+        store.add(f'key_{i % 10}', 1)
+
+
+class MmapStoreTestCase(TestCase):
+    """Test sharing values between processes."""
+
+    def test_totals_across_processes(self):
+        """Are every process's values summed?"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            children = [Process(target=add_from_child, args=(directory,)) for _ in range(3)]
+            for child in children:
+                child.start()
+            for child in children:
+                child.join()
+
+            store = MmapStore(directory)
+            store.add('key_0', 0.5)
+
+            totals = store.totals()
+
+        self.assertEqual(totals['key_0'], 300.5)
+        self.assertEqual(totals['key_9'], 300)
+
+    def test_file_grows(self):
+        """Can one process hold more keys than fit in the initial file?"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = MmapStore(directory)
+            for i in range(5000):
+                store.add(f'a_long_metric_name_with_labels{{n="{i}"}}', i)
+
+            totals = store.totals()
+
+        self.assertEqual(len(totals), 5000)
+        self.assertEqual(totals['a_long_metric_name_with_labels{n="4999"}'], 4999)
+
+
+class MetricsEndpointTestCase(TestCase):
+    """Test /metrics."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_request_metrics(self):
+        """Are routes, templates and pool waits recorded?"""
+
+        self.client.get("/users")
+        text = self.client.get("/metrics").get_data(as_text=True)
+
+        self.assertIn('warbler_http_requests_total{method="GET",route="/users",status="200"}', text)
+        self.assertIn('warbler_http_request_duration_seconds_count{route="/users"}', text)
+        self.assertIn('warbler_template_render_duration_seconds_count{template="users/index.html"}', text)
+        self.assertIn('warbler_db_pool_checkout_wait_seconds_count', text)
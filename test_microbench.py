@@ -0,0 +1,64 @@
+"""Model helper scaling tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_microbench.py
+
+
+import os
+from unittest import TestCase
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app  # noqa: F401 (importing it connects `db` to DATABASE_URL)
+from hashing import password_hasher
+from microbench import run, scaling_exponent, BENCHMARK_BCRYPT_ROUNDS
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class ScalingExponentTestCase(TestCase):
+    """Test fitting growth exponents."""
+
+    def test_constant_and_linear(self):
+        """Is flat ~0 and proportional ~1?"""
+
+        self.assertAlmostEqual(scaling_exponent({100: 0.002, 1000: 0.002, 10000: 0.002}), 0)
+        self.assertAlmostEqual(scaling_exponent({100: 0.001, 1000: 0.01, 10000: 0.1}), 1)
+
+
+class MicrobenchTestCase(TestCase):
+    """Time the hot model helpers at a few sizes."""
+
+    def setUp(self):
+        self.rounds = password_hasher.rounds
+        password_hasher.rounds = BENCHMARK_BCRYPT_ROUNDS
+
+    def tearDown(self):
+        """Clean up fouled transactions and the fixture graph."""
+
+        password_hasher.rounds = self.rounds
+        db.session.rollback()
+        db.session.execute("TRUNCATE users, messages, follows, likes, timeline_entries "
+                           "RESTART IDENTITY CASCADE")
+        db.session.commit()
+
+    def test_helpers_scale(self):
+        """Does every helper stay within its scaling threshold up to 10k relations?"""
+
+        for result in run(sizes=(100, 1000, 10000)):
+            self.assertLessEqual(result.exponent, result.limit, result)
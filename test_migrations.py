@@ -0,0 +1,193 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, SchemaMigration, User, Message, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app  # noqa: F401 (importing it connects `db` to DATABASE_URL)
+import migrations
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class MigrationsTestCase(TestCase):
+    """Test versioned migrations and the missing-index check."""
+
+    def setUp(self):
+        """Start from an unmigrated database."""
+
+        SchemaMigration.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions and put back any dropped index."""
+
+        db.session.rollback()
+        migrations.upgrade()
+
+    def drop_index(self, name):
+        db.session.execute(f"DROP INDEX IF EXISTS {name}")
+        db.session.commit()
+
+    def test_create_all_matches_models(self):
+        """Does a fresh database have every model index?"""
+
+        self.assertEqual(migrations.missing_indexes(), [])
+
+    def test_stamp(self):
+        """Does stamping mark every migration applied?"""
+
+        self.assertEqual(len(migrations.pending()), len(migrations.MIGRATIONS))
+
+        migrations.stamp()
+        db.session.commit()
+
+        self.assertEqual(migrations.pending(), [])
+
+    def test_missing_index_reported_and_rebuilt(self):
+        """Is a dropped index reported, then recreated by upgrade?"""
+
+        self.drop_index('ix_messages_user_id_id')
+
+        missing = migrations.missing_indexes()
+        self.assertEqual([index.name for index in missing], ['ix_messages_user_id_id'])
+        self.assertEqual(missing[0].columns, ['user_id', 'id'])
+
+        applied = migrations.upgrade()
+
+        self.assertEqual(applied, migrations.MIGRATIONS)
+        self.assertEqual(migrations.missing_indexes(), [])
+        self.assertEqual(migrations.pending(), [])
+
+    def test_upgrade_is_idempotent(self):
+        """Can migrations re-run against indexes that already exist?"""
+
+        migrations.upgrade()
+        SchemaMigration.query.delete()
+        db.session.commit()
+
+        migrations.upgrade()
+        self.assertEqual(migrations.missing_indexes(), [])
+
+    def test_invalid_index_is_rebuilt(self):
+        """Is an index left INVALID by a failed concurrent build replaced?"""
+
+        db.session.execute(
+            "UPDATE pg_index SET indisvalid = false "
+            "WHERE indexrelid = 'ix_likes_message_id_user_id'::regclass")
+        db.session.commit()
+
+        self.assertIn('ix_likes_message_id_user_id',
+                      [index.name for index in migrations.missing_indexes()])
+
+        migrations.upgrade()
+        self.assertEqual(migrations.missing_indexes(), [])
+
+
+# the schema `db.create_all()` made before there were any migrations
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id SERIAL PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    username TEXT NOT NULL UNIQUE,
+    image_url TEXT,
+    header_image_url TEXT,
+    bio TEXT,
+    location TEXT,
+    password TEXT NOT NULL
+);
+CREATE TABLE follows (
+    user_being_followed_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    user_following_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    PRIMARY KEY (user_being_followed_id, user_following_id)
+);
+CREATE TABLE messages (
+    id SERIAL PRIMARY KEY,
+    text VARCHAR(140) NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE
+);
+CREATE TABLE likes (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    message_id INTEGER UNIQUE REFERENCES messages (id) ON DELETE CASCADE
+);
+"""
+
+
+class UpgradeFromBaselineTestCase(TestCase):
+    """Test migrating a database that predates the migrations."""
+
+    def setUp(self):
+        """Replace the schema with the original one, plus a little data."""
+
+        db.session.remove()
+        db.drop_all()
+
+        db.session.execute(BASELINE_SCHEMA)
+        db.session.execute(
+            "INSERT INTO users (id, email, username, password) VALUES "
+            "(1, 'a@test.com', 'alice', 'HASHED'), (2, 'b@test.com', 'bob', 'HASHED')")
+        db.session.execute(
+            "INSERT INTO messages (id, text, timestamp, user_id) VALUES "
+            "(1, 'Later', '2020-01-02', 1), (2, 'Earlier', '2020-01-01', 1)")
+        db.session.execute("INSERT INTO follows VALUES (1, 2)")
+        db.session.execute("INSERT INTO likes (user_id, message_id) VALUES (2, 1)")
+        db.session.commit()
+
+    def tearDown(self):
+        """Put back the schema the models make."""
+
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+        migrations.stamp()
+        db.session.commit()
+
+    def test_upgrade_reaches_model_schema(self):
+        """Does upgrading the original schema give the models' tables and data?"""
+
+        migrations.upgrade()
+
+        self.assertEqual(migrations.missing_indexes(), [])
+
+        alice = User.query.get(1)
+        bob = User.query.get(2)
+        self.assertEqual((alice.messages_count, alice.followers_count), (2, 1))
+        self.assertEqual((bob.following_count, bob.likes_count), (1, 1))
+
+        # renumbered by time, likes and timelines following along
+        earlier, later = Message.query.order_by(Message.id).all()
+        self.assertEqual([earlier.text, later.text], ['Earlier', 'Later'])
+        self.assertEqual(later.like_count, 1)
+        self.assertEqual(Likes.query.one().message_id, later.id)
+        self.assertEqual(sorted((entry.user_id, entry.message_id)
+                                for entry in TimelineEntry.query),
+                         sorted([(1, earlier.id), (1, later.id),
+                                 (2, earlier.id), (2, later.id)]))
+
+        # new messages get time-ordered ids from the trigger
+        msg = Message(text="Newest", user_id=2)
+        db.session.add(msg)
+        db.session.commit()
+        self.assertGreater(msg.id, later.id)
@@ -0,0 +1,130 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from pagination import encode_cursor, decode_cursor, keyset_page
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Test cursor pagination of message lists."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Likes.query.delete()
+
+        self.client = app.test_client()
+
+        user = User(email="test1@test.com",
+                    username="testuser1",
+                    password="HASHED_PASSWORD1")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        start = datetime(2020, 1, 1)
+
+        # two messages share a timestamp; their ids still differ, in posting order
+        timestamps = [start, start, start + timedelta(days=1),
+                      start + timedelta(days=2), start + timedelta(days=3)]
+
+        messages = [Message(text=f"message {i}", user_id=user.id, timestamp=ts)
+                    for i, ts in enumerate(timestamps)]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        self.newest_first = [msg.id for msg in
+                             sorted(messages,
+                                    key=lambda m: (m.timestamp, m.id),
+                                    reverse=True)]
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_cursor_round_trip(self):
+        """Can a cursor be decoded back into its position?"""
+
+        self.assertEqual(decode_cursor(encode_cursor(42)), 42)
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor("not-a-cursor"))
+        self.assertIsNone(decode_cursor("-1"))
+
+    def test_pages_cover_everything_once(self):
+        """Does following cursors walk every message exactly once, in order?"""
+
+        query = Message.query.filter(Message.user_id == self.user_id)
+
+        seen = []
+        before = None
+
+        while True:
+            page = keyset_page(query, Message.id,
+                               before=before, per_page=2)
+            seen.extend(msg.id for msg in page.items)
+            if not page.next_cursor:
+                break
+            before = decode_cursor(page.next_cursor)
+
+        self.assertEqual(seen, self.newest_first)
+
+    def test_profile_before_cursor(self):
+        """Does the profile page honor ?before=?"""
+
+        newest = Message.query.get(self.newest_first[0])
+        cursor = encode_cursor(newest.id)
+
+        resp = self.client.get(f"/users/{self.user_id}?before={cursor}")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn(newest.text, html)
+        self.assertIn("message 0", html)
+
+    def test_likes_page_uses_join(self):
+        """Does the likes page list liked messages?"""
+
+        liked = Message.query.get(self.newest_first[-1])
+        liked_text = liked.text
+        db.session.add(Likes(user_id=self.user_id, message_id=liked.id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.get(f"/users/{self.user_id}/likes")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn(liked_text, html)
+            self.assertNotIn("message 4", html)
+            self.assertNotIn('id="load-more"', html)
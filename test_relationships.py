@@ -0,0 +1,183 @@
+"""Follow/like write tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_relationships.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from relationships import State, follow, unfollow, like, unlike, _insert_new
+import counters
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RelationshipsTestCase(TestCase):
+    """Test idempotent follow/like writes."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        fan = User(username="fan", email="fan@test.com", password="HASHED")
+        star = User(username="star", email="star@test.com", password="HASHED")
+        star.messages.append(Message(text="Hello"))
+        db.session.add_all([fan, star])
+        db.session.commit()
+
+        self.fan_id = fan.id
+        self.star_id = star.id
+        self.message_id = star.messages[0].id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+        db.session.refresh(user)
+        return user.following_count, user.followers_count, user.likes_count
+
+    def test_follow_twice(self):
+        """Is a repeated follow a no-op rather than an error?"""
+
+        self.assertEqual(follow(self.fan_id, self.star_id), State(active=True, changed=True))
+        self.assertEqual(follow(self.fan_id, self.star_id), State(active=True, changed=False))
+        db.session.commit()
+
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(self.counts(self.fan_id), (1, 0, 0))
+        self.assertEqual(self.counts(self.star_id), (0, 1, 0))
+
+        # the star's message was backfilled into the fan's timeline, once
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.fan_id).count(), 1)
+
+    def test_unfollow_twice(self):
+        follow(self.fan_id, self.star_id)
+
+        self.assertEqual(unfollow(self.fan_id, self.star_id), State(active=False, changed=True))
+        self.assertEqual(unfollow(self.fan_id, self.star_id), State(active=False, changed=False))
+        db.session.commit()
+
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(self.counts(self.fan_id), (0, 0, 0))
+        self.assertEqual(self.counts(self.star_id), (0, 0, 0))
+
+    def test_like_and_unlike_twice(self):
+        self.assertEqual(like(self.fan_id, self.message_id), State(active=True, changed=True))
+        self.assertEqual(like(self.fan_id, self.message_id), State(active=True, changed=False))
+        self.assertEqual(self.counts(self.fan_id), (0, 0, 1))
+
+        self.assertEqual(unlike(self.fan_id, self.message_id), State(active=False, changed=True))
+        self.assertEqual(unlike(self.fan_id, self.message_id), State(active=False, changed=False))
+        self.assertEqual(self.counts(self.fan_id), (0, 0, 0))
+
+    def test_collections_not_loaded(self):
+        """Do writes leave the user's collections unloaded?"""
+
+        fan = User.query.get(self.fan_id)
+
+        follow(self.fan_id, self.star_id)
+        like(self.fan_id, self.message_id)
+
+        self.assertNotIn('following', fan.__dict__)
+        self.assertNotIn('likes', fan.__dict__)
+
+    def test_double_click_follow(self):
+        """Does posting the follow form twice succeed both times?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+
+            first = c.post(f"/users/follow/{self.star_id}")
+            second = c.post(f"/users/follow/{self.star_id}")
+
+        self.assertEqual((first.status_code, second.status_code), (302, 302))
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(self.counts(self.star_id), (0, 1, 0))
+
+    def test_many_users_like_one_message(self):
+        """Can everyone like the same message, and is it counted?"""
+
+        self.assertTrue(like(self.fan_id, self.message_id).changed)
+        self.assertTrue(like(self.star_id, self.message_id).changed)
+        db.session.commit()
+
+        self.assertEqual(Message.query.get(self.message_id).like_count, 2)
+
+        unlike(self.fan_id, self.message_id)
+        db.session.commit()
+        db.session.expire_all()
+
+        self.assertEqual(Message.query.get(self.message_id).like_count, 1)
+
+    def test_deleting_liker_uncounts_likes(self):
+        like(self.fan_id, self.message_id)
+        db.session.commit()
+
+        fan = User.query.get(self.fan_id)
+        counters.user_deleted(fan)
+        db.session.delete(fan)
+        db.session.commit()
+        db.session.expire_all()
+
+        self.assertEqual(Message.query.get(self.message_id).like_count, 0)
+
+    def test_insert_new_on_sqlite(self):
+        """Are repeated follows and likes no-ops on SQLite too?"""
+
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(engine)
+        session = Session(bind=engine)
+
+        fan = User(username="fan", email="fan@test.com", password="HASHED")
+        star = User(username="star", email="star@test.com", password="HASHED")
+        session.add_all([fan, star])
+        session.flush()
+        msg = Message(text="Hello", user_id=star.id)
+        session.add(msg)
+        session.flush()
+
+        follows = dict(user_following_id=fan.id, user_being_followed_id=star.id)
+        self.assertTrue(_insert_new(session, Follows.__table__, **follows))
+        self.assertFalse(_insert_new(session, Follows.__table__, **follows))
+
+        likes = dict(user_id=fan.id, message_id=msg.id)
+        self.assertTrue(_insert_new(session, Likes.__table__, **likes))
+        self.assertFalse(_insert_new(session, Likes.__table__, **likes))
+
+        self.assertEqual(session.query(Follows).count(), 1)
+        self.assertEqual(session.query(Likes).count(), 1)
+        session.close()
@@ -0,0 +1,319 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_search.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from search import (user_search, message_search, create_search_indexes,
+                    NgramIndex, MemoryUserSearch, InvertedIndex,
+                    MemoryMessageSearch, PostgresMessageSearch, tokenize)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class NgramIndexTestCase(TestCase):
+    """Test the in-process n-gram index."""
+
+    def setUp(self):
+        self.index = NgramIndex()
+
+        for doc_id, text in enumerate(["warbler", "Warble", "robin", "blue_jay",
+                                       "bluebird", "ble"]):
+            self.index.add(doc_id, text)
+
+    def test_substring_matches(self):
+        """Do long and short queries both find every substring match?"""
+
+        self.assertEqual(set(self.index.search("arbl", 10)), {0, 1})
+        self.assertEqual(set(self.index.search("bl", 10)), {0, 1, 3, 4, 5})
+        self.assertEqual(self.index.search("sparrow", 10), [])
+
+    def test_ranking(self):
+        """Are exact matches first, then prefix matches?"""
+
+        results = self.index.search("ble", 10)
+
+        self.assertEqual(results[0], 5)
+        self.assertEqual(set(results), {0, 1, 5})
+
+        # equally similar prefix matches fall back to alphabetical order
+        self.assertEqual(self.index.search("blue", 10), [3, 4])
+
+    def test_limit_and_offset(self):
+        """Do limit/offset page through the ranked results?"""
+
+        everything = self.index.search("b", 10)
+
+        self.assertEqual(self.index.search("b", 2), everything[:2])
+        self.assertEqual(self.index.search("b", 2, offset=2), everything[2:4])
+
+    def test_reindex_and_remove(self):
+        """Does re-adding a doc replace its text, and remove drop it?"""
+
+        self.index.add(2, "sparrow")
+        self.assertEqual(self.index.search("robin", 10), [])
+        self.assertEqual(self.index.search("sparrow", 10), [2])
+
+        self.index.remove(2)
+        self.assertEqual(self.index.search("sparrow", 10), [])
+        self.assertEqual(len(self.index), 5)
+
+    def test_candidates_capped(self):
+        """Does a capped search still rank exact, then prefix matches first?"""
+
+        index = NgramIndex(max_candidates=2)
+        for doc_id, text in enumerate(["xbox", "boxer", "bo", "box", "elbow"]):
+            index.add(doc_id, text)
+
+        self.assertEqual(index.search("bo", 2), [2, 3])
+        self.assertEqual(index.search("bo", 1, offset=1), [3])
+        self.assertEqual(index.search("bo", 5), [2, 3, 1, 4, 0])
+
+
+class UserSearchTestCase(TestCase):
+    """Test /users?q= search."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+
+        self.client = app.test_client()
+        user_search.backend = MemoryUserSearch()
+
+        for name in ["warbler", "warbler2", "robin", "bluejay"]:
+            db.session.add(User(email=f"{name}@test.com",
+                                username=name,
+                                password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        user_search.backend.warm()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        user_search.backend = None
+
+    def test_search_route(self):
+        """Does /users?q= list only matching users?"""
+
+        html = self.client.get("/users?q=WARB").get_data(as_text=True)
+
+        self.assertIn("@warbler<", html)
+        self.assertIn("@warbler2<", html)
+        self.assertNotIn("@robin", html)
+
+    def test_search_pages(self):
+        """Do search pages report whether there's more?"""
+
+        first = user_search.search("warb", page=1, per_page=1)
+        second = user_search.search("warb", page=2, per_page=1)
+
+        self.assertEqual([u.username for u in first.items], ["warbler"])
+        self.assertTrue(first.has_next)
+        self.assertEqual([u.username for u in second.items], ["warbler2"])
+        self.assertFalse(second.has_next)
+
+    def test_search_before_warm(self):
+        """Are searches answered from the table until the index is built?"""
+
+        backend = MemoryUserSearch()
+        # pretend it's being built, so no thread is started here
+        backend._refreshing = True
+        user_search.backend = backend
+
+        with app.app_context():
+            page = user_search.search("warb")
+
+        self.assertEqual([u.username for u in page.items], ["warbler", "warbler2"])
+        self.assertIsNone(backend.index)
+
+    def test_index_tracks_changes(self):
+        """Are renamed users found under their new name?"""
+
+        robin = User.query.filter_by(username="robin").one()
+        robin.username = "sparrow"
+        db.session.commit()
+        user_search.index_user(robin)
+
+        self.assertEqual(user_search.search("robin").items, [])
+        self.assertEqual([u.username for u in user_search.search("sparrow").items],
+                         ["sparrow"])
+
+
+class InvertedIndexTestCase(TestCase):
+    """Test the in-process message word index."""
+
+    def setUp(self):
+        self.index = InvertedIndex()
+
+        texts = ["The early bird catches the worm",
+                 "Bird bird bird, bird is the word",
+                 "Worms are early risers",
+                 "Nothing to see here"]
+
+        for doc_id, text in enumerate(texts, 1):
+            self.index.add(doc_id, text)
+
+    def ids(self, matches):
+        return [id for score, id in matches]
+
+    def test_tokenize(self):
+        """Are words lowercased and stopwords dropped?"""
+
+        self.assertEqual(tokenize("The Bird's WORD, is it?"), ["bird's", "word"])
+
+    def test_every_term_must_match(self):
+        """Do results contain all query words, newest first?"""
+
+        self.assertEqual(self.ids(self.index.search("bird")), [2, 1])
+        self.assertEqual(self.ids(self.index.search("early bird")), [1])
+        self.assertEqual(self.index.search("early penguin"), [])
+        self.assertEqual(self.index.search("the"), [])
+
+    def test_relevance_and_cursor(self):
+        """Does relevance order favour repeated terms, and cursors continue?"""
+
+        first = self.index.search("bird", sort='relevant', limit=1)
+        self.assertEqual(self.ids(first), [2])
+
+        rest = self.index.search("bird", sort='relevant', before=first[0])
+        self.assertEqual(self.ids(rest), [1])
+
+    def test_remove(self):
+        """Does a removed message stop matching?"""
+
+        self.index.remove(2)
+        self.assertEqual(self.ids(self.index.search("bird")), [1])
+
+
+class MessageSearchTestCase(TestCase):
+    """Test /messages/search."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        user = User(email="test@test.com",
+                    username="testuser",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        for i in range(5):
+            db.session.add(Message(text=f"Warbling about birds, part {i}",
+                                   user_id=user.id,
+                                   timestamp=start + timedelta(days=i)))
+        db.session.add(Message(text="Something else entirely",
+                               user_id=user.id,
+                               timestamp=start))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        message_search.backend = None
+
+    def walk(self, sort):
+        """Follow cursors through every page of a search for 'birds'."""
+
+        texts = []
+        cursor = None
+
+        while True:
+            page = message_search.search("birds", sort=sort, cursor=cursor,
+                                         per_page=2)
+            texts.extend(msg.text for msg in page.items)
+            if not page.next_cursor:
+                return texts
+            cursor = page.next_cursor
+
+    def test_memory_backend(self):
+        """Does the in-process index page through every match?"""
+
+        message_search.backend = MemoryMessageSearch()
+        message_search.backend.warm()
+
+        self.assertEqual(self.walk('recent'),
+                         [f"Warbling about birds, part {i}" for i in range(4, -1, -1)])
+        self.assertEqual(len(self.walk('relevant')), 5)
+
+    def test_postgres_backend(self):
+        """Does the tsvector backend page through every match?"""
+
+        create_search_indexes()
+        db.session.commit()
+        message_search.backend = PostgresMessageSearch()
+
+        self.assertEqual(self.walk('recent'),
+                         [f"Warbling about birds, part {i}" for i in range(4, -1, -1)])
+        self.assertEqual(len(self.walk('relevant')), 5)
+
+    def test_memory_backend_before_warm(self):
+        """Is a search refused, not run against the table, while the index is built?"""
+
+        backend = MemoryMessageSearch()
+        # pretend it's being built, so no thread is started here
+        backend._warming = True
+        message_search.backend = backend
+
+        resp = self.client.get("/messages/search?q=birds")
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '5')
+        self.assertEqual(len(backend.index), 0)
+
+    def test_memory_backend_late_commit(self):
+        """Is a message whose id is below ones already indexed still found?"""
+
+        message_search.backend = MemoryMessageSearch()
+        message_search.backend.warm()
+
+        newest = Message.query.order_by(Message.id.desc()).first()
+        late = Message(text="Late birds", user_id=newest.user_id,
+                       timestamp=newest.timestamp - timedelta(seconds=5))
+        db.session.add(late)
+        db.session.commit()
+
+        self.assertLess(late.id, message_search.backend.index.max_id)
+        self.assertIn("Late birds", self.walk('recent'))
+
+    def test_search_route(self):
+        """Does /messages/search render matching messages only?"""
+
+        message_search.backend = MemoryMessageSearch()
+        message_search.backend.warm()
+
+        html = self.client.get("/messages/search?q=birds").get_data(as_text=True)
+
+        self.assertIn("part 4", html)
+        self.assertNotIn("Something else", html)
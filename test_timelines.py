@@ -0,0 +1,274 @@
+"""Materialized timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_timelines.py
+
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from timelines import (timeline_store, SQLTimelineBackend, MemoryTimelineBackend,
+                       AuthorRingTimelineBackend)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out-on-write timelines."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        TimelineEntry.query.delete()
+
+        self.client = app.test_client()
+
+        self.author = User(email="author@test.com",
+                           username="author",
+                           password="HASHED_PASSWORD")
+        self.reader = User(email="reader@test.com",
+                           username="reader",
+                           password="HASHED_PASSWORD")
+
+        db.session.add_all([self.author, self.reader])
+        db.session.commit()
+
+        self.author_id = self.author.id
+        self.reader_id = self.reader.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        timeline_store.backend = SQLTimelineBackend()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def timeline_ids(self, user_id):
+        return [msg.id for msg in timeline_store.page(user_id).items]
+
+    def test_post_fans_out_to_followers(self):
+        """Does posting a message put it on each follower's timeline?"""
+
+        self.reader.following.append(self.author)
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "Fanned out"})
+
+        msg = Message.query.filter_by(text="Fanned out").one()
+
+        self.assertEqual(self.timeline_ids(self.reader_id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.author_id), [msg.id])
+
+    def test_follow_backfills_and_unfollow_purges(self):
+        """Does following pull in old messages and unfollowing drop them?"""
+
+        msg = Message(text="Older message", user_id=self.author_id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+
+            c.post(f"/users/follow/{self.author_id}")
+            self.assertEqual(self.timeline_ids(self.reader_id), [msg_id])
+
+            c.post(f"/users/stop-following/{self.author_id}")
+            self.assertEqual(self.timeline_ids(self.reader_id), [])
+
+    def test_delete_removes_from_timelines(self):
+        """Does deleting a message take it off every timeline?"""
+
+        self.reader.following.append(self.author)
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "Short-lived"})
+
+            msg = Message.query.filter_by(text="Short-lived").one()
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_homepage_reads_timeline(self):
+        """Does the homepage render messages from the materialized timeline?"""
+
+        self.reader.following.append(self.author)
+        db.session.commit()
+
+        msg = Message(text="Rebuilt message", user_id=self.author_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        timeline_store.rebuild(self.reader_id)
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            resp = c.get("/")
+
+            self.assertIn("Rebuilt message", resp.get_data(as_text=True))
+
+    def test_memory_backend(self):
+        """Does the in-process backend track posts and deletes?"""
+
+        timeline_store.backend = MemoryTimelineBackend()
+
+        self.reader.following.append(self.author)
+        db.session.commit()
+
+        # load the reader's (empty) timeline before anything is posted
+        self.assertEqual(self.timeline_ids(self.reader_id), [])
+
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "In memory"})
+
+            msg = Message.query.filter_by(text="In memory").one()
+            self.assertEqual(self.timeline_ids(self.reader_id), [msg.id])
+
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(self.timeline_ids(self.reader_id), [])
+
+    def test_ring_backend(self):
+        """Does the per-author ring backend track follows, posts and deletes?"""
+
+        timeline_store.backend = AuthorRingTimelineBackend()
+        timeline_store.warm()
+
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "In a ring"})
+            msg = Message.query.filter_by(text="In a ring").one()
+            msg_id = msg.id
+
+            # following shows the author's messages without any backfill
+            self.login(c, self.reader_id)
+            c.post(f"/users/follow/{self.author_id}")
+            self.assertEqual(self.timeline_ids(self.reader_id), [msg_id])
+
+            self.login(c, self.author_id)
+            c.post(f"/messages/{msg_id}/delete")
+            self.assertEqual(self.timeline_ids(self.reader_id), [])
+
+    def test_ring_merge_and_fallback(self):
+        """Are authors' rings merged newest first, past the depth they hold?"""
+
+        self.reader.following.append(self.author)
+        start = datetime(2020, 1, 1)
+        for i in range(6):
+            user_id = self.author_id if i % 3 else self.reader_id
+            db.session.add(Message(text=f"Message {i}", user_id=user_id,
+                                   timestamp=start + timedelta(hours=i)))
+        db.session.commit()
+
+        newest_first = [msg.id for msg in Message.query.order_by(Message.id.desc())]
+
+        timeline_store.backend = AuthorRingTimelineBackend(length=2)
+        timeline_store.warm()
+
+        seen = []
+        cursor = None
+        while True:
+            page = timeline_store.page(self.reader_id, before=cursor, per_page=2)
+            seen.extend(msg.id for msg in page.items)
+            if not page.next_cursor:
+                break
+            cursor = int(page.next_cursor)
+
+        self.assertEqual(seen, newest_first)
+
+    def test_ring_fallback_after_delete(self):
+        """Does a full ring that loses a message still lead to older ones?"""
+
+        start = datetime(2020, 1, 1)
+        for i in range(3):
+            db.session.add(Message(text=f"Message {i}", user_id=self.author_id,
+                                   timestamp=start + timedelta(hours=i)))
+        db.session.commit()
+
+        timeline_store.backend = AuthorRingTimelineBackend(length=2)
+        timeline_store.warm()
+
+        newest = Message.query.order_by(Message.id.desc()).first()
+        timeline_store.retract(newest)
+        db.session.delete(newest)
+        db.session.commit()
+
+        texts = [msg.text for msg in timeline_store.page(self.author_id).items]
+        self.assertEqual(texts, ["Message 1", "Message 0"])
+
+    def test_ring_sync(self):
+        """Are messages posted through another host synced into the rings?"""
+
+        backend = AuthorRingTimelineBackend()
+        timeline_store.backend = backend
+        newest = backend.warm()
+
+        # as if posted through another host: in the table, never published here
+        msg = Message(text="Elsewhere", user_id=self.author_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.author_id), [])
+        self.assertEqual(backend.sync(newest), msg.id)
+        self.assertEqual(self.timeline_ids(self.author_id), [msg.id])
+
+    def test_shared_rings_seen_by_every_worker(self):
+        """Do rings in SHARED_STATE_DIR show one worker's writes to another?"""
+
+        self.reader.following.append(self.author)
+        db.session.commit()
+
+        with tempfile.TemporaryDirectory() as directory:
+            posting = AuthorRingTimelineBackend(directory=directory)
+            reading = AuthorRingTimelineBackend(directory=directory)
+
+            self.assertFalse(reading.rings.ready)
+            posting.warm()
+            self.assertTrue(reading.rings.ready)
+
+            msg = Message(text="Shared", user_id=self.author_id)
+            db.session.add(msg)
+            db.session.flush()
+            posting.publish(msg)
+            db.session.commit()
+
+            timeline_store.backend = reading
+            self.assertEqual(self.timeline_ids(self.reader_id), [msg.id])
+
+            posting.retract(msg)
+            self.assertEqual(reading.rings.get([self.author_id]), [])
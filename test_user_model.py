@@ -6,10 +6,12 @@
 
 
 import os
+from datetime import datetime
 from unittest import TestCase
 
 from models import db, User, Message, Follows, Likes
 
+from sqlalchemy import create_engine
 from sqlalchemy.exc import IntegrityError
 
 # BEFORE we import our app, let's set an environmental variable
@@ -258,3 +260,21 @@ class UserModelTestCase(TestCase):
         user = User.authenticate(user3.username, 'wrong_password')
 
         self.assertFalse(user)
+
+    def test_updated_at_on_sqlite(self):
+        """Is updated_at filled in and bumped on databases other than Postgres?"""
+
+        engine = create_engine('sqlite://')
+        users = User.__table__
+
+        with engine.begin() as conn:
+            users.create(conn)
+            conn.execute(users.insert(), email="lite@test.com", username="lite",
+                         password="HASHED_PASSWORD")
+            self.assertIsNotNone(conn.execute(db.select([users.c.updated_at])).scalar())
+
+            conn.execute(users.update().values(updated_at=datetime(2000, 1, 1)))
+            conn.execute(users.update().values(bio="Updated"))
+            updated = conn.execute(db.select([users.c.updated_at])).scalar()
+
+        self.assertGreater(updated, datetime(2000, 1, 1))
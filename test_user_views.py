@@ -6,9 +6,11 @@
 
 
 import os
+import re
 from unittest import TestCase
+from unittest.mock import patch
 
-from models import db, connect_db, User, Message, Follows, Likes
+from models import db, connect_db, User, Message, Follows, Likes, CARD_COLUMNS
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -199,6 +201,44 @@ class UserViewTestCase(TestCase):
         html = resp.get_data(as_text=True)
         self.assertIn('You must be logged in to access this page', html)
 
+    def test_followers_pages(self):
+        """Do followers come a page of cards at a time, each exactly once?"""
+
+        star_id = self.testuser2.id
+        fans = [User(username=f"fan{i}", email=f"fan{i}@test.com", password="HASHED")
+                for i in range(5)]
+        db.session.add_all(fans)
+        db.session.flush()
+        db.session.add_all(Follows(user_being_followed_id=star_id, user_following_id=fan.id)
+                           for fan in fans)
+        db.session.commit()
+
+        seen = []
+        url = f"/users/{star_id}/followers"
+
+        with self.client as c, patch('app.CARD_PAGE_SIZE', 2):
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1.id
+
+            while url:
+                html = c.get(url).get_data(as_text=True)
+                cards = re.findall(r"<p>@(fan\d)</p>", html)
+                self.assertLessEqual(len(cards), 2)
+                seen.extend(cards)
+
+                more = re.search(r'href="(\?before=\d+)"', html)
+                url = f"/users/{star_id}/followers{more.group(1)}" if more else None
+
+        self.assertEqual(sorted(seen), [f"fan{i}" for i in range(5)])
+
+    def test_cards_skip_private_columns(self):
+        """Do follower/following cards load only what they show?"""
+
+        card = User.cards().filter(User.id == self.testuser1.id).one()
+
+        self.assertEqual(card.keys(), list(CARD_COLUMNS))
+        self.assertEqual(card.username, "test1user")
+
     def test_view_likes_logged_in(self):
         """When you’re logged in, can you see the likes page for any user?"""
         
@@ -0,0 +1,133 @@
+"""Viewer state resolver tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_viewer.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from viewer import liked_message_ids, follow_relationships, NOT_RELATED
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class ViewerStateTestCase(TestCase):
+    """Test batched lookups of what the viewer has liked/followed."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        Likes.query.delete()
+
+        self.client = app.test_client()
+
+        self.viewer = User(email="viewer@test.com",
+                           username="viewer",
+                           password="HASHED_PASSWORD")
+        self.author = User(email="author@test.com",
+                           username="author",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.viewer, self.author])
+        db.session.commit()
+
+        self.messages = [Message(text=f"message {i}", user_id=self.author.id)
+                         for i in range(3)]
+        db.session.add_all(self.messages)
+        db.session.commit()
+
+        db.session.add(Likes(user_id=self.viewer.id,
+                             message_id=self.messages[1].id))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_liked_message_ids(self):
+        """Does the resolver return exactly the liked ids on the page?"""
+
+        self.assertEqual(liked_message_ids(self.viewer, self.messages),
+                         {self.messages[1].id})
+        self.assertEqual(liked_message_ids(self.author, self.messages), set())
+
+    def test_liked_message_ids_no_viewer(self):
+        """Do anonymous viewers and empty pages skip the query?"""
+
+        self.assertEqual(liked_message_ids(None, self.messages), set())
+        self.assertEqual(liked_message_ids(self.viewer, []), set())
+
+    def test_profile_renders_liked_state(self):
+        """Does the profile page mark liked messages with a filled heart?"""
+
+        author_id = self.author.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer.id
+
+            html = c.get(f"/users/{author_id}").get_data(as_text=True)
+
+            self.assertEqual(html.count('<i class="fas fa-heart">'), 1)
+            self.assertEqual(html.count('<i class="far fa-heart">'), 2)
+
+    def test_follow_relationships(self):
+        """Are both follow directions resolved for every id at once?"""
+
+        other = User(email="other@test.com",
+                     username="other",
+                     password="HASHED_PASSWORD")
+        db.session.add(other)
+        self.viewer.following.append(self.author)
+        other.following.append(self.viewer)
+        db.session.commit()
+
+        relationships = follow_relationships(self.viewer,
+                                             [self.author.id, other.id])
+
+        self.assertTrue(relationships[self.author.id].following)
+        self.assertFalse(relationships[self.author.id].followed_by)
+        self.assertFalse(relationships[other.id].following)
+        self.assertTrue(relationships[other.id].followed_by)
+
+        # ids that weren't asked about are simply unrelated
+        self.assertEqual(relationships[-1], NOT_RELATED)
+        self.assertEqual(follow_relationships(None, [other.id])[other.id],
+                         NOT_RELATED)
+
+    def test_users_page_renders_follow_state(self):
+        """Does the /users grid show Unfollow only for followed users?"""
+
+        self.viewer.following.append(self.author)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer.id
+
+            html = c.get("/users").get_data(as_text=True)
+
+            self.assertEqual(html.count(">Unfollow</button>"), 1)
+            self.assertEqual(html.count(">Follow</button>"), 1)
@@ -0,0 +1,788 @@
+"""Materialized home timelines for Warbler.
+
+Instead of rebuilding a user's timeline from everyone they follow on every
+homepage hit, messages are fanned out to their followers when posted. The
+homepage then reads a single user's timeline back in order.
+
+Two backends are available, picked with the TIMELINE_BACKEND config value:
+
+- "sql" (default): rows in the `timeline_entries` table, read back through
+  its (user_id, message_id) primary key; message ids are time-ordered.
+- "memory": per-process sorted lists of message ids, loaded from the database the first
+  time a user's timeline is read. Useful for single-process deployments
+  and development; each worker keeps its own copy.
+- "rings": arrays of each author's most recent message ids, shared by the
+  workers on a host through SHARED_STATE_DIR (see workers.py) and warmed
+  in the background as they start. A home page is a k-way merge of the
+  rings of everyone the viewer follows, so nothing is fanned out on write
+  and follows/unfollows cost nothing. Each host has its own rings: posts
+  made through other hosts reach them by a re-sync from the messages table
+  every RING_SYNC_INTERVAL seconds.
+"""
+
+from array import array
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from itertools import islice
+from operator import itemgetter
+from threading import Lock
+import heapq
+import logging
+import os
+import struct
+import time
+
+from flask import current_app
+
+from ids import SEQUENCE_BITS
+from models import db, Follows, Message, TimelineEntry
+from pagination import PAGE_SIZE, keyset_page, make_page
+from workers import SharedFile, claim, release, run_in_background
+
+# how many messages we keep (or backfill) per timeline
+TIMELINE_LENGTH = 800
+
+logger = logging.getLogger(__name__)
+
+# how many of each author's newest message ids the "rings" backend keeps
+RING_LENGTH = 200
+
+# how often (seconds) the rings pick up messages posted through other hosts
+RING_SYNC_INTERVAL = 5
+
+# how far back (seconds of message ids) each re-sync looks: a message's id
+# comes from its transaction's start time, so it can commit late
+RING_SYNC_WINDOW = 60
+
+
+def follower_ids(user_id):
+    """Return ids of everyone following `user_id`."""
+
+    rows = (db.session
+            .query(Follows.user_following_id)
+            .filter(Follows.user_being_followed_id == user_id)
+            .all())
+    return [row[0] for row in rows]
+
+
+class SQLTimelineBackend:
+    """Timelines stored as rows in the `timeline_entries` table."""
+
+    def warm(self):
+        """Nothing to do; timelines live in the database."""
+
+    def start_warming(self, app):
+        """Nothing to do; timelines live in the database."""
+
+    def publish(self, message):
+        """Add a freshly-flushed `message` to its author's and followers' timelines."""
+
+        table = TimelineEntry.__table__
+
+        db.session.execute(table.insert().values(
+            user_id=message.user_id,
+            message_id=message.id,
+        ))
+
+        followers = (db
+                     .select([
+                         Follows.user_following_id,
+                         db.literal(message.id, db.BigInteger),
+                     ])
+                     .where(Follows.user_being_followed_id == message.user_id)
+                     .where(Follows.user_following_id != message.user_id))
+
+        db.session.execute(table.insert().from_select(
+            ['user_id', 'message_id'], followers))
+
+    def retract(self, message):
+        """Remove `message` from every timeline it was fanned out to."""
+
+        (TimelineEntry
+         .query
+         .filter(TimelineEntry.message_id == message.id)
+         .delete(synchronize_session=False))
+
+    def follow(self, follower_id, followed_id):
+        """Backfill `follower_id`'s timeline with `followed_id`'s recent messages."""
+
+        if follower_id == followed_id:
+            return
+
+        already_there = (db
+                         .exists()
+                         .where(TimelineEntry.user_id == follower_id)
+                         .where(TimelineEntry.message_id == Message.id))
+
+        recent = (db
+                  .select([db.literal(follower_id), Message.id])
+                  .where(Message.user_id == followed_id)
+                  .where(~already_there)
+                  .order_by(Message.id.desc())
+                  .limit(TIMELINE_LENGTH))
+
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'message_id'], recent))
+
+    def unfollow(self, follower_id, followed_id):
+        """Drop `followed_id`'s messages from `follower_id`'s timeline."""
+
+        if follower_id == followed_id:
+            return
+
+        their_messages = (db.session
+                          .query(Message.id)
+                          .filter(Message.user_id == followed_id))
+
+        (TimelineEntry
+         .query
+         .filter(TimelineEntry.user_id == follower_id,
+                 TimelineEntry.message_id.in_(their_messages.subquery()))
+         .delete(synchronize_session=False))
+
+    def drop_user(self, user_id):
+        """Forget `user_id`'s timeline (rows also cascade with the user)."""
+
+        (TimelineEntry
+         .query
+         .filter(TimelineEntry.user_id == user_id)
+         .delete(synchronize_session=False))
+
+    def page(self, user_id, before=None, per_page=PAGE_SIZE):
+        """Return a Page of `user_id`'s timeline, older than cursor `before`."""
+
+        query = (Message
+                 .listing('timeline')
+                 .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+                 .filter(TimelineEntry.user_id == user_id))
+
+        return keyset_page(query,
+                           TimelineEntry.message_id,
+                           before=before,
+                           per_page=per_page)
+
+    def rebuild(self, user_id):
+        """Recompute `user_id`'s timeline from the follows table."""
+
+        self.drop_user(user_id)
+
+        following = (db.session
+                     .query(Follows.user_being_followed_id)
+                     .filter(Follows.user_following_id == user_id))
+
+        recent = (db
+                  .select([db.literal(user_id), Message.id])
+                  .where(db.or_(Message.user_id == user_id,
+                                Message.user_id.in_(following.subquery())))
+                  .order_by(Message.id.desc())
+                  .limit(TIMELINE_LENGTH))
+
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'message_id'], recent))
+
+    def rebuild_all(self):
+        """Recompute every timeline in one pass (e.g. after seeding)."""
+
+        TimelineEntry.query.delete(synchronize_session=False)
+
+        own = db.select([Message.user_id, Message.id])
+        followed = (db
+                    .select([Follows.user_following_id, Message.id])
+                    .where(Follows.user_being_followed_id == Message.user_id))
+
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'message_id'], db.union(own, followed)))
+
+
+class MemoryTimelineBackend:
+    """Timelines kept as sorted lists of message ids in this process.
+
+    A timeline is loaded from the database the first time it's read; after
+    that, posts/follows/deletes made through this process keep it current.
+    """
+
+    def __init__(self, length=TIMELINE_LENGTH):
+        self.length = length
+        self._timelines = {}
+        self._lock = Lock()
+
+    def warm(self):
+        """Nothing to do; each timeline is loaded the first time it's read."""
+
+    def start_warming(self, app):
+        """Nothing to do; each timeline is loaded the first time it's read."""
+
+    def _load(self, user_id):
+        """Pull `user_id`'s timeline from the messages table."""
+
+        following = (db.session
+                     .query(Follows.user_being_followed_id)
+                     .filter(Follows.user_following_id == user_id))
+
+        rows = (db.session
+                .query(Message.id)
+                .filter(db.or_(Message.user_id == user_id,
+                               Message.user_id.in_(following.subquery())))
+                .order_by(Message.id.desc())
+                .limit(self.length)
+                .all())
+
+        return sorted(id for id, in rows)
+
+    def publish(self, message):
+        audience = [message.user_id] + follower_ids(message.user_id)
+
+        with self._lock:
+            for user_id in audience:
+                timeline = self._timelines.get(user_id)
+                if timeline is None:
+                    continue
+                insort(timeline, message.id)
+                del timeline[:-self.length]
+
+    def retract(self, message):
+        audience = [message.user_id] + follower_ids(message.user_id)
+
+        with self._lock:
+            for user_id in audience:
+                timeline = self._timelines.get(user_id)
+                if timeline is None:
+                    continue
+                idx = bisect_left(timeline, message.id)
+                if idx < len(timeline) and timeline[idx] == message.id:
+                    del timeline[idx]
+
+    def follow(self, follower_id, followed_id):
+        self.drop_user(follower_id)
+
+    def unfollow(self, follower_id, followed_id):
+        self.drop_user(follower_id)
+
+    def drop_user(self, user_id):
+        with self._lock:
+            self._timelines.pop(user_id, None)
+
+    def page(self, user_id, before=None, per_page=PAGE_SIZE):
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+
+        if timeline is None:
+            timeline = self._load(user_id)
+            with self._lock:
+                self._timelines.setdefault(user_id, timeline)
+
+        end = bisect_left(timeline, before) if before else len(timeline)
+        ids = timeline[max(0, end - per_page - 1):end][::-1]
+        if not ids:
+            return make_page([], per_page)
+
+        # rows deleted elsewhere simply drop out here
+        by_id = {msg.id: msg for msg in Message.listing('timeline').filter(Message.id.in_(ids))}
+        return make_page([by_id[id] for id in ids if id in by_id], per_page)
+
+    def rebuild(self, user_id):
+        self.drop_user(user_id)
+
+    def rebuild_all(self):
+        with self._lock:
+            self._timelines.clear()
+
+
+def _combine(ring, ids, length):
+    """The newest `length` of `ring` and `ids` together, oldest first.
+
+    Also returns whether the author may have older messages than that:
+    once `length` ids have been seen, there may be more.
+    """
+
+    if ring:
+        ids = sorted(set(ring).union(ids))
+
+    return array('q', ids[-length:]), len(ids) >= length
+
+
+class MemoryRings:
+    """Each author's ring as an array in this process.
+
+    A ring is "truncated" once its author may have older messages than it
+    holds; deletes don't undo that.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self._rings = {}
+        self._truncated = set()
+        self._ready = False
+        self._warming = False
+        self._lock = Lock()
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def claim(self):
+        """Is it the caller's job to warm the rings? (True at most once.)"""
+
+        with self._lock:
+            if self._ready or self._warming:
+                return False
+            self._warming = True
+            return True
+
+    def release(self):
+        with self._lock:
+            self._warming = False
+
+    def load(self, rings, replace=False):
+        """Merge `rings` (author id -> ids, oldest first) in, and mark them ready."""
+
+        with self._lock:
+            if replace:
+                self._rings = {}
+                self._truncated = set()
+            for author_id, ids in rings.items():
+                ring, truncated = _combine(self._rings.get(author_id), ids, self.length)
+                self._rings[author_id] = ring
+                if truncated:
+                    self._truncated.add(author_id)
+            self._ready = True
+            self._warming = False
+
+    def get(self, author_ids):
+        """(ring copy, truncated) for `author_ids` with anything to say."""
+
+        with self._lock:
+            return [(array('q', self._rings.get(id, ())), id in self._truncated)
+                    for id in author_ids
+                    if self._rings.get(id) or id in self._truncated]
+
+    def add(self, author_id, id):
+        with self._lock:
+            ring = self._rings.setdefault(author_id, array('q'))
+            idx = bisect_left(ring, id)
+            if idx < len(ring) and ring[idx] == id:
+                return
+            ring.insert(idx, id)
+            if len(ring) > self.length:
+                del ring[:-self.length]
+                self._truncated.add(author_id)
+
+    def remove(self, author_id, id):
+        with self._lock:
+            ring = self._rings.get(author_id)
+            if ring is None:
+                return
+            idx = bisect_left(ring, id)
+            if idx < len(ring) and ring[idx] == id:
+                del ring[idx]
+
+    def drop(self, author_id):
+        with self._lock:
+            self._rings.pop(author_id, None)
+            self._truncated.discard(author_id)
+
+
+class SharedRings:
+    """Each author's ring in files under `directory`, shared by every worker.
+
+    In `timeline_rings.idx`, a 64-byte header (ready flag, slots in use) is
+    followed by one 8-byte entry per author id: the author's slot number
+    plus one, or 0. `timeline_rings.dat` is the slots, each a count and a
+    truncated flag (see MemoryRings) followed by room for `length` ids.
+    """
+
+    HEADER_SIZE = 64
+
+    # authors' rings written per hold of the lock while warming
+    LOAD_BATCH = 1000
+
+    def __init__(self, directory, length):
+        self.length = length
+        self.slot_size = 8 * (2 + length)
+        self._index = SharedFile(os.path.join(directory, 'timeline_rings.idx'))
+        self._slots = SharedFile(os.path.join(directory, 'timeline_rings.dat'))
+        self._claim = os.path.join(directory, 'timeline_rings.warming')
+
+    @contextmanager
+    def _locked(self):
+        # the index's lock guards both files
+        with self._index.locked():
+            self._slots.refresh()
+            yield
+
+    @property
+    def ready(self):
+        with self._locked():
+            return struct.unpack_from('q', self._index.map, 0)[0] == 1
+
+    def claim(self):
+        """Is it the caller's job to warm the rings? (True for one process.)"""
+
+        return claim(self._claim)
+
+    def release(self):
+        release(self._claim)
+
+    def _offset(self, author_id, create=False):
+        """Where `author_id`'s slot starts in the slots file (None if it has none)."""
+
+        entry = self.HEADER_SIZE + 8 * author_id
+
+        if entry + 8 > len(self._index.map):
+            if not create:
+                return None
+            self._index.grow(entry + 8)
+
+        slot, = struct.unpack_from('q', self._index.map, entry)
+
+        if not slot:
+            if not create:
+                return None
+            slot = struct.unpack_from('q', self._index.map, 8)[0] + 1
+            struct.pack_into('q', self._index.map, 8, slot)
+            struct.pack_into('q', self._index.map, entry, slot)
+            self._slots.grow(slot * self.slot_size)
+            struct.pack_into('qq', self._slots.map, (slot - 1) * self.slot_size, 0, 0)
+
+        return (slot - 1) * self.slot_size
+
+    def _read(self, offset):
+        count, truncated = struct.unpack_from('qq', self._slots.map, offset)
+        ring = array('q')
+        ring.frombytes(self._slots.map[offset + 16:offset + 16 + 8 * count])
+        return ring, bool(truncated)
+
+    def _write(self, offset, ring, truncated):
+        struct.pack_into('qq', self._slots.map, offset, len(ring), truncated)
+        self._slots.map[offset + 16:offset + 16 + 8 * len(ring)] = ring.tobytes()
+
+    def load(self, rings, replace=False):
+        """Merge `rings` (author id -> ids, oldest first) in, and mark them ready."""
+
+        if replace:
+            with self._locked():
+                self._index.map[:] = bytes(len(self._index.map))
+
+        items = list(rings.items())
+
+        for start in range(0, len(items), self.LOAD_BATCH):
+            with self._locked():
+                for author_id, ids in items[start:start + self.LOAD_BATCH]:
+                    offset = self._offset(author_id, create=True)
+                    ring, truncated = self._read(offset)
+                    ring, dropped = _combine(ring, ids, self.length)
+                    self._write(offset, ring, truncated or dropped)
+
+        with self._locked():
+            struct.pack_into('q', self._index.map, 0, 1)
+
+    def get(self, author_ids):
+        """(ring copy, truncated) for `author_ids` with anything to say."""
+
+        rings = []
+
+        with self._locked():
+            for author_id in author_ids:
+                offset = self._offset(author_id)
+                if offset is not None:
+                    ring, truncated = self._read(offset)
+                    if ring or truncated:
+                        rings.append((ring, truncated))
+
+        return rings
+
+    def add(self, author_id, id):
+        with self._locked():
+            offset = self._offset(author_id, create=True)
+            ring, truncated = self._read(offset)
+            idx = bisect_left(ring, id)
+            if idx < len(ring) and ring[idx] == id:
+                return
+            ring.insert(idx, id)
+            self._write(offset, ring[-self.length:], truncated or len(ring) > self.length)
+
+    def remove(self, author_id, id):
+        with self._locked():
+            offset = self._offset(author_id)
+            if offset is None:
+                return
+            ring, truncated = self._read(offset)
+            idx = bisect_left(ring, id)
+            if idx < len(ring) and ring[idx] == id:
+                del ring[idx]
+                self._write(offset, ring, truncated)
+
+    def drop(self, author_id):
+        with self._locked():
+            offset = self._offset(author_id)
+            if offset is not None:
+                self._write(offset, array('q'), False)
+
+
+class AuthorRingTimelineBackend:
+    """Timelines merged on read from per-author rings of recent message ids.
+
+    Each author's newest `length` message ids are kept, oldest first, as an
+    array of 8-byte ids with the timestamp built in (see ids.py). A page
+    reads who the viewer follows, picks the rings whose newest id below the
+    cursor could make the page, heap-merges just those, and hydrates only
+    the ids on the page.
+
+    Given a `directory`, the rings are in files there that every worker on
+    the host shares (SharedRings); otherwise they're in this process. Either
+    way, whoever warmed them goes on to `sync()` them with the messages
+    table every `sync_interval` seconds, for posts made through other hosts.
+    Until they're warm, and for pages that reach past the oldest id of a
+    truncated ring, pages are queried from the messages table.
+    """
+
+    def __init__(self, length=RING_LENGTH, directory=None, sync_interval=RING_SYNC_INTERVAL):
+        self.length = length
+        self.sync_interval = sync_interval
+        self.rings = (SharedRings(directory, length) if directory
+                      else MemoryRings(length))
+
+    def _newest(self):
+        """Every author's newest `length` message ids, oldest first."""
+
+        newest = (db
+                  .select([
+                      Message.user_id,
+                      Message.id,
+                      db.func.row_number().over(partition_by=Message.user_id,
+                                                order_by=Message.id.desc()).label('n'),
+                  ])
+                  .alias())
+
+        rows = db.session.execute(db
+                                  .select([newest.c.user_id, newest.c.id])
+                                  .where(newest.c.n <= self.length)
+                                  .order_by(newest.c.user_id, newest.c.id))
+
+        rings = {}
+        for user_id, id in rows:
+            rings.setdefault(user_id, array('q')).append(id)
+
+        return rings
+
+    def warm(self):
+        """Load every author's ring from the messages table.
+
+        Posts and deletes made while this runs are kept. Returns the newest
+        message id loaded (0 if none), to `sync()` from.
+        """
+
+        rings = self._newest()
+        self.rings.load(rings)
+
+        return max((ids[-1] for ids in rings.values()), default=0)
+
+    def sync(self, newest):
+        """Add messages posted since id `newest`, through any host, to the rings.
+
+        Looks RING_SYNC_WINDOW seconds further back, for late commits.
+        Returns the newest message id seen, to pass in next time.
+        """
+
+        after = newest - (RING_SYNC_WINDOW * 1000 << SEQUENCE_BITS)
+
+        rows = db.session.execute(db
+                                  .select([Message.user_id, Message.id])
+                                  .where(Message.id > after)
+                                  .order_by(Message.id))
+
+        rings = {}
+        for user_id, id in rows:
+            rings.setdefault(user_id, []).append(id)
+            newest = max(newest, id)
+
+        self.rings.load(rings)
+
+        return newest
+
+    def start_warming(self, app):
+        """Warm the rings on a background thread, unless that's already been done.
+
+        The thread then keeps them in sync with the messages table.
+        """
+
+        if self.rings.claim():
+            run_in_background(app, self._warm_claimed, 'timeline-rings')
+
+    def _warm_claimed(self):
+        try:
+            newest = self.warm()
+        except Exception:
+            # let the next page try again
+            self.rings.release()
+            raise
+
+        while True:
+            # don't hold a connection between passes
+            db.session.remove()
+            time.sleep(self.sync_interval)
+
+            try:
+                newest = self.sync(newest)
+            except Exception:
+                logger.exception("syncing timeline rings failed")
+
+    def _followed(self, user_id):
+        """Ids of the authors `user_id` follows."""
+
+        rows = db.session.execute(db
+                                  .select([Follows.user_being_followed_id])
+                                  .where(Follows.user_following_id == user_id))
+
+        return [id for id, in rows]
+
+    def publish(self, message):
+        self.rings.add(message.user_id, message.id)
+
+    def retract(self, message):
+        self.rings.remove(message.user_id, message.id)
+
+    def follow(self, follower_id, followed_id):
+        """Nothing to do; follows are read with each page."""
+
+    def unfollow(self, follower_id, followed_id):
+        """Nothing to do; follows are read with each page."""
+
+    def drop_user(self, user_id):
+        """Forget `user_id`'s messages (they cascade with the user)."""
+
+        self.rings.drop(user_id)
+
+    def _merge(self, author_ids, before, limit):
+        """Newest `limit` ring ids older than `before`, and how far they're exact.
+
+        Returns (ids, floor): ids at or above `floor` are complete; below it,
+        some author may have older messages than their ring holds. Returns
+        (None, None) if the rings can't answer at all.
+        """
+
+        def head(ring):
+            """The newest id in `ring` older than `before` (0 if none)."""
+
+            end = bisect_left(ring, before)
+            return ring[end - 1] if end else 0
+
+        rings = self.rings.get(author_ids)
+
+        # deletes emptied a ring whose author has older messages
+        if any(truncated and not ring for ring, truncated in rings):
+            return None, None
+
+        # an author whose newest id is below `limit` others' can't make the page
+        newest = head if before else itemgetter(-1)
+        candidates = heapq.nlargest(limit, rings, key=lambda entry: newest(entry[0]))
+
+        slices = []
+        floor = None
+
+        for ring, truncated in candidates:
+            end = bisect_left(ring, before) if before else len(ring)
+            start = max(0, end - limit)
+            slices.append(ring[start:end])
+
+            if start == 0 and truncated:
+                floor = ring[0] if floor is None else max(floor, ring[0])
+
+        merged = heapq.merge(*(reversed(ids) for ids in slices), reverse=True)
+
+        return list(islice(merged, limit)), floor
+
+    def page(self, user_id, before=None, per_page=PAGE_SIZE):
+        author_ids = [user_id]
+        author_ids.extend(self._followed(user_id))
+
+        if self.rings.ready:
+            ids, floor = self._merge(author_ids, before, per_page + 1)
+        else:
+            self.start_warming(current_app._get_current_object())
+            ids, floor = None, None
+
+        if ids is None or (floor is not None and (len(ids) <= per_page or ids[-1] < floor)):
+            query = Message.listing('timeline').filter(Message.user_id.in_(author_ids))
+            return keyset_page(query, Message.id, before=before, per_page=per_page)
+
+        if not ids:
+            return make_page([], per_page)
+
+        # rows deleted elsewhere simply drop out here
+        by_id = {msg.id: msg for msg in Message.listing('timeline').filter(Message.id.in_(ids))}
+        return make_page([by_id[id] for id in ids if id in by_id], per_page)
+
+    def rebuild(self, user_id):
+        """Nothing to do; follows are read with each page."""
+
+    def rebuild_all(self):
+        """Reload every ring from scratch (e.g. after seeding)."""
+
+        self.rings.load(self._newest(), replace=True)
+
+
+BACKENDS = {
+    'sql': SQLTimelineBackend,
+    'memory': MemoryTimelineBackend,
+    'rings': AuthorRingTimelineBackend,
+}
+
+
+class TimelineStore:
+    """Front door to whichever timeline backend the app is configured with."""
+
+    def __init__(self):
+        self.backend = SQLTimelineBackend()
+
+    def init_app(self, app):
+        """Pick the backend named by app.config['TIMELINE_BACKEND']."""
+
+        name = app.config.setdefault('TIMELINE_BACKEND', 'sql')
+        directory = app.config.setdefault('SHARED_STATE_DIR', None)
+
+        if name == 'rings':
+            self.backend = AuthorRingTimelineBackend(directory=directory)
+        else:
+            self.backend = BACKENDS[name]()
+
+    def warm(self):
+        self.backend.warm()
+
+    def start_warming(self, app):
+        """Start warming the backend off the request path, if it needs it."""
+
+        self.backend.start_warming(app)
+
+    def publish(self, message):
+        self.backend.publish(message)
+
+    def retract(self, message):
+        self.backend.retract(message)
+
+    def follow(self, follower_id, followed_id):
+        self.backend.follow(follower_id, followed_id)
+
+    def unfollow(self, follower_id, followed_id):
+        self.backend.unfollow(follower_id, followed_id)
+
+    def drop_user(self, user_id):
+        self.backend.drop_user(user_id)
+
+    def page(self, user_id, before=None, per_page=PAGE_SIZE):
+        return self.backend.page(user_id, before=before, per_page=per_page)
+
+    def rebuild(self, user_id):
+        self.backend.rebuild(user_id)
+
+    def rebuild_all(self):
+        self.backend.rebuild_all()
+
+
+timeline_store = TimelineStore()
+
+
+def connect_timelines(app):
+    """Attach the timeline store to the Flask app."""
+
+    timeline_store.init_app(app)
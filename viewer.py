@@ -0,0 +1,68 @@
+"""Batched lookups of the current viewer's relationship to things on a page.
+
+Templates used to ask the viewer about each item in turn (e.g.
+`user.likes_message(msg.id)` per message), and each question scanned a
+whole collection. These helpers answer for the whole page in one query and
+hand templates a set to test membership against.
+"""
+
+from collections import namedtuple
+
+from models import db, Follows, Likes
+
+Relationship = namedtuple('Relationship', ['following', 'followed_by'])
+
+NOT_RELATED = Relationship(following=False, followed_by=False)
+
+
+class Relationships(dict):
+    """Map of user id -> Relationship; ids never looked up are NOT_RELATED."""
+
+    def __missing__(self, user_id):
+        return NOT_RELATED
+
+
+def liked_message_ids(viewer, messages):
+    """Return the set of ids, among `messages`, that `viewer` has liked."""
+
+    message_ids = [msg.id for msg in messages]
+
+    if viewer is None or not message_ids:
+        return set()
+
+    rows = (db.session
+            .query(Likes.message_id)
+            .filter(Likes.user_id == viewer.id,
+                    Likes.message_id.in_(message_ids))
+            .all())
+
+    return {row[0] for row in rows}
+
+
+def follow_relationships(viewer, user_ids):
+    """Return Relationships between `viewer` and each of `user_ids`.
+
+    Both directions come back from a single query against the follows
+    table, so a grid of user cards costs one round trip.
+    """
+
+    user_ids = list(user_ids)
+
+    if viewer is None or not user_ids:
+        return Relationships()
+
+    rows = (db.session
+            .query(Follows.user_following_id, Follows.user_being_followed_id)
+            .filter(db.or_(
+                db.and_(Follows.user_following_id == viewer.id,
+                        Follows.user_being_followed_id.in_(user_ids)),
+                db.and_(Follows.user_being_followed_id == viewer.id,
+                        Follows.user_following_id.in_(user_ids))))
+            .all())
+
+    following = {followed for follower, followed in rows if follower == viewer.id}
+    followed_by = {follower for follower, followed in rows if followed == viewer.id}
+
+    return Relationships(
+        (user_id, Relationship(user_id in following, user_id in followed_by))
+        for user_id in user_ids)
@@ -0,0 +1,196 @@
+"""State and background work shared by the gunicorn workers on one host.
+
+Some indexes (timeline rings, the availability filter) are kept in memory
+rather than queried per request. Built separately in each worker, they
+disagree with each other: a write through one worker isn't seen by the
+others. So when SHARED_STATE_DIR is set they live in memory-mapped files
+in that directory instead, and every worker on the host reads and writes
+the same copy. gunicorn.conf.py sets the directory and empties it each time
+the server starts.
+
+Building one of them takes a scan of a big table, so it's never done in a
+request: exactly one worker `claim()`s the job and runs it with
+`run_in_background()`, and until it's done callers answer from the
+database.
+
+Limits on expensive work (see hashing.py) are per host too: a
+`SharedSemaphore` of lock files in the same directory.
+"""
+
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock, Thread
+import fcntl
+import logging
+import mmap
+import os
+
+logger = logging.getLogger(__name__)
+
+# initial size of a shared file; files double whenever they run out of room
+SHARED_FILE_SIZE = 1024 * 64
+
+
+class SharedFile:
+    """A memory-mapped file at `path`, shared by every process that opens it.
+
+    Like metrics.MmapStore, a forked worker reopens the file for itself.
+    Whoever holds `locked()` may read and write `map`, and `grow()` it; other
+    processes pick up the new size the next time they take the lock.
+    """
+
+    def __init__(self, path, size=SHARED_FILE_SIZE):
+        self.path = path
+        self.size = size
+        self.map = None
+        self._pid = None
+        self._lock = Lock()
+
+    def _open(self):
+        self._pid = os.getpid()
+
+        with open(self.path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                f.truncate(self.size)
+
+        self._file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self._file.fileno(), 0)
+
+    def refresh(self):
+        """Open or remap the file as needed; call while holding a lock."""
+
+        if self._pid != os.getpid():
+            self._open()
+        elif os.fstat(self._file.fileno()).st_size != len(self.map):
+            self.map.close()
+            self.map = mmap.mmap(self._file.fileno(), 0)
+
+    def grow(self, needed):
+        """Make the file at least `needed` bytes long; call while holding the lock."""
+
+        size = len(self.map)
+        if size >= needed:
+            return
+
+        while size < needed:
+            size *= 2
+
+        self.map.close()
+        self._file.truncate(size)
+        self.map = mmap.mmap(self._file.fileno(), 0)
+
+    @contextmanager
+    def locked(self):
+        """Hold this file against other threads and processes."""
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield self.map
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+
+class LocalSemaphore:
+    """At most `count` holders of `slot()` at once, among this process's threads."""
+
+    def __init__(self, count):
+        self._semaphore = BoundedSemaphore(count) if count > 0 else None
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot if one is free, without waiting; yields whether one was."""
+
+        acquired = self._semaphore is not None and self._semaphore.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._semaphore.release()
+
+
+class SharedSemaphore:
+    """At most `count` holders of `slot()` at once, among every process on the host.
+
+    Each slot is a file `<name>.<n>` under `directory`, held with flock for
+    as long as it's in use, so a slot held by a process that dies is freed
+    with it.
+    """
+
+    def __init__(self, directory, name, count):
+        self.paths = [os.path.join(directory, f"{name}.{n}") for n in range(count)]
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot if one is free, without waiting; yields whether one was."""
+
+        for path in self.paths:
+            # a descriptor of our own, so other threads here can't share its lock
+            fd = os.open(path, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+
+            try:
+                yield True
+            finally:
+                os.close(fd)
+            return
+
+        yield False
+
+
+def claim(path):
+    """Try to take the one-off job named by the file at `path`.
+
+    Returns True for exactly one caller among every process on the host.
+    A claim left behind by a process that has since died is taken over.
+    """
+
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            with open(path) as f:
+                pid = int(f.read() or 0)
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            release(path)
+            return claim(path)
+        except (OSError, ValueError):
+            pass
+        return False
+
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(os.getpid()))
+
+    return True
+
+
+def release(path):
+    """Give up a claim, so someone else can take the job."""
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def run_in_background(app, fn, name):
+    """Call `fn` on a daemon thread, inside an app context for `app`."""
+
+    def run():
+        with app.app_context():
+            try:
+                fn()
+            except Exception:
+                logger.exception("%s failed", name)
+
+    thread = Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread